@@ -0,0 +1,178 @@
+"""Aggregates over a snapshot written by export.py.
+
+``Snapshot`` memory-maps the column files, so opening one is instant and
+the operating system pages in only the columns an aggregate touches. The
+aggregates are whole-column NumPy operations (bincount, searchsorted,
+unique) rather than Python loops or SQL:
+
+* ``star_histogram``: how many reviews gave each number of stars,
+  optionally in one state only,
+* ``state_averages``: businesses, reviews and average stars per state,
+* ``owner_portfolios``: per owner, businesses owned, the reviews they
+  have received and their average stars.
+
+Each review is joined to its business once per snapshot, through a table
+indexed by business id (or a binary search of the sorted ids when they
+are sparse); reviews whose business is not in the snapshot are ignored.
+
+    python analytics.py snapshot
+    python analytics.py snapshot --state CA --owners 20
+
+Needs numpy, which the API itself does not use:
+
+    pip install -r requirements-analytics.txt
+"""
+
+import argparse
+import json
+import os
+
+import numpy
+
+# Join through an id -> row table while the largest business id is below
+# this many times the number of businesses, else by binary search
+DENSE_LOOKUP_FACTOR = 8
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self._columns = {}
+        self._dictionaries = {}
+        self._business_index = None
+
+    def column(self, table, name):
+        """A read-only memory map of one column."""
+        key = (table, name)
+        if key not in self._columns:
+            self._columns[key] = numpy.load(os.path.join(self.path, table, name + '.npy'), mmap_mode='r')
+        return self._columns[key]
+
+    def dictionary(self, table, name):
+        """The values of a dictionary encoded column, indexed by code."""
+        key = (table, name)
+        if key not in self._dictionaries:
+            with open(os.path.join(self.path, table, name + '.dict.json')) as f:
+                self._dictionaries[key] = json.load(f)
+        return self._dictionaries[key]
+
+    def business_index(self):
+        """For each review, the row of its business, or -1 if not exported."""
+        if self._business_index is None:
+            business_ids = numpy.asarray(self.column('businesses', 'id'))
+            review_business_ids = self.column('reviews', 'business_id')
+            if len(business_ids) and business_ids[-1] < DENSE_LOOKUP_FACTOR * len(business_ids):
+                # Ids are compact enough for a table indexed by id, which
+                # is a plain gather instead of a binary search per review
+                lookup = numpy.full(int(business_ids[-1]) + 1, -1, dtype=numpy.int32)
+                lookup[business_ids] = numpy.arange(len(business_ids), dtype=numpy.int32)
+                valid = (review_business_ids >= 0) & (review_business_ids < len(lookup))
+                rows = numpy.full(len(review_business_ids), -1, dtype=numpy.int32)
+                rows[valid] = lookup[review_business_ids[valid]]
+            else:
+                rows = numpy.searchsorted(business_ids, review_business_ids)
+                found = rows < len(business_ids)
+                found[found] = business_ids[rows[found]] == review_business_ids[found]
+                rows = numpy.where(found, rows, -1)
+            self._business_index = rows
+        return self._business_index
+
+
+def _state_code(snapshot, state):
+    try:
+        return snapshot.dictionary('businesses', 'state').index(state.upper())
+    except ValueError:
+        return None
+
+
+def star_histogram(snapshot, state=None):
+    """{stars: number of reviews} for 1 to 5 stars."""
+    stars = snapshot.column('reviews', 'stars')
+    if state is not None:
+        code = _state_code(snapshot, state)
+        if code is None:
+            return {value: 0 for value in range(1, 6)}
+        rows = snapshot.business_index()
+        matched = rows >= 0
+        in_state = numpy.zeros(len(rows), dtype=bool)
+        in_state[matched] = snapshot.column('businesses', 'state')[rows[matched]] == code
+        stars = stars[in_state]
+    counts = numpy.bincount(stars, minlength=6)
+    return {value: int(counts[value]) for value in range(1, 6)}
+
+
+def state_averages(snapshot):
+    """[{state, businesses, reviews, average_stars}], most reviewed first."""
+    names = snapshot.dictionary('businesses', 'state')
+    businesses = numpy.bincount(snapshot.column('businesses', 'state'), minlength=len(names))
+    rows = snapshot.business_index()
+    matched = rows >= 0
+    states = snapshot.column('businesses', 'state')[rows[matched]]
+    stars = snapshot.column('reviews', 'stars')[matched]
+    reviews = numpy.bincount(states, minlength=len(names))
+    star_totals = numpy.bincount(states, weights=stars, minlength=len(names))
+    averages = numpy.divide(star_totals, reviews, out=numpy.full(len(names), numpy.nan), where=reviews > 0)
+    order = numpy.lexsort((numpy.arange(len(names)), -reviews))
+    return [{'state': names[code], 'businesses': int(businesses[code]), 'reviews': int(reviews[code]),
+             'average_stars': None if reviews[code] == 0 else round(float(averages[code]), 3)}
+            for code in order]
+
+
+def owner_portfolios(snapshot, limit=None):
+    """[{owner_id, businesses, reviews, average_stars}], most reviewed first.
+
+    Businesses without an owner are left out.
+    """
+    business_count = len(snapshot.column('businesses', 'id'))
+    rows = snapshot.business_index()
+    matched = rows >= 0
+    stars = snapshot.column('reviews', 'stars')[matched]
+    # Per business first, then per owner: two bincounts instead of a join
+    review_counts = numpy.bincount(rows[matched], minlength=business_count)
+    star_totals = numpy.bincount(rows[matched], weights=stars, minlength=business_count)
+
+    owner_ids = numpy.asarray(snapshot.column('businesses', 'owner_id'))
+    owned = owner_ids >= 0
+    owners, positions = numpy.unique(owner_ids[owned], return_inverse=True)
+    businesses = numpy.bincount(positions, minlength=len(owners))
+    reviews = numpy.bincount(positions, weights=review_counts[owned], minlength=len(owners))
+    totals = numpy.bincount(positions, weights=star_totals[owned], minlength=len(owners))
+    averages = numpy.divide(totals, reviews, out=numpy.full(len(owners), numpy.nan), where=reviews > 0)
+
+    order = numpy.lexsort((owners, -reviews))
+    if limit is not None:
+        order = order[:limit]
+    return [{'owner_id': int(owners[i]), 'businesses': int(businesses[i]), 'reviews': int(reviews[i]),
+             'average_stars': None if reviews[i] == 0 else round(float(averages[i]), 3)}
+            for i in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='directory written by export.py')
+    parser.add_argument('--state', help='limit the star histogram to one state')
+    parser.add_argument('--owners', type=int, default=10, help='how many owners to list')
+    args = parser.parse_args()
+
+    snapshot = Snapshot(args.path)
+    histogram = star_histogram(snapshot, args.state)
+    total = sum(histogram.values()) or 1
+    print('stars%s' % (' in %s' % args.state.upper() if args.state else ''))
+    for value, count in histogram.items():
+        print('  %d  %10d  %5.1f%%' % (value, count, count / total * 100))
+
+    print('\n%-6s %10s %10s %8s' % ('state', 'businesses', 'reviews', 'average'))
+    for row in state_averages(snapshot):
+        print('%-6s %10d %10d %8s' % (row['state'], row['businesses'], row['reviews'],
+                                      '-' if row['average_stars'] is None else '%.3f' % row['average_stars']))
+
+    print('\n%-10s %10s %10s %8s' % ('owner', 'businesses', 'reviews', 'average'))
+    for row in owner_portfolios(snapshot, args.owners):
+        print('%-10d %10d %10d %8s' % (row['owner_id'], row['businesses'], row['reviews'],
+                                       '-' if row['average_stars'] is None else '%.3f' % row['average_stars']))
+
+
+if __name__ == '__main__':
+    main()
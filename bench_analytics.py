@@ -0,0 +1,104 @@
+"""Analytics aggregates in SQL against the same aggregates on a snapshot.
+
+Runs the star histogram, the per-state averages and the owner portfolios
+as GROUP BY queries on a SQLite file and with analytics.py on a snapshot
+of it written by export.py, checks that both agree, and reports the time
+each took, plus the time of the export itself. The snapshot timings
+include opening it, so the columns come from the page cache rather than
+from memory already held by the process.
+
+Without --path a SQLite file with --reviews reviews is generated first.
+
+    python bench_analytics.py --reviews 1000000
+    python bench_analytics.py --path bench.db --repeat 5
+
+Needs the packages in requirements-analytics.txt.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import sqlalchemy
+
+import analytics
+import datagen
+import export
+import statements
+
+QUERIES = {
+    'star histogram': sqlalchemy.text(
+        'SELECT stars, COUNT(*) FROM reviews WHERE deleted_at IS NULL GROUP BY stars'),
+    'state averages': sqlalchemy.text(
+        'SELECT b.state, COUNT(*), AVG(r.stars) FROM reviews r '
+        'JOIN businesses b ON b.id = r.business_id AND b.deleted_at IS NULL '
+        'WHERE r.deleted_at IS NULL GROUP BY b.state'),
+    'owner portfolios': sqlalchemy.text(
+        'SELECT b.owner_id, COUNT(*), AVG(r.stars) FROM reviews r '
+        'JOIN businesses b ON b.id = r.business_id AND b.deleted_at IS NULL '
+        'WHERE r.deleted_at IS NULL AND b.owner_id IS NOT NULL GROUP BY b.owner_id'),
+}
+
+AGGREGATES = {
+    'star histogram': lambda snapshot: analytics.star_histogram(snapshot),
+    'state averages': lambda snapshot: analytics.state_averages(snapshot),
+    'owner portfolios': lambda snapshot: analytics.owner_portfolios(snapshot),
+}
+
+
+def same(name, rows, result):
+    if name == 'star histogram':
+        return dict(rows) == result
+    key = 'state' if name == 'state averages' else 'owner_id'
+    expected = {row[0]: (row[1], round(row[2], 3)) for row in rows}
+    return expected == {row[key]: (row['reviews'], row['average_stars']) for row in result if row['reviews']}
+
+
+def generate(path, n_reviews):
+    n_users = max(1, n_reviews // 10)
+    n_businesses = max(1, n_reviews // 50)
+    datagen.load_sqlite(path, [
+        (statements.users, datagen.generate_users(n_users, 0)),
+        (statements.businesses, datagen.generate_businesses(n_businesses, 0)),
+        (statements.reviews, datagen.generate_reviews(n_reviews, n_users, n_businesses, 0)),
+    ], 10000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', help='SQLite file loaded by datagen.py')
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'analytics.db')
+        generate(path, args.reviews)
+    engine = sqlalchemy.create_engine('sqlite:///' + path)
+    out = tempfile.mkdtemp()
+
+    start = time.perf_counter()
+    manifest = export.export(engine, out, args.batch_size)
+    print('export           %8.1f ms   %d reviews' % ((time.perf_counter() - start) * 1000,
+                                                      manifest['tables']['reviews']['rows']))
+
+    with engine.connect() as conn:
+        for name, query in QUERIES.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                rows = conn.execute(query).fetchall()
+            sql = (time.perf_counter() - start) / args.repeat
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                result = AGGREGATES[name](analytics.Snapshot(out))
+            snapshot = (time.perf_counter() - start) / args.repeat
+            assert same(name, rows, result), name
+            print('%-16s %8.1f ms SQL  %8.1f ms snapshot  %6.1fx'
+                  % (name, sql * 1000, snapshot * 1000, sql / snapshot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Datastore lookup RPCs saved by the entity cache on a read-heavy replay.
+
+Replays requests in-process against main1.py three times: with the
+per-request cache only, with a process LRU of --lru-size entities, and
+with both turned off as the baseline. Reports the lookup RPCs each run
+sent and how many keys the caches served. The requests come from capture
+files (see capture.py); without any, a synthetic mix is used: Zipf
+distributed GET /businesses/<id> over ids 1..--businesses, with one PUT
+of the same business in every --write-every requests.
+
+Needs Datastore, normally the emulator, holding data such as
+``python datagen.py datastore``, which creates businesses 1..n:
+
+    gcloud beta emulators datastore start &
+    $(gcloud beta emulators datastore env-init)
+    python datagen.py datastore --reviews 100000
+    python bench_entity_cache.py --businesses 2000 --requests 20000
+    python bench_entity_cache.py captures/requests-*.jsonl
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import random
+
+import main1
+import replay
+
+
+def synthetic(n_businesses, n_requests, write_every, seed=0):
+    rng = random.Random(seed)
+    popularity = list(itertools.accumulate(rank ** -1.1 for rank in range(1, n_businesses + 1)))
+    for i in range(n_requests):
+        business_id = bisect.bisect(popularity, rng.random() * popularity[-1]) + 1
+        if write_every and i % write_every == write_every - 1:
+            body = {'name': 'Renamed %d' % i, 'street_address': '1 Main Street', 'owner_id': 1,
+                    'city': 'Corvallis', 'state': 'OR', 'zip_code': 97330}
+            yield {'method': 'PUT', 'path': '/businesses/%d' % business_id,
+                   'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+        else:
+            yield {'method': 'GET', 'path': '/businesses/%d' % business_id, 'headers': {}}
+
+
+def run(entries, context, lru_size, ttl):
+    main1._client = None
+    main1.ENTITY_CACHE_SIZE = lru_size
+    main1.ENTITY_CACHE_TTL = ttl
+    client = main1.get_client()
+    client.context = context
+    http = main1.app.test_client()
+    for entry in entries:
+        http.open(entry['path'], method=entry['method'], headers=entry.get('headers', {}),
+                  data=replay.body_of(entry))
+    return client.lookups, client.hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='*')
+    parser.add_argument('--businesses', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--write-every', type=int, default=20)
+    parser.add_argument('--lru-size', type=int, default=10000)
+    parser.add_argument('--ttl', type=float, default=30)
+    args = parser.parse_args()
+
+    if args.captures:
+        entries = replay.load_capture(args.captures)
+    else:
+        entries = list(synthetic(args.businesses, args.requests, args.write_every))
+
+    baseline = None
+    for label, context, lru_size in [('no cache', False, 0),
+                                     ('request cache', True, 0),
+                                     ('request + LRU', True, args.lru_size)]:
+        lookups, hits = run(entries, context, lru_size, args.ttl)
+        baseline = baseline or lookups
+        print('%-14s %8d lookup RPCs  %8d cache hits  %6.1f%% fewer RPCs'
+              % (label, lookups, hits, (1 - lookups / baseline) * 100))
+
+
+if __name__ == '__main__':
+    main()
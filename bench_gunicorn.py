@@ -0,0 +1,165 @@
+"""Throughput and latency of gunicorn worker configurations.
+
+Starts gunicorn with gunicorn.conf.py for each configuration, overriding
+the worker class, workers and threads from the environment, and serves
+main.py against a SQLite file whose queries are slowed down to stand in for
+Cloud SQL round trips. Concurrent clients then hit GET /businesses/<id>.
+
+    python bench_gunicorn.py --clients 32 --seconds 5 --query-ms 5
+
+This module is also the app gunicorn loads (bench_gunicorn:app).
+"""
+
+import argparse
+import http.client
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import sqlalchemy
+
+import main as api
+import statements
+from connect_connector import POOL_SIZE, MAX_OVERFLOW, POOL_TIMEOUT
+
+CONFIGS = [
+    # (worker class, workers, threads)
+    ('gthread', 1, 1),
+    ('gthread', 1, POOL_SIZE + MAX_OVERFLOW),
+    ('gthread', 2, POOL_SIZE + MAX_OVERFLOW),
+    ('gthread', 4, POOL_SIZE + MAX_OVERFLOW),
+    ('gevent', 2, 1),
+]
+
+
+def sqlite_pool():
+    engine = sqlalchemy.create_engine('sqlite:///' + os.environ['BENCH_DB'], pool_size=POOL_SIZE,
+                                      max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT,
+                                      connect_args={'check_same_thread': False})
+    query_time = float(os.environ.get('BENCH_QUERY_MS', 5)) / 1000
+
+    @sqlalchemy.event.listens_for(engine, 'before_cursor_execute')
+    def round_trip(*args):
+        time.sleep(query_time)
+
+    return engine
+
+
+if 'BENCH_DB' in os.environ:
+    # Loaded by gunicorn: gunicorn.conf.py calls init_db() in each worker
+    api.init_connection_pool = sqlite_pool
+app = api.app
+
+
+def setup_database(path):
+    engine = sqlalchemy.create_engine('sqlite:///' + path)
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_BUSINESS, parameters={
+            'name': 'b', 'street_address': 'street', 'owner_id': 1,
+            'city': 'city', 'state': 'OR', 'zip_code': 97000})
+        conn.commit()
+    engine.dispose()
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/businesses/1')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def load(port, clients, seconds):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', '/businesses/1')
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except OSError:
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            if ok:
+                mine.append((time.perf_counter() - start) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--query-ms', type=float, default=5)
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    setup_database(path)
+
+    for worker_class, workers, threads in CONFIGS:
+        name = '%s %dx%d' % (worker_class, workers, threads)
+        if worker_class == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print('%-14s skipped, gevent is not installed' % name)
+                continue
+        env = dict(os.environ, BENCH_DB=path, BENCH_QUERY_MS=str(args.query_ms), PORT=str(args.port),
+                   GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+                   # Measure the workers, not the load shedding
+                   SHED_QUEUE_DEPTH='1000000', SHED_MAX_WAIT_MS='1000000')
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'bench_gunicorn:app'],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_until_up(args.port):
+                print('%-14s failed to start' % name)
+                continue
+            latencies, errors = load(args.port, args.clients, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        if not latencies:
+            print('%-14s no successful requests, %d errors' % (name, errors))
+            continue
+        print('%-14s %7.0f req/s  p50 %6.1f ms  p99 %7.1f ms  errors %d'
+              % (name, len(latencies) / args.seconds, percentile(latencies, 50), percentile(latencies, 99), errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Top-k reads from the in-memory leaderboard against an aggregate query.
+
+Times, on data from datagen.py:
+
+* the bulk load of a Leaderboard from business_ratings (what every process
+  does on startup),
+* Leaderboard.top() for the states and cities with the most businesses,
+* the same ranking computed by SQL from every review of the state, which
+  is what a homepage without the leaderboard has to run,
+* moving one business on its boards after a rating change.
+
+Without --path a SQLite file with --reviews reviews is generated first.
+
+    python bench_leaderboard.py --reviews 1000000 --reads 100000
+    python bench_leaderboard.py --path bench.db
+"""
+
+import argparse
+import collections
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy
+
+import datagen
+import statements
+from leaderboard import Leaderboard
+
+# The Bayesian average straight from the reviews table
+AGGREGATE_TOP = sqlalchemy.text(
+    'SELECT b.id, (:m * :prior + SUM(r.stars)) / (:m + COUNT(*)) AS score '
+    'FROM businesses b JOIN reviews r ON r.business_id = b.id AND r.deleted_at IS NULL '
+    'WHERE b.state = :state AND b.deleted_at IS NULL '
+    'GROUP BY b.id HAVING COUNT(*) >= :m ORDER BY score DESC, b.id LIMIT :k')
+
+Rating = collections.namedtuple('Rating', 'id name city state review_count star_total')
+
+
+def generate(path, n_reviews):
+    n_users = max(1, n_reviews // 10)
+    n_businesses = max(1, n_reviews // 50)
+    datagen.load_sqlite(path, [
+        (statements.users, datagen.generate_users(n_users, 0)),
+        (statements.businesses, datagen.generate_businesses(n_businesses, 0)),
+        (statements.reviews, datagen.generate_reviews(n_reviews, n_users, n_businesses, 0)),
+    ], 10000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', help='SQLite file loaded by datagen.py')
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--reads', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=100000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--min-reviews', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'leaderboard.db')
+        generate(path, args.reviews)
+    engine = sqlalchemy.create_engine('sqlite:///' + path)
+
+    board = Leaderboard(engine, min_reviews=args.min_reviews)
+    start = time.perf_counter()
+    ranked = board.load()
+    print('load             %8.1f ms   %d ranked businesses' % ((time.perf_counter() - start) * 1000, ranked))
+
+    states = sorted((name for name in board._boards if isinstance(name, str)),
+                    key=lambda name: -len(board._boards[name]))[:5]
+    cities = sorted((name for name in board._boards if not isinstance(name, str)),
+                    key=lambda name: -len(board._boards[name]))[:5]
+
+    for label, names, top in [('top() by state', states, lambda name: board.top(name, k=args.k)),
+                              ('top() by city', cities, lambda name: board.top(name[0], name[1], k=args.k))]:
+        start = time.perf_counter()
+        for i in range(args.reads):
+            top(names[i % len(names)])
+        print('%-16s %8.2f us' % (label, (time.perf_counter() - start) / args.reads * 1e6))
+
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for i in range(args.queries):
+            expected = conn.execute(AGGREGATE_TOP, {'m': args.min_reviews, 'prior': board.prior_mean,
+                                                    'state': states[i % len(states)], 'k': args.k}).fetchall()
+        print('SQL aggregate    %8.2f ms' % ((time.perf_counter() - start) / args.queries * 1000))
+        # Both rank the same businesses
+        assert [row.id for row in expected] == [entry['id'] for entry in board.top(states[(args.queries - 1) % len(states)],
+                                                                                    k=args.k)]
+
+    rng = random.Random(0)
+    entries = [entry for _, _, entry in board._entries.values()]
+    start = time.perf_counter()
+    for _ in range(args.updates):
+        entry = rng.choice(entries)
+        review_count = entry['review_count'] + 1
+        star_total = round(entry['average_stars'] * entry['review_count']) + rng.randint(1, 5)
+        board._apply([entry['id']], [Rating(entry['id'], entry['name'], entry['city'], entry['state'],
+                                            review_count, star_total)])
+    print('update           %8.2f us' % ((time.perf_counter() - start) / args.updates * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Latency per write: SELECT-then-mutate vs a single rowcount-checked statement.
+
+Each statement sent to the database is charged a simulated network round
+trip (--rtt-ms), which is what separates the two patterns against Cloud SQL.
+
+    python bench_mutations.py --writes 500 --rtt-ms 0.5
+"""
+
+import argparse
+import time
+
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+import statements
+
+
+def make_engine(rtt, n_reviews):
+    engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool)
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_BUSINESS, parameters={
+            'name': 'b', 'street_address': 'street', 'owner_id': 1,
+            'city': 'city', 'state': 'OR', 'zip_code': 97000})
+        # Review 1 is updated; each delete run removes its own set of reviews
+        conn.execute(statements.INSERT_REVIEW, [
+            {'user_id': i, 'business_id': 1, 'stars': 3, 'review_text': 'text', 'created_at': time.time()}
+            for i in range(n_reviews)])
+        conn.commit()
+
+    @sqlalchemy.event.listens_for(engine, 'before_cursor_execute')
+    def round_trip(*args):
+        time.sleep(rtt)
+
+    return engine
+
+
+def select_then_update(conn, i):
+    row = conn.execute(statements.SELECT_REVIEW, parameters={'review_id': 1}).one_or_none()
+    if row is None:
+        return None
+    conn.execute(statements.UPDATE_REVIEW, parameters={'stars': i % 5 + 1, 'b_review_text': row.review_text, 'review_id': 1,
+                                                       'updated_at': time.time()})
+    conn.commit()
+    return row
+
+
+def update_rowcount(conn, i):
+    if conn.dialect.update_returning:
+        row = conn.execute(statements.UPDATE_REVIEW_RETURNING, parameters={'stars': i % 5 + 1, 'b_review_text': None, 'review_id': 1,
+                                                                              'updated_at': time.time()}).one_or_none()
+    else:
+        row = conn.execute(statements.UPDATE_REVIEW, parameters={'stars': i % 5 + 1, 'b_review_text': None, 'review_id': 1,
+                                                                  'updated_at': time.time()}).rowcount
+    conn.commit()
+    return row
+
+
+def select_then_delete(conn, i):
+    if conn.execute(statements.SELECT_REVIEW, parameters={'review_id': i + 2}).one_or_none() is None:
+        return None
+    conn.execute(statements.DELETE_REVIEW, parameters={'review_id': i + 2})
+    conn.commit()
+
+
+def delete_rowcount(conn, i, offset=0):
+    rowcount = conn.execute(statements.DELETE_REVIEW, parameters={'review_id': i + 2 + offset}).rowcount
+    conn.commit()
+    return rowcount
+
+
+def timed(engine, fn, n):
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for i in range(n):
+            fn(conn, i)
+        return (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--rtt-ms', type=float, default=0.5)
+    args = parser.parse_args()
+
+    engine = make_engine(args.rtt_ms / 1000, 2 * args.writes + 1)
+    for name, fn in [('update_review: SELECT + UPDATE', select_then_update),
+                     ('update_review: UPDATE rowcount', update_rowcount),
+                     ('delete_review: SELECT + DELETE', select_then_delete),
+                     ('delete_review: DELETE rowcount',
+                      lambda conn, i: delete_rowcount(conn, i, offset=args.writes))]:
+        print('%-32s %7.3f ms/write' % (name, timed(engine, fn, args.writes)))
+
+
+if __name__ == '__main__':
+    main()
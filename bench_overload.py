@@ -0,0 +1,105 @@
+"""Latency under overload with and without pool-aware load shedding.
+
+Runs the app against a small SQLite pool whose queries are slowed down to
+mimic a saturated database, then hits GET /businesses/<id> from more
+threads than the pool has connections. Without shedding every request
+queues for a connection and the tail grows towards pool_timeout; with it the
+excess is answered at once with a 503 and admitted requests keep a bounded
+p99.
+
+    python bench_overload.py --threads 32 --requests 20 --query-ms 20
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import threading
+import time
+
+import sqlalchemy
+
+import main as api
+import statements
+
+
+def make_engine(path, pool_size, pool_timeout, query_time):
+    engine = sqlalchemy.create_engine('sqlite:///' + path, pool_size=pool_size, max_overflow=0,
+                                      pool_timeout=pool_timeout, connect_args={'check_same_thread': False})
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_BUSINESS, parameters={
+            'name': 'b', 'street_address': 'street', 'owner_id': 1,
+            'city': 'city', 'state': 'OR', 'zip_code': 97000})
+        conn.commit()
+
+    @sqlalchemy.event.listens_for(engine, 'before_cursor_execute')
+    def slow_query(*args):
+        time.sleep(query_time)
+
+    return engine
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def run(app, threads, requests):
+    latencies = {}
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for _ in range(requests):
+            start = time.perf_counter()
+            status = client.get('/businesses/1').status_code
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.setdefault(status, []).append(elapsed)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, time.perf_counter() - start
+
+
+def report(name, latencies, elapsed):
+    for status, values in sorted(latencies.items()):
+        print('%-12s %d: %5d requests  p50 %7.1f ms  p99 %7.1f ms  max %7.1f ms'
+              % (name, status, len(values), percentile(values, 50), percentile(values, 99), max(values)))
+    print('%-12s %.1f s wall' % (name, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help='requests per thread')
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--pool-timeout', type=float, default=5)
+    parser.add_argument('--query-ms', type=float, default=20)
+    parser.add_argument('--queue-depth', type=int, default=4)
+    parser.add_argument('--max-wait-ms', type=float, default=100)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = api.create_app(engine=make_engine(path, args.pool_size, args.pool_timeout, args.query_ms / 1000))
+
+    # The app's controller was sized from the environment; size it for this pool
+    admission = app.extensions['api'].admission
+    admission.capacity = args.pool_size
+
+    admission.max_queue_depth = admission.max_wait = float('inf')
+    report('no shedding', *run(app, args.threads, args.requests))
+
+    admission.max_queue_depth = args.queue_depth
+    admission.max_wait = args.max_wait_ms / 1000
+    admission.wait_ewma = 0.0
+    report('shedding', *run(app, args.threads, args.requests))
+
+
+if __name__ == '__main__':
+    main()
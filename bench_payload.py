@@ -0,0 +1,91 @@
+"""Wire size and CPU cost of list responses by link style and encoding.
+
+Renders a page of businesses and of reviews with full, relative and compact
+links, then compresses each body with gzip at several levels (and brotli
+when it is installed), reporting bytes on the wire and milliseconds per
+response.
+
+    python bench_payload.py --entries 100 --repeat 200
+"""
+
+import argparse
+import json
+import time
+
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+import compression
+import statements
+from mappers import (BUSINESS_FIELDS, REVIEW_FIELDS, business_columns, business_to_json,
+                     compact_fields, review_columns, review_to_json)
+
+URL_ROOT = 'https://business-review-api.uc.r.appspot.com/'
+
+
+def load_rows(n):
+    engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool)
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_BUSINESS, [
+            {'name': 'Business %d' % i, 'street_address': '%d Main Street' % i, 'owner_id': i % 10,
+             'city': 'Corvallis', 'state': 'OR', 'zip_code': 97330 + i % 10}
+            for i in range(n)])
+        conn.execute(statements.INSERT_REVIEW, [
+            {'user_id': 1, 'business_id': i + 1, 'stars': i % 5 + 1,
+             'review_text': 'Friendly staff and quick service.', 'created_at': time.time()}
+            for i in range(n)])
+        conn.commit()
+        businesses = conn.execute(statements.select_businesses_page(business_columns()),
+                                  {'limit': n, 'offset': 0}).fetchall()
+        reviews = conn.execute(statements.select_user_reviews(review_columns()),
+                               parameters={'user_id': 1}).fetchall()
+    return businesses, reviews
+
+
+def render(rows, to_json, all_fields, links):
+    if links == 'compact':
+        entries = [to_json(row, None, compact_fields(all_fields)) for row in rows]
+        body = {'base': URL_ROOT, 'entries': entries}
+    else:
+        entries = [to_json(row, URL_ROOT if links == 'full' else '/', all_fields) for row in rows]
+        body = entries
+    # Flask's default JSON provider writes compact separators too
+    return json.dumps(body, separators=(',', ':')).encode()
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    businesses, reviews = load_rows(args.entries)
+    encodings = [('identity', None)] + [('gzip -%d' % level, (compression.GZIP, level)) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        encodings += [('br q%d' % (level + 1), (compression.BROTLI, level)) for level in (3, 6)]
+    else:
+        print('(brotli is not installed, skipping it)')
+
+    for name, rows, to_json, fields in (('businesses', businesses, business_to_json, BUSINESS_FIELDS),
+                                        ('reviews', reviews, review_to_json, REVIEW_FIELDS)):
+        for links in ('full', 'relative', 'compact'):
+            body, render_ms = timed(lambda: render(rows, to_json, fields, links), args.repeat)
+            for label, encoding in encodings:
+                if encoding is None:
+                    wire, compress_ms = body, 0.0
+                else:
+                    wire, compress_ms = timed(lambda: compression.compress(body, *encoding), args.repeat)
+                print('%-10s %-8s %-9s %7d bytes  render %6.3f ms  compress %6.3f ms'
+                      % (name, links, label, len(wire), render_ms, compress_ms))
+
+
+if __name__ == '__main__':
+    main()
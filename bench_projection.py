@@ -0,0 +1,62 @@
+"""Bytes and latency for list endpoints: full rows vs a ?fields= projection.
+
+Serves GET /users/<id>/reviews from main.py against an in-memory SQLite
+database holding reviews with long review_text values.
+
+    python bench_projection.py --reviews 500 --requests 200
+"""
+
+import argparse
+import time
+
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+import main as api
+import statements
+
+
+def seed(engine, n_reviews):
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_BUSINESS, parameters={
+            'name': 'b', 'street_address': 'street', 'owner_id': 1,
+            'city': 'city', 'state': 'OR', 'zip_code': 97000})
+        conn.execute(statements.INSERT_REVIEW, [
+            {'user_id': 1, 'business_id': 1, 'stars': i % 5 + 1, 'review_text': 'x' * 1000, 'created_at': time.time()}
+            for i in range(n_reviews)])
+        conn.commit()
+
+
+def db_bytes(engine, fields):
+    # Size of the column values fetched from the database for one request
+    stmt = statements.select_user_reviews(api.review_columns(fields))
+    with engine.connect() as conn:
+        rows = conn.execute(stmt, parameters={'user_id': 1}).fetchall()
+    return sum(len(str(value)) for row in rows for value in row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool,
+                                      connect_args={'check_same_thread': False})
+    seed(engine, args.reviews)
+    client = api.create_app(engine=engine).test_client()
+
+    for label, query in [('all fields', ''),
+                         ('fields=id,stars,business', '?fields=id,stars,business')]:
+        fields = api.parse_fields(query.partition('=')[2] or None, api.REVIEW_FIELDS)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            response = client.get('/users/1/reviews' + query)
+        elapsed = (time.perf_counter() - start) / args.requests * 1000
+        print('%-26s db %9d B  response %9d B  %7.2f ms/request'
+              % (label, db_bytes(engine, fields), len(response.data), elapsed))
+
+
+if __name__ == '__main__':
+    main()
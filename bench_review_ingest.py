@@ -0,0 +1,121 @@
+"""Reviews per second: one commit per review vs the group-commit writer.
+
+Runs against a throwaway SQLite file so every commit pays for an fsync,
+which is the cost group commit amortises. Every mode is timed until the
+last review is committed, so ack-on-enqueue includes draining the queue
+rather than just filling it.
+
+    python bench_review_ingest.py --reviews 5000 --threads 64
+    python bench_review_ingest.py --threads 1 2 8 64
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import sqlalchemy
+
+import changes
+import statements
+from review_writer import ReviewWriter
+
+
+
+def make_engine(path):
+    engine = sqlalchemy.create_engine('sqlite:///' + path, pool_size=16, max_overflow=0)
+
+    # The same durability for every mode: an fsync per commit
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def synchronous_full(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA synchronous=FULL')
+
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text('PRAGMA journal_mode=WAL'))
+        conn.commit()
+    statements.metadata.create_all(engine, tables=[statements.reviews, statements.business_ratings,
+                                                   statements.changes])
+    return engine
+
+
+def run_threads(n_reviews, n_threads, work, finish=None):
+    """Reviews per second, from the first submission until finish() returns."""
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(offset, n_reviews, n_threads):
+                work(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if finish is not None and not errors:
+        finish()
+    elapsed = time.perf_counter() - start
+    # A failed write would make the rate meaningless
+    if errors:
+        raise errors[0]
+    return n_reviews / elapsed
+
+
+def bench_direct(engine, n_reviews, n_threads):
+    def work(i):
+        with engine.connect() as conn:
+            result = conn.execute(statements.INSERT_REVIEW, parameters={'user_id': i, 'business_id': 1,
+                                                                        'stars': 5, 'review_text': 'x' * 200,
+                                                                        'created_at': time.time()})
+            changes.record_change(conn, changes.ENTITY_REVIEW, result.lastrowid, changes.OP_CREATE)
+            conn.commit()
+    return run_threads(n_reviews, n_threads, work)
+
+
+def bench_buffered(engine, n_reviews, n_threads, ack_commit):
+    writer = ReviewWriter(engine)
+    writer.start()
+    futures = []
+
+    def work(i):
+        writer.claim(i, 1)
+        future = writer.submit(i, 1, 5, 'x' * 200)
+        futures.append(future)
+        if ack_commit:
+            future.result()
+
+    def finish():
+        # Acknowledged on enqueue, so the reviews are committed (or failed) only now
+        writer.close()
+        for future in futures:
+            future.result(timeout=0)
+
+    return run_threads(n_reviews, n_threads, work, finish)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reviews', type=int, default=2000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 64])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [
+            ('direct (commit per review)', bench_direct),
+            ('buffered, ack-on-commit', lambda e, n, t: bench_buffered(e, n, t, True)),
+            ('buffered, ack-on-enqueue', lambda e, n, t: bench_buffered(e, n, t, False)),
+        ]
+        for n_threads in args.threads:
+            for i, (name, fn) in enumerate(runs):
+                engine = make_engine(os.path.join(tmp, 'bench%d-%d.db' % (n_threads, i)))
+                print('%3d threads  %-28s %10.0f reviews/s committed'
+                      % (n_threads, name, fn(engine, args.reviews, n_threads)))
+                engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
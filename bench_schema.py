@@ -0,0 +1,110 @@
+"""Table size and scan speed of the old and the compact reviews schema.
+
+Loads the same reviews into two SQLite files: one with the original DDL
+(INTEGER stars, inline VARCHAR review_text, INTEGER zip codes) and one
+built from statements.metadata (SMALLINT stars with a CHECK, CHAR zip
+codes, compressed review_text). Reports file size and the time of a scan
+that only needs the hot columns and of one that reads every review_text.
+
+    python bench_schema.py --reviews 10000000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy
+
+import statements
+
+OLD_DDL = (
+    'CREATE TABLE businesses (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL, '
+    'street_address VARCHAR(100) NOT NULL, owner_id INTEGER, city VARCHAR(50) NOT NULL, '
+    'state TEXT NOT NULL, zip_code INTEGER NOT NULL)',
+    'CREATE TABLE reviews (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, business_id INTEGER NOT NULL, '
+    'stars INTEGER NOT NULL, review_text VARCHAR(1000))',
+)
+
+WORDS = ('the food was great friendly staff service slow quick clean dirty price fair '
+         'expensive cheap will come back again never recommend highly parking easy hard '
+         'coffee pizza tacos burgers noodles portions small large atmosphere cozy loud').split()
+
+
+def review_texts(n, seed):
+    rng = random.Random(seed)
+    for _ in range(n):
+        length = min(1000, int(rng.paretovariate(1.5) * 60))
+        words = []
+        size = 0
+        while size < length:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        yield ' '.join(words)[:1000]
+
+
+def load(engine, old, n_reviews, n_businesses, batch_size=10000):
+    with engine.connect() as conn:
+        if old:
+            for ddl in OLD_DDL:
+                conn.execute(sqlalchemy.text(ddl))
+            businesses = sqlalchemy.table('businesses', *[sqlalchemy.column(c) for c in (
+                'name', 'street_address', 'owner_id', 'city', 'state', 'zip_code')])
+            reviews = sqlalchemy.table('reviews', *[sqlalchemy.column(c) for c in (
+                'user_id', 'business_id', 'stars', 'review_text')])
+        else:
+            statements.metadata.create_all(conn)
+            businesses, reviews = statements.businesses, statements.reviews
+        conn.execute(sqlalchemy.insert(businesses), [
+            {'name': 'Business %d' % i, 'street_address': '%d Main Street' % i, 'owner_id': i % 100,
+             'city': 'Corvallis', 'state': 'OR', 'zip_code': 97330 + i % 10}
+            for i in range(n_businesses)])
+        rng = random.Random(1)
+        batch = []
+        for text in review_texts(n_reviews, 0):
+            batch.append({'user_id': rng.randrange(n_reviews // 10 + 1), 'business_id': rng.randrange(n_businesses) + 1,
+                          'stars': rng.randint(1, 5), 'review_text': text})
+            if len(batch) == batch_size:
+                conn.execute(sqlalchemy.insert(reviews), batch)
+                batch = []
+        if batch:
+            conn.execute(sqlalchemy.insert(reviews), batch)
+        conn.commit()
+    return reviews
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--businesses', type=int, default=10000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    for old in (True, False):
+        name = 'old schema' if old else 'compact'
+        path = os.path.join(directory, 'old.db' if old else 'compact.db')
+        engine = sqlalchemy.create_engine('sqlite:///' + path)
+        start = time.perf_counter()
+        reviews = load(engine, old, args.reviews, args.businesses)
+        load_time = time.perf_counter() - start
+
+        with engine.connect() as conn:
+            hot_scan = timed(lambda: conn.execute(sqlalchemy.text(
+                'SELECT business_id, AVG(stars) FROM reviews GROUP BY business_id')).fetchall())
+            text_scan = timed(lambda: sum(len(text) for text in conn.execute(
+                sqlalchemy.select(reviews.c.review_text)).scalars()))
+        engine.dispose()
+        print('%-10s %8.1f MB  load %6.1f s  stars scan %6.2f s  text scan %6.2f s'
+              % (name, os.path.getsize(path) / 1e6, load_time, hot_scan, text_scan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Read and delete latency with soft deletes.
+
+Reads: GET /users/<id>/reviews as a statement, against tables where a
+growing share of the rows are tombstones, once with the partial
+``reviews_user_live`` index and once with a plain index on user_id that
+has to visit every tombstone and filter it out.
+
+Deletes: a hard DELETE of one review against setting its deleted_at.
+
+    python bench_soft_delete.py --users 200 --reviews-per-user 50
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy
+
+import statements
+from mappers import review_columns
+
+
+def make_engine(path, users, per_user, tombstoned, partial):
+    engine = sqlalchemy.create_engine('sqlite:///' + path)
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        if not partial:
+            conn.execute(sqlalchemy.text('DROP INDEX reviews_user_live'))
+            conn.execute(sqlalchemy.text('CREATE INDEX reviews_user ON reviews (user_id)'))
+        conn.execute(statements.INSERT_BUSINESS, parameters={
+            'name': 'b', 'street_address': 'street', 'owner_id': 1,
+            'city': 'city', 'state': 'OR', 'zip_code': 97000})
+        conn.execute(statements.INSERT_REVIEW, [
+            {'user_id': user, 'business_id': 1, 'stars': 3, 'review_text': 'Friendly staff and quick service.',
+             'created_at': time.time()}
+            for _ in range(per_user) for user in range(users)])
+        ids = conn.execute(sqlalchemy.select(statements.reviews.c.id)).scalars().all()
+        dead = random.Random(0).sample(ids, int(len(ids) * tombstoned))
+        if dead:
+            conn.execute(statements.SOFT_DELETE_REVIEWS, parameters={'review_ids': dead, 'deleted_at': time.time()})
+        conn.commit()
+    return engine
+
+
+def time_reads(engine, users, n):
+    stmt = statements.select_user_reviews(review_columns())
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        for i in range(n):
+            conn.execute(stmt, parameters={'user_id': i % users}).fetchall()
+        return (time.perf_counter() - start) / n * 1000
+
+
+def time_deletes(engine, n, soft):
+    with engine.connect() as conn:
+        live = conn.execute(sqlalchemy.select(statements.reviews.c.id)
+                            .where(statements.reviews.c.deleted_at.is_(None)).limit(n)).scalars().all()
+        start = time.perf_counter()
+        for review_id in live:
+            if soft:
+                conn.execute(statements.SOFT_DELETE_REVIEW, parameters={'review_id': review_id, 'deleted_at': time.time()})
+            else:
+                conn.execute(statements.DELETE_REVIEW, parameters={'review_id': review_id})
+            conn.commit()
+        return (time.perf_counter() - start) / len(live) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--reviews-per-user', type=int, default=50)
+    parser.add_argument('--reads', type=int, default=2000)
+    parser.add_argument('--deletes', type=int, default=500)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    for tombstoned in (0.0, 0.5, 0.9):
+        for partial in (True, False):
+            path = os.path.join(directory, 'bench-%s-%s.db' % (tombstoned, partial))
+            engine = make_engine(path, args.users, args.reviews_per_user, tombstoned, partial)
+            print('%3d%% tombstones, %-13s read %.3f ms'
+                  % (tombstoned * 100, 'partial index' if partial else 'plain index',
+                     time_reads(engine, args.users, args.reads)))
+            engine.dispose()
+
+    for soft in (False, True):
+        path = os.path.join(directory, 'bench-delete-%s.db' % soft)
+        engine = make_engine(path, args.users, args.reviews_per_user, 0.0, True)
+        print('%-11s delete %.3f ms' % ('soft' if soft else 'hard', time_deletes(engine, args.deletes, soft)))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Cold-start cost of the API: import time and app construction.
+
+Runs ``python -X importtime`` in a fresh interpreter per repeat, for each
+module, and reports the best total import time, the time create_app()
+takes when the module has one, and the slowest imports below it.
+--budget-ms makes it exit with status 1 when an import takes longer, so
+a CI job can keep cold starts from creeping back up:
+
+    python bench_startup.py main --budget-ms 400
+    python bench_startup.py main main_mysql --repeat 10 --top 15
+"""
+
+import argparse
+import subprocess
+import sys
+
+# Prints the create_app() time in ms after the import has been timed
+CREATE_APP = ('import time, {module}; start = time.perf_counter(); '
+              'getattr({module}, "create_app", lambda: None)(); '
+              'print((time.perf_counter() - start) * 1000)')
+
+
+def import_times(module):
+    """Returns ({imported module: (self us, cumulative us)}, create_app ms)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CREATE_APP.format(module=module)],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=['main'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, help='fail when an import takes longer than this')
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        # The fastest run is the one least disturbed by the rest of the machine
+        runs = [import_times(module) for _ in range(args.repeat)]
+        times, create_app_ms = min(runs, key=lambda run: run[0][module][1])
+        total_ms = times[module][1] / 1000
+        print('%-12s import %7.1f ms  create_app %5.1f ms' % (module, total_ms, create_app_ms))
+        slowest = sorted((item for item in times.items() if item[0] != module),
+                         key=lambda item: item[1][1], reverse=True)[:args.top]
+        for name, (self_us, cumulative_us) in slowest:
+            print('    %-50s %7.1f ms  (self %6.1f ms)' % (name, cumulative_us / 1000, self_us / 1000))
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            print('%s: import takes %.1f ms, over the %.1f ms budget' % (module, total_ms, args.budget_ms))
+            over_budget = True
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
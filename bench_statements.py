@@ -0,0 +1,55 @@
+"""Python-side overhead per query: per-request text() vs statements.py.
+
+Runs the business lookup from get_business against an in-memory SQLite
+database so the numbers are dominated by SQLAlchemy rather than the server.
+
+    python bench_statements.py --queries 20000
+"""
+
+import argparse
+import time
+
+import sqlalchemy
+
+import statements
+
+
+def per_request_text(conn, business_id):
+    stmt = sqlalchemy.text('SELECT * FROM businesses WHERE id=:business_id')
+    return conn.execute(stmt, parameters={'business_id': business_id}).one_or_none()
+
+
+def precompiled(conn, business_id):
+    return conn.execute(statements.SELECT_BUSINESS, parameters={'business_id': business_id}).one_or_none()
+
+
+def timed(engine, fn, n):
+    with engine.connect() as conn:
+        fn(conn, 1)  # warm the compiled cache
+        start = time.perf_counter()
+        for i in range(n):
+            fn(conn, i % 100 + 1)
+        return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine('sqlite://')
+    statements.metadata.create_all(engine)
+    with engine.connect() as conn:
+        for i in range(100):
+            conn.execute(statements.INSERT_BUSINESS, parameters={
+                'name': 'b%d' % i, 'street_address': 'street', 'owner_id': i % 10,
+                'city': 'city', 'state': 'OR', 'zip_code': 97000 + i})
+        conn.commit()
+
+    for name, fn in [('text() per request', per_request_text),
+                     ('statements.py', precompiled)]:
+        print('%-20s %8.1f us/query' % (name, timed(engine, fn, args.queries)))
+
+
+if __name__ == '__main__':
+    main()
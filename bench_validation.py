@@ -0,0 +1,139 @@
+"""Decode and validation cost per request body.
+
+Compares the hand-rolled checks main.py used before schemas.py (parse with
+request.get_json(), a required_fields list comprehension, then
+check_business / check_review) with schemas.Schema.load, which parses,
+checks and coerces in one pass. Valid and invalid bodies are both timed,
+since a rejected body should be cheap too. With the optional msgspec
+package installed, a msgspec Struct decoder is timed as well for reference.
+
+    python bench_validation.py --iterations 200000
+"""
+
+import argparse
+import json
+import time
+from typing import Annotated, Optional
+
+import schemas
+
+try:
+    import msgspec
+except ImportError:  # optional, for comparison only
+    msgspec = None
+
+BUSINESS_BODY = json.dumps({'name': 'Golden Cafe', 'street_address': '120 Main Street', 'owner_id': 7,
+                            'city': 'Corvallis', 'state': 'or', 'zip_code': 97330}).encode()
+REVIEW_BODY = json.dumps({'user_id': 12, 'business_id': 3, 'stars': 4,
+                          'review_text': 'Friendly staff and quick service, will come back.'}).encode()
+INVALID_BODY = json.dumps({'user_id': 12, 'business_id': 3, 'stars': 9}).encode()
+
+
+# The checks main.py ran before schemas.py, kept here as the baseline
+def legacy_check_business(content):
+    state = content.get('state')
+    if not isinstance(state, str) or len(state) != 2 or not state.isalpha():
+        return {"Error": "state must be a two letter abbreviation"}
+    content['state'] = state.upper()
+    zip_code = content.get('zip_code')
+    if isinstance(zip_code, int) and not isinstance(zip_code, bool) and 0 <= zip_code <= 99999:
+        zip_code = '%05d' % zip_code
+    if not isinstance(zip_code, str) or len(zip_code) != 5 or not zip_code.isdigit():
+        return {"Error": "zip_code must be a five digit ZIP code"}
+    content['zip_code'] = zip_code
+    return None
+
+
+def legacy_check_review(content):
+    stars = content.get('stars')
+    if not isinstance(stars, int) or isinstance(stars, bool) or not 1 <= stars <= 5:
+        return {"Error": "stars must be a whole number from 1 to 5"}
+    review_text = content.get('review_text')
+    if review_text is not None and (not isinstance(review_text, str) or len(review_text) > 1000):
+        return {"Error": "review_text must be text of at most 1000 characters"}
+    return None
+
+
+def legacy_business(body):
+    content = json.loads(body)
+    required_fields = ['name', 'street_address', 'owner_id', 'city', 'state', 'zip_code']
+    missing_fields = [field for field in required_fields if field not in content]
+    if missing_fields:
+        return {"Error": "The request body is missing at least one of the required attributes"}
+    return legacy_check_business(content) or content
+
+
+def legacy_review(body):
+    content = json.loads(body)
+    required_fields = ['user_id', 'business_id', 'stars']
+    missing_fields = [field for field in required_fields if field not in content]
+    if missing_fields:
+        return {"Error": "The request body is missing at least one of the required attributes"}
+    return legacy_check_review(content) or content
+
+
+def schema_loader(schema):
+    def load(body):
+        try:
+            return schema.load(body)
+        except schemas.InvalidBody as e:
+            return {"Error": str(e)}
+    return load
+
+
+def msgspec_loaders():
+    def text(max_length):
+        return Annotated[str, msgspec.Meta(min_length=1, max_length=max_length)]
+
+    class Business(msgspec.Struct):
+        name: text(50)
+        street_address: text(100)
+        owner_id: Optional[int]
+        city: text(50)
+        state: Annotated[str, msgspec.Meta(pattern='^[A-Za-z]{2}$')]
+        zip_code: Annotated[int, msgspec.Meta(ge=0, le=99999)]
+
+    class Review(msgspec.Struct):
+        user_id: int
+        business_id: int
+        stars: Annotated[int, msgspec.Meta(ge=1, le=5)]
+        review_text: Optional[Annotated[str, msgspec.Meta(max_length=1000)]] = ''
+
+    def loader(decoder):
+        def load(body):
+            try:
+                return decoder.decode(body)
+            except msgspec.ValidationError as e:
+                return {"Error": str(e)}
+        return load
+
+    return loader(msgspec.json.Decoder(Business)), loader(msgspec.json.Decoder(Review))
+
+
+def per_call_us(fn, body, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    paths = [('hand-rolled', legacy_business, legacy_review),
+             ('schemas.py', schema_loader(schemas.BUSINESS), schema_loader(schemas.REVIEW))]
+    if msgspec is not None:
+        paths.append(('msgspec', *msgspec_loaders()))
+
+    print('%-12s %14s %14s %14s' % ('', 'business', 'review', 'invalid review'))
+    for name, business, review in paths:
+        print('%-12s %11.2f us %11.2f us %11.2f us' % (
+            name, per_call_us(business, BUSINESS_BODY, args.iterations),
+            per_call_us(review, REVIEW_BODY, args.iterations),
+            per_call_us(review, INVALID_BODY, args.iterations)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Sampled capture of live requests for replay.py.
+
+A sampled request is written as one JSON line holding its arrival time,
+method, path with query string, a few headers that change how the request
+is handled, the body, and the response status, size and duration. Lines are
+handed to a background thread through a bounded queue, so a request never
+waits on disk: when the queue is full the record is dropped and counted.
+The file rotates at ``max_bytes`` keeping ``backups`` old files, like
+``logging.handlers.RotatingFileHandler``.
+
+The writer thread starts with the first sampled request in each process,
+so it also runs in gunicorn workers forked from a preloaded app. Workers
+must not share a file: put ``{pid}`` in the path (e.g.
+``captures/requests-{pid}.jsonl``) when running more than one.
+
+Capture is off unless TRAFFIC_CAPTURE_PATH is set (see main.py).
+"""
+
+import base64
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from flask import g, request
+
+logger = logging.getLogger()
+
+HEADERS = ('Content-Type', 'Accept', 'Accept-Encoding', 'X-Client-Id', 'X-Review-Ack', 'Idempotency-Key')
+
+
+class TrafficCapture:
+    def __init__(self, path, sample_rate=0.01, max_bytes=100 * 1024 * 1024, backups=5,
+                 max_body=64 * 1024, max_queue=10000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_body = max_body
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A thread started before a fork does not exist in the child
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._file = self.path.format(pid=self._pid)
+            self._thread = threading.Thread(target=self._run, name='traffic-capture', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def record(self, entry):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        out = open(self._file, 'a', encoding='utf-8')
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                line = json.dumps(entry, separators=(',', ':')) + '\n'
+                if out.tell() + len(line) > self.max_bytes:
+                    out.close()
+                    self._rotate()
+                    out = open(self._file, 'a', encoding='utf-8')
+                out.write(line)
+                if self._queue.empty():
+                    out.flush()
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            out.close()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self._file, i)):
+                os.replace('%s.%d' % (self._file, i), '%s.%d' % (self._file, i + 1))
+        if self.backups:
+            os.replace(self._file, self._file + '.1')
+        else:
+            os.remove(self._file)
+
+    def install(self, app):
+        @app.before_request
+        def sample_request():
+            if random.random() < self.sample_rate:
+                g.capture_started = (time.time(), time.perf_counter())
+
+        @app.after_request
+        def capture_response(response):
+            started = g.pop('capture_started', None)
+            if started is None:
+                return response
+            body = request.get_data(cache=True)[:self.max_body]
+            entry = {
+                'ts': started[0],
+                'method': request.method,
+                'path': request.full_path if request.query_string else request.path,
+                'headers': {name: request.headers[name] for name in HEADERS if name in request.headers},
+                'status': response.status_code,
+                'bytes': None if response.is_streamed else response.calculate_content_length(),
+                'duration_ms': round((time.perf_counter() - started[1]) * 1000, 3),
+            }
+            if body:
+                try:
+                    entry['body'] = body.decode('utf-8')
+                except UnicodeDecodeError:
+                    entry['body_b64'] = base64.b64encode(body).decode('ascii')
+            self.record(entry)
+            return response
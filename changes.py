@@ -0,0 +1,180 @@
+"""Change-data feed for businesses, reviews and lodgings.
+
+Every mutation handler calls ``record_change`` on the connection it is
+about to commit, so the ``changes`` row is written in the same transaction
+as the mutation (transactional outbox). Readers page through the table by
+``seq``.
+
+``seq`` is an AUTO_INCREMENT key, handed out when the row is inserted
+but visible only once its transaction commits, so seq N can still be
+in flight after N + 1 is readable. A reader that moved past N would never
+see it. ``read_changes`` therefore stops at a gap in the sequence until
+the row after the gap is ``SETTLE_SECONDS`` old; a seq missing for that
+long belonged to a rolled back transaction (or was compacted away).
+``settled_seq`` is the same boundary for readers that start from a
+snapshot of the tables instead of the feed.
+
+The window is a trade-off, set with CHANGES_SETTLE_SECONDS. Every
+rolled back transaction that recorded a change leaves a gap, and readers
+stall at it for up to the whole window: GET /changes returns nothing new,
+and the leaderboard and similarity.py stay that far behind. A
+transaction that commits more than the window after recording its change
+(say, one stuck in a lock wait) is skipped by readers that passed it, so
+handlers record their change just before committing, and the window must
+stay longer than any such delay.
+
+``wait_for_changes`` lets a long-poll block until a commit that recorded
+a change wakes it, without holding a pooled connection while it waits.
+``compact`` drops rows that a later row for the same entity supersedes,
+so the table grows with the number of live entities rather than the
+number of writes.
+"""
+
+import json
+import os
+import threading
+import time
+
+import sqlalchemy
+
+import statements
+
+ENTITY_BUSINESS = 'business'
+ENTITY_REVIEW = 'review'
+ENTITY_LODGING = 'lodging'
+
+OP_CREATE = 'create'
+OP_UPDATE = 'update'
+OP_DELETE = 'delete'
+
+# How long a gap in seq may be an uncommitted change rather than a lost
+# one, and so how long readers stall at a rolled back change
+SETTLE_SECONDS = float(os.environ.get('CHANGES_SETTLE_SECONDS', 2.0))
+
+_new_changes = threading.Condition()
+
+
+def install(engine):
+    """Wake waiting readers whenever a transaction that recorded a change commits."""
+    @sqlalchemy.event.listens_for(engine, 'commit')
+    def notify(conn):
+        if conn.info.pop('changes_pending', False):
+            with _new_changes:
+                _new_changes.notify_all()
+
+    @sqlalchemy.event.listens_for(engine, 'rollback')
+    def discard(conn):
+        conn.info.pop('changes_pending', None)
+
+
+def record_change(conn, entity, entity_id, op, payload=None):
+    conn.execute(statements.INSERT_CHANGE, parameters={
+        'entity': entity,
+        'entity_id': entity_id,
+        'op': op,
+        'payload': None if payload is None else json.dumps(payload, default=str),
+        'created_at': time.time(),
+    })
+    conn.info['changes_pending'] = True
+
+
+def _settled(row, previous, horizon):
+    # Rows written before created_at existed are old enough by definition
+    return row.seq == previous + 1 or row.created_at is None or row.created_at <= horizon
+
+
+def read_changes(conn, since, limit):
+    """Up to limit changes after since, stopping short of an unsettled gap."""
+    rows = conn.execute(statements.SELECT_CHANGES_SINCE, parameters={'since': since, 'limit': limit}).fetchall()
+    horizon = time.time() - SETTLE_SECONDS
+    entries = []
+    for row in rows:
+        if not _settled(row, since, horizon):
+            break
+        since = row.seq
+        entries.append({'seq': row.seq,
+                        'entity': row.entity,
+                        'id': row.entity_id,
+                        'op': row.op,
+                        'data': None if row.payload is None else json.loads(row.payload)})
+    return entries
+
+
+def settled_seq(conn, page_size=1000):
+    """The seq up to which the feed is complete: no lower seq can still show up.
+
+    A reader that snapshots the tables reflects at least every change up
+    to here, and follows the feed from here without missing one.
+    """
+    horizon = time.time() - SETTLE_SECONDS
+    # Walk back over the rows written within the settle window
+    recent = []
+    before = None
+    while True:
+        rows = conn.execute(statements.SELECT_CHANGES_BEFORE,
+                            parameters={'before': before if before is not None else 2 ** 62,
+                                        'limit': page_size}).fetchall()
+        old = next((row for row in rows if row.created_at is None or row.created_at <= horizon), None)
+        if old is not None:
+            recent.extend(row for row in rows if row.seq > old.seq)
+            settled = old.seq
+            break
+        recent.extend(rows)
+        if len(rows) < page_size:
+            settled = 0
+            break
+        before = rows[-1].seq
+    # Then forward over them, up to the first gap
+    for row in reversed(recent):
+        if row.seq != settled + 1:
+            break
+        settled = row.seq
+    return settled
+
+
+def wait_for_changes(timeout):
+    """Block until a change is committed in this process or timeout passes.
+
+    Other processes' commits are not seen here, so callers should re-read
+    the table after a timeout as well.
+    """
+    with _new_changes:
+        return _new_changes.wait(timeout)
+
+
+def compact(engine, horizon, batch_size=1000):
+    """Delete superseded changes with seq < horizon. Returns the number deleted."""
+    deleted = 0
+    while True:
+        with engine.connect() as conn:
+            seqs = conn.execute(statements.SELECT_SUPERSEDED_CHANGES,
+                                parameters={'horizon': horizon, 'limit': batch_size}).scalars().all()
+            if not seqs:
+                return deleted
+            conn.execute(statements.DELETE_CHANGES, parameters={'seqs': seqs})
+            conn.commit()
+        deleted += len(seqs)
+
+
+def main():
+    import argparse
+    import main as api
+
+    parser = argparse.ArgumentParser(description='Maintain the change feed.')
+    parser.add_argument('--url', default=api.DATABASE_URL,
+                        help='SQLAlchemy URL to connect with (default: $DATABASE_URL, else Cloud SQL)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    compact_parser = commands.add_parser('compact', help='delete superseded changes')
+    compact_parser.add_argument('--keep', type=int, default=100000,
+                                help='leave the most recent KEEP changes untouched')
+    compact_parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(args.url) if args.url else api.init_connection_pool()
+    with engine.connect() as conn:
+        last_seq = conn.execute(statements.LAST_CHANGE_SEQ).scalar() or 0
+    print('deleted %d changes' % compact(engine, last_seq - args.keep + 1, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Negotiated response compression.
+
+Responses of at least ``min_size`` bytes are compressed with the best
+encoding the client accepts: brotli when the optional ``brotli`` package is
+installed, otherwise gzip. Smaller bodies are sent as they are, because the
+header and CPU overhead outweighs the few bytes saved. Streamed responses
+(the /changes event stream) are never compressed, since buffering them
+would hold events back.
+"""
+
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+
+def available_encodings():
+    """Encodings this process can produce, most preferred first."""
+    return (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def choose_encoding(accept_encoding):
+    """Pick an encoding from an Accept-Encoding header, or None for identity."""
+    offered = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip().lower()] = quality
+    best = None
+    for encoding in available_encodings():
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(data, encoding, level):
+    if encoding == BROTLI:
+        # Brotli quality runs 0-11; map the gzip style 1-9 level onto it
+        return brotli.compress(data, quality=min(11, level + 1))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def install(app, min_size=1024, level=6):
+    @app.after_request
+    def compress_response(response):
+        # Whatever the outcome, caches must key on Accept-Encoding
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return compress_response
@@ -15,11 +15,13 @@
 # [START cloud_sql_mysql_sqlalchemy_connect_connector]
 import os
 
-from google.cloud.sql.connector import Connector, IPTypes
-import pymysql
-
 import sqlalchemy
 
+# Pool limits, also used by main.py to size load shedding
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 2))
+POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+
 
 def connect_with_connector() -> sqlalchemy.engine.base.Engine:
     """
@@ -27,6 +29,13 @@ def connect_with_connector() -> sqlalchemy.engine.base.Engine:
 
     Uses the Cloud SQL Python Connector package.
     """
+    # Imported here rather than at the top: the connector pulls in aiohttp
+    # and google-auth, which roughly doubles the import time of main.py,
+    # and tools importing main for its statements never connect
+    from google.cloud.sql.connector import Connector, IPTypes
+    import pymysql
+    import pymysql.constants
+
     # Note: Saving credentials in environment variables is convenient, but not
     # secure - consider a more secure solution such as
     # Cloud Secret Manager (https://cloud.google.com/secret-manager) to help
@@ -55,6 +64,11 @@ def connect_with_connector() -> sqlalchemy.engine.base.Engine:
             user=db_user,
             password=db_pass,
             db=db_name,
+            # Report matched rather than changed rows for UPDATE, so an
+            # update that sets identical values still has rowcount 1 and is
+            # not mistaken for a missing row. SQLAlchemy sets this flag
+            # itself only when it opens connections, not with a creator.
+            client_flag=pymysql.constants.CLIENT.FOUND_ROWS,
         )
         return conn
 
@@ -63,19 +77,23 @@ def connect_with_connector() -> sqlalchemy.engine.base.Engine:
         creator=getconn,
         # [START_EXCLUDE]
         # Pool size is the maximum number of permanent connections to keep.
-        pool_size=5,
+        pool_size=POOL_SIZE,
         # Temporarily exceeds the set pool_size if no connections are available.
-        max_overflow=2,
+        max_overflow=MAX_OVERFLOW,
         # The total number of concurrent connections for your application will be
         # a total of pool_size and max_overflow.
         # 'pool_timeout' is the maximum number of seconds to wait when retrieving a
         # new connection from the pool. After the specified amount of time, an
         # exception will be thrown.
-        pool_timeout=30,  # 30 seconds
+        pool_timeout=POOL_TIMEOUT,  # 30 seconds by default
         # 'pool_recycle' is the maximum number of seconds a connection can persist.
         # Connections that live longer than the specified amount of time will be
         # re-established
         pool_recycle=1800,  # 30 minutes
+        # 'query_cache_size' is the number of compiled statements kept per
+        # engine. The statements in statements.py are built once, so each
+        # one is compiled on first use and served from this cache afterwards.
+        query_cache_size=500,
         # [END_EXCLUDE]
     )
     return pool
@@ -0,0 +1,157 @@
+"""Background purge of a deleted business's reviews.
+
+In the async delete mode, DELETE /businesses/<id> only tombstones the
+business (sets ``deleted_at``, so reads return 404 straight away) and
+records a job in ``delete_jobs`` in the same transaction. A
+``DeleteJobRunner`` then deletes the reviews in chunks of ``chunk_size``,
+one short transaction per chunk, and finally the business row itself.
+
+With soft deletes on, the job's action is ``tombstone`` instead: the
+reviews get ``deleted_at`` set in the same chunks and the business row is
+kept, leaving both to ``tombstones.compact``.
+
+Jobs live in the database, so a job interrupted by a restart is picked up
+again: a running job whose heartbeat (``updated_at``) is older than
+``stale_after`` seconds is claimed by the next runner that looks. Deleting
+a chunk twice is harmless, so resuming needs no other bookkeeping. The
+runner can live in the web process or run on its own:
+
+    python delete_jobs.py
+"""
+
+import logging
+import threading
+import time
+
+import statements
+
+logger = logging.getLogger()
+
+ACTION_PURGE = 'purge'
+ACTION_TOMBSTONE = 'tombstone'
+
+STATE_PENDING = 'pending'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+
+
+def enqueue(conn, business_id, action=ACTION_PURGE):
+    """Record a job on conn; it is visible to runners once conn commits."""
+    conn.execute(statements.INSERT_DELETE_JOB,
+                 parameters={'business_id': business_id, 'action': action, 'created_at': time.time()})
+    return conn.execute(statements.LAST_INSERT_ID).scalar()
+
+
+def get_job(conn, job_id):
+    return conn.execute(statements.SELECT_DELETE_JOB, parameters={'job_id': job_id}).one_or_none()
+
+
+class DeleteJobRunner:
+    def __init__(self, engine, chunk_size=1000, pause=0.0, poll_interval=5.0, stale_after=60.0):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        # Sleep between chunks so the purge leaves room for other writes
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='delete-jobs', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=None):
+        """Stop after the current chunk; the job resumes on the next start."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        """Look for jobs now instead of at the next poll."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                while self.run_once() and not self._stopped.is_set():
+                    pass
+            except Exception as e:
+                logger.exception(e)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def run_once(self):
+        """Claim and finish one job. Returns False if there was nothing to do."""
+        with self.engine.connect() as conn:
+            candidates = conn.execute(statements.SELECT_RUNNABLE_DELETE_JOBS, parameters={
+                'stale_before': time.time() - self.stale_after, 'limit': 10}).fetchall()
+            for job in candidates:
+                count = (statements.COUNT_LIVE_BUSINESS_REVIEWS if job.action == ACTION_TOMBSTONE
+                         else statements.COUNT_BUSINESS_REVIEWS)
+                total = conn.execute(count, parameters={'business_id': job.business_id}).scalar()
+                claimed = conn.execute(statements.CLAIM_DELETE_JOB, parameters={
+                    'b_job_id': job.id, 'b_updated_at': job.updated_at,
+                    'total': job.processed + total, 'now': time.time()}).rowcount
+                conn.commit()
+                if claimed == 1:
+                    break
+            else:
+                return False
+
+        logger.info('delete job %d: %s %d reviews of business %d', job.id, job.action, total, job.business_id)
+        self._purge(job)
+        return True
+
+    def _purge(self, job):
+        tombstone = job.action == ACTION_TOMBSTONE
+        select_ids = statements.SELECT_LIVE_BUSINESS_REVIEW_IDS if tombstone else statements.SELECT_BUSINESS_REVIEW_IDS
+        while not self._stopped.is_set():
+            with self.engine.connect() as conn:
+                review_ids = conn.execute(select_ids, parameters={
+                    'business_id': job.business_id, 'limit': self.chunk_size}).scalars().all()
+                if review_ids:
+                    if tombstone:
+                        conn.execute(statements.SOFT_DELETE_REVIEWS,
+                                     parameters={'review_ids': review_ids, 'deleted_at': time.time()})
+                    else:
+                        conn.execute(statements.DELETE_REVIEWS, parameters={'review_ids': review_ids})
+                    conn.execute(statements.UPDATE_DELETE_JOB_PROGRESS,
+                                 parameters={'b_job_id': job.id, 'n': len(review_ids), 'now': time.time()})
+                else:
+                    if not tombstone:
+                        conn.execute(statements.PURGE_BUSINESS, parameters={'business_id': job.business_id})
+                    conn.execute(statements.FINISH_DELETE_JOB, parameters={'b_job_id': job.id, 'now': time.time()})
+                conn.commit()
+            if not review_ids:
+                logger.info('delete job %d: done', job.id)
+                return
+            if self.pause:
+                time.sleep(self.pause)
+
+
+def main():
+    import argparse
+    import main as api
+
+    parser = argparse.ArgumentParser(description='Run business delete jobs.')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--pause-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    runner = DeleteJobRunner(api.init_connection_pool(), chunk_size=args.chunk_size, pause=args.pause_ms / 1000)
+    runner.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Read-through entity cache for the Datastore backend (main1.py).
+
+``CachedClient`` wraps a ``datastore.Client`` and serves ``get`` and
+``get_multi`` from two levels, in the spirit of NDB's caches:
+
+* a context cache that lives for one request (on ``flask.g``), so a key
+  read twice while handling a request costs one lookup. It remembers
+  misses too.
+* an optional process-wide LRU of ``max_entities`` entities, shared by
+  the requests of one process. Other instances do not invalidate it, so
+  an entry is trusted for ``ttl`` seconds at most; only found entities
+  are kept, so a new entity is never hidden by a cached miss.
+
+``put``/``put_multi`` write through: the stored entity replaces the cached
+one. ``delete``/``delete_multi`` invalidate. Inside a transaction, reads
+go to Datastore (the transaction has to see and lock them) and writes only
+invalidate, since they are not committed yet. Callers get copies, so
+changing a returned entity never changes the cache.
+
+Every other attribute is passed through to the wrapped client, so
+``key()``, ``query()`` and ``transaction()`` work as before. ``lookups``
+counts the lookup RPCs actually sent and ``hits`` the keys served from a
+cache.
+"""
+
+import collections
+import threading
+import time
+
+from flask import g, has_request_context
+
+
+def _copy(entity):
+    clone = type(entity)(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    clone.update(entity)
+    return clone
+
+
+class CachedClient:
+    def __init__(self, client, context=True, max_entities=0, ttl=30.0):
+        self.client = client
+        self.context = context
+        self.max_entities = max_entities
+        self.ttl = ttl
+        self.lookups = 0
+        self.hits = 0
+        # key -> (expiry, entity), least recently used first
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _context(self):
+        if not self.context or not has_request_context():
+            return None
+        local = g.get('entity_cache')
+        if local is None:
+            local = g.entity_cache = {}
+        return local
+
+    def _lru_get(self, key):
+        if not self.max_entities:
+            return None
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is None:
+                return None
+            if cached[0] < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return cached[1]
+
+    def _lru_put(self, key, entity):
+        if not self.max_entities:
+            return
+        with self._lock:
+            self._lru[key] = (time.monotonic() + self.ttl, entity)
+            self._lru.move_to_end(key)
+            if len(self._lru) > self.max_entities:
+                self._lru.popitem(last=False)
+
+    def _store(self, entity):
+        entity = _copy(entity)
+        local = self._context()
+        if local is not None:
+            local[entity.key] = entity
+        self._lru_put(entity.key, entity)
+
+    def invalidate(self, key):
+        local = self._context()
+        if local is not None:
+            local.pop(key, None)
+        if self.max_entities:
+            with self._lock:
+                self._lru.pop(key, None)
+
+    def get(self, key, **kwargs):
+        found = self.get_multi([key], **kwargs)
+        return found[0] if found else None
+
+    def get_multi(self, keys, **kwargs):
+        if kwargs or self.client.current_transaction is not None:
+            self.lookups += 1
+            return self.client.get_multi(keys, **kwargs)
+
+        local = self._context()
+        found = {}
+        missing = []
+        for key in keys:
+            if local is not None and key in local:
+                self.hits += 1
+                entity = local[key]
+            else:
+                entity = self._lru_get(key)
+                if entity is None:
+                    missing.append(key)
+                    continue
+                self.hits += 1
+                if local is not None:
+                    local[key] = entity
+            if entity is not None:
+                found[key] = entity
+
+        if missing:
+            self.lookups += 1
+            fetched = {entity.key: entity for entity in self.client.get_multi(missing)}
+            for key in missing:
+                entity = fetched.get(key)
+                if entity is None:
+                    if local is not None:
+                        local[key] = None
+                else:
+                    self._store(entity)
+                    found[key] = entity
+        return [_copy(found[key]) for key in keys if key in found]
+
+    def put(self, entity, **kwargs):
+        self.put_multi([entity], **kwargs)
+
+    def put_multi(self, entities, **kwargs):
+        self.client.put_multi(entities, **kwargs)
+        for entity in entities:
+            if self.client.current_transaction is not None:
+                if not entity.key.is_partial:
+                    self.invalidate(entity.key)
+            else:
+                self._store(entity)
+
+    def delete(self, key, **kwargs):
+        self.delete_multi([key], **kwargs)
+
+    def delete_multi(self, keys, **kwargs):
+        self.client.delete_multi(keys, **kwargs)
+        for key in keys:
+            self.invalidate(key)
@@ -0,0 +1,159 @@
+"""Columnar snapshot of businesses and reviews for offline analytics.
+
+Analysts query the snapshot (see analytics.py) instead of running GROUP BY
+queries against the production database. Each column is written to its
+own NumPy ``.npy`` file, which ``numpy.load(..., mmap_mode='r')`` maps
+without reading it:
+
+    <out>/manifest.json
+    <out>/businesses/id.npy, owner_id.npy, city.npy, state.npy, ...
+    <out>/reviews/id.npy, user_id.npy, business_id.npy, stars.npy, ...
+
+Only live rows are exported, in id order. NULL integers are stored as -1
+and NULL times as NaN. Text columns are dictionary encoded: the ``.npy``
+holds int32 codes into ``<column>.dict.json``. review_text is left out.
+
+Rows are streamed from a server-side cursor in batches of --batch-size
+and appended to the column files, so memory use does not grow with the
+table. The row count goes into each file's header once the stream ends,
+which takes one pass and no COUNT(*). Without --sqlite or --url the
+engine is built by connect_with_connector() from the usual environment;
+a read replica is the better --url for large exports.
+
+    python export.py --out snapshot
+    python export.py --sqlite bench.db --out snapshot --batch-size 50000
+
+Needs numpy, which the API itself does not use:
+
+    pip install -r requirements-analytics.txt
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy
+import sqlalchemy
+from sqlalchemy import select
+
+from statements import businesses, reviews
+
+# table -> (statement, {column: (dtype, kind)}). kind is 'int' (NULL is -1),
+# 'float' (NULL is NaN) or 'text' (dictionary encoded).
+TABLES = {
+    'businesses': (
+        select(businesses.c.id, businesses.c.owner_id, businesses.c.city, businesses.c.state,
+               businesses.c.zip_code)
+        .where(businesses.c.deleted_at.is_(None))
+        .order_by(businesses.c.id),
+        {'id': ('<i4', 'int'), 'owner_id': ('<i4', 'int'), 'city': ('<i4', 'text'),
+         'state': ('<i4', 'text'), 'zip_code': ('<i4', 'text')},
+    ),
+    'reviews': (
+        select(reviews.c.id, reviews.c.user_id, reviews.c.business_id, reviews.c.stars,
+               reviews.c.created_at, reviews.c.updated_at)
+        .where(reviews.c.deleted_at.is_(None))
+        .order_by(reviews.c.id),
+        {'id': ('<i4', 'int'), 'user_id': ('<i4', 'int'), 'business_id': ('<i4', 'int'),
+         'stars': ('i1', 'int'), 'created_at': ('<f8', 'float'), 'updated_at': ('<f8', 'float')},
+    ),
+}
+
+# Room for the .npy header of any row count, so it can be written last
+HEADER_SIZE = 128
+
+
+class ColumnWriter:
+    """Appends values to a one-dimensional .npy file of unknown length."""
+
+    def __init__(self, path, dtype, kind):
+        self.path = path
+        self.dtype = numpy.dtype(dtype)
+        self.kind = kind
+        self.rows = 0
+        # value -> code, for text columns
+        self.dictionary = {} if kind == 'text' else None
+        self._file = open(path, 'wb')
+        self._file.write(b'\0' * HEADER_SIZE)
+
+    def append(self, values):
+        if self.kind == 'text':
+            codes = self.dictionary
+            values = [codes.setdefault(value, len(codes)) for value in values]
+        elif self.kind == 'int':
+            values = [-1 if value is None else value for value in values]
+        else:
+            values = [numpy.nan if value is None else value for value in values]
+        self._file.write(numpy.asarray(values, dtype=self.dtype).tobytes())
+        self.rows += len(values)
+
+    def close(self):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (self.dtype.str, self.rows)
+        # Magic, version 1.0, header length, then the header padded with
+        # spaces to HEADER_SIZE as numpy.lib.format expects
+        prefix = numpy.lib.format.magic(1, 0) + (HEADER_SIZE - 10).to_bytes(2, 'little')
+        self._file.seek(0)
+        self._file.write(prefix + header.ljust(HEADER_SIZE - len(prefix) - 1).encode('latin1') + b'\n')
+        self._file.close()
+        if self.dictionary is not None:
+            with open(self.path[:-len('.npy')] + '.dict.json', 'w') as f:
+                json.dump(list(self.dictionary), f)
+
+
+def export_table(conn, name, out, batch_size):
+    stmt, columns = TABLES[name]
+    os.makedirs(os.path.join(out, name), exist_ok=True)
+    writers = {column: ColumnWriter(os.path.join(out, name, column + '.npy'), dtype, kind)
+               for column, (dtype, kind) in columns.items()}
+    # A server-side cursor (PyMySQL's SSCursor), read batch_size rows at a time
+    result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(stmt)
+    for batch in result.partitions(batch_size):
+        for position, (column, writer) in enumerate(writers.items()):
+            writer.append([row[position] for row in batch])
+    for writer in writers.values():
+        writer.close()
+    rows = writers['id'].rows
+    return {'rows': rows,
+            'columns': {column: {'dtype': writer.dtype.str, 'dictionary': writer.dictionary is not None}
+                        for column, writer in writers.items()}}
+
+
+def export(engine, out, batch_size=10000):
+    """Write the snapshot to the directory out. Returns its manifest."""
+    manifest = {'created_at': time.time(), 'tables': {}}
+    with engine.connect() as conn:
+        # Under InnoDB's REPEATABLE READ both tables are read in the same
+        # snapshot, so every exported review's business is exported too
+        for name in TABLES:
+            manifest['tables'][name] = export_table(conn, name, out, batch_size)
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='snapshot', help='directory to write the columns to')
+    parser.add_argument('--sqlite', help='SQLite file to export instead of Cloud SQL')
+    parser.add_argument('--url', help='SQLAlchemy URL to export from instead of Cloud SQL')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.sqlite:
+        engine = sqlalchemy.create_engine('sqlite:///' + args.sqlite)
+    elif args.url:
+        engine = sqlalchemy.create_engine(args.url)
+    else:
+        from connect_connector import connect_with_connector
+        engine = connect_with_connector()
+
+    start = time.perf_counter()
+    manifest = export(engine, args.out, args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(', '.join('%d %s' % (table['rows'], name) for name, table in manifest['tables'].items())
+          + ' in %.1f s' % elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Gunicorn settings for main.py.
+
+    gunicorn -c gunicorn.conf.py main:app
+    gunicorn -c gunicorn.conf.py 'main:create_app()'
+
+Each worker process gets its own connection pool, so the number of threads
+(or greenlets) per worker is matched to what its pool can serve, and the
+total connections to Cloud SQL are workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+Everything can be overridden from the environment.
+"""
+
+import multiprocessing
+import os
+import sys
+
+from connect_connector import POOL_SIZE, MAX_OVERFLOW
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8080')
+
+# gthread for plain threads; gevent if it is installed and most time is
+# spent waiting on the database
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', POOL_SIZE + MAX_OVERFLOW))
+# Greenlets per gevent worker; requests beyond what the pool can serve are
+# shed by the admission controller rather than queued for a connection
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 4 * (POOL_SIZE + MAX_OVERFLOW)))
+
+# Import the app once in the master so workers fork with it already loaded.
+# gevent has to patch the standard library before the app is imported, so
+# it loads the app in each worker instead.
+preload_app = worker_class != 'gevent'
+
+# Recycle workers now and then to bound memory growth; the jitter keeps
+# them from all restarting at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+# Long-polls on /changes wait up to 30 seconds
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+
+def post_worker_init(worker):
+    api = sys.modules.get('main')
+    if api is None or 'api' not in getattr(worker.wsgi, 'extensions', {}):
+        return
+    # main.ensure_db() would create the pool on the first request; do it
+    # before the worker takes traffic instead. init_db() drops an engine
+    # inherited from the master without closing the master's sockets.
+    api.init_db(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    api = sys.modules.get('main')
+    if api is None or 'api' not in getattr(worker.wsgi, 'extensions', {}):
+        return
+    # Commits reviews that were acknowledged but are still queued; a
+    # running delete job stops after its chunk and another worker resumes it
+    api.close_app(worker.wsgi, graceful_timeout)
@@ -0,0 +1,200 @@
+"""Idempotency-Key support for POST endpoints.
+
+Keys are scoped to the client named by ``identify`` (main passes the
+ClientIdentity the rate limits use), so one client cannot replay, or block,
+another client's request by guessing its key.
+
+The first request with a given (client, Idempotency-Key) pair claims the key
+by inserting a placeholder row; the primary key makes the claim atomic, so
+of two simultaneous duplicates exactly one runs the handler. The handler's
+response is then stored on that row, and repeats are answered from it
+without touching the business/review tables. A duplicate that arrives while
+the first request is still running waits briefly for it, then gets a 409.
+
+A claim is a lease of ``lease`` seconds: if the worker handling the first
+request dies (say, killed by a gunicorn timeout) before storing a
+response, a retry after the lease has run out takes the key over and runs
+the handler itself, instead of getting 409s until the key expires. Only
+the current holder of a claim can store a response or release the key.
+
+Each key stores a fingerprint of its request: the method, path, query
+string and body. Reusing a key for a different request is a client error
+(422), checked before anything is replayed.
+Responses of 5xx are not stored, so the client can retry them. Keys expire
+after ``ttl`` seconds and at most ``max_keys`` are kept; both are enforced by
+a purge that runs every ``purge_every`` claims.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import sqlalchemy
+from flask import make_response, request
+
+import statements
+
+logger = logging.getLogger()
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+
+
+def request_fingerprint():
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.query_string):
+        digest.update(part)
+        digest.update(b'\0')
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, get_engine, ttl=24 * 3600, max_keys=1000000, wait=5.0, purge_every=1000, lease=180.0,
+                 identify=None):
+        # get_engine is called per request, so the engine can be created
+        # after the routes are declared
+        self.get_engine = get_engine
+        # Names the client of a request; by default its address
+        self.identify = identify or (lambda: request.remote_addr or '')
+        self.ttl = ttl
+        # Longer than any request can run, so a live claim never expires
+        self.lease = lease
+        self.max_keys = max_keys
+        self.wait = wait
+        self.purge_every = purge_every
+        self._claims = 0
+        self._claims_lock = threading.Lock()
+
+    def idempotent(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            idem_key = request.headers.get(HEADER)
+            if idem_key is None:
+                return view(*args, **kwargs)
+            if not idem_key or len(idem_key) > MAX_KEY_LENGTH:
+                return {"Error": "Idempotency-Key must be 1 to 100 characters"}, 400
+
+            client_id = self.identify()
+            if len(client_id) > MAX_KEY_LENGTH:
+                # Cutting it short could merge two clients
+                client_id = hashlib.sha256(client_id.encode()).hexdigest()
+            key = {'b_client_id': client_id, 'b_idem_key': idem_key}
+            request_hash = request_fingerprint()
+
+            claimed_at, stored = self._claim(key, request_hash)
+            if stored is not None:
+                return stored
+
+            claim = dict(key, claimed_at=claimed_at)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                self._release(claim)
+                raise
+            if response.status_code >= 500:
+                self._release(claim)
+            else:
+                self._complete(claim, response)
+            return response
+        return wrapper
+
+    def _claim(self, key, request_hash):
+        """Claim the key.
+
+        Returns (claim time, None) if claimed, else (None, the response to send).
+        """
+        engine = self.get_engine()
+        deadline = time.monotonic() + self.wait
+        while True:
+            with engine.connect() as conn:
+                row = conn.execute(statements.SELECT_IDEMPOTENCY_KEY, parameters=key).one_or_none()
+                if row is not None and row.created_at < time.time() - self.ttl:
+                    conn.execute(statements.DELETE_IDEMPOTENCY_KEY, parameters=key)
+                    conn.commit()
+                    row = None
+                if row is None:
+                    claimed_at = time.time()
+                    try:
+                        conn.execute(statements.INSERT_IDEMPOTENCY_KEY,
+                                     parameters=dict(key, request_hash=request_hash, created_at=claimed_at))
+                        conn.commit()
+                        self._maybe_purge()
+                        return claimed_at, None
+                    except sqlalchemy.exc.IntegrityError:
+                        # A simultaneous duplicate claimed it first
+                        conn.rollback()
+                        row = conn.execute(statements.SELECT_IDEMPOTENCY_KEY, parameters=key).one_or_none()
+                        if row is None:
+                            continue
+                elif (row.status is None and row.request_hash == request_hash
+                      and row.created_at < time.time() - self.lease):
+                    # The claimant died without finishing. Matching on the
+                    # claim time read makes the takeover atomic: of two
+                    # retries racing for it, only one updates the row.
+                    claimed_at = time.time()
+                    result = conn.execute(statements.TAKE_OVER_IDEMPOTENCY_KEY,
+                                          parameters=dict(key, claimed_at=row.created_at, now=claimed_at))
+                    conn.commit()
+                    if result.rowcount == 1:
+                        return claimed_at, None
+                    continue
+
+            if row.request_hash != request_hash:
+                return None, ({"Error": "This Idempotency-Key was used with a different request"}, 422)
+            if row.status is not None:
+                stored = json.loads(row.body)
+                return None, make_response(stored['data'], row.status, stored['headers'])
+            if time.monotonic() >= deadline:
+                return None, ({"Error": "A request with this Idempotency-Key is still in progress"}, 409)
+            time.sleep(0.05)
+
+    def _complete(self, claim, response):
+        body = json.dumps({'data': response.get_data(as_text=True),
+                           'headers': {'Content-Type': response.headers.get('Content-Type')}})
+        try:
+            with self.get_engine().connect() as conn:
+                conn.execute(statements.COMPLETE_IDEMPOTENCY_KEY,
+                             parameters=dict(claim, status=response.status_code, body=body))
+                conn.commit()
+        except Exception as e:
+            logger.exception(e)
+
+    def _release(self, claim):
+        try:
+            with self.get_engine().connect() as conn:
+                conn.execute(statements.RELEASE_IDEMPOTENCY_KEY, parameters=claim)
+                conn.commit()
+        except Exception as e:
+            logger.exception(e)
+
+    def _maybe_purge(self):
+        with self._claims_lock:
+            self._claims += 1
+            if self._claims % self.purge_every:
+                return
+        try:
+            self.purge()
+        except Exception as e:
+            logger.exception(e)
+
+    def purge(self, batch_size=1000):
+        """Delete expired keys, then the oldest keys beyond max_keys."""
+        engine = self.get_engine()
+        with engine.connect() as conn:
+            before = time.time() - self.ttl
+            if conn.execute(statements.COUNT_IDEMPOTENCY_KEYS).scalar() > self.max_keys:
+                before = max(before, conn.execute(statements.NTH_NEWEST_IDEMPOTENCY_KEY,
+                                                  parameters={'n': max(self.max_keys - 1, 0)}).scalar())
+            while True:
+                rows = conn.execute(statements.SELECT_EXPIRED_IDEMPOTENCY_KEYS,
+                                    parameters={'before': before, 'limit': batch_size}).fetchall()
+                if rows:
+                    conn.execute(statements.DELETE_IDEMPOTENCY_KEY,
+                                 [{'b_client_id': row.client_id, 'b_idem_key': row.idem_key} for row in rows])
+                conn.commit()
+                if len(rows) < batch_size:
+                    return
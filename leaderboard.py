@@ -0,0 +1,158 @@
+"""Top-rated businesses per state and per city, for GET /businesses/top.
+
+Businesses are ranked by a Bayesian average, which counts every business
+as if it also had ``min_reviews`` reviews of ``prior_mean`` stars:
+
+    score = (min_reviews * prior_mean + star_total) / (min_reviews + review_count)
+
+so two five star reviews do not outrank two hundred that average 4.8.
+Businesses with fewer than ``min_reviews`` reviews are not ranked at all.
+
+Review counts and star totals are persisted in ``business_ratings``, which
+the review handlers keep exact in the same transaction as each review
+write. Each process holds a ``Leaderboard``: for every state and every
+(state, city), its ranked businesses in a list sorted by score, so a top-k
+read is a slice under a lock. ``load`` builds it with one query over
+``business_ratings``, a row per business rather than per review. After
+that it follows the change feed: the businesses touched by a page of
+changes are re-read in one query and moved in the lists. Commits in this
+process wake it; it also re-reads the feed every ``poll_interval``
+seconds, which bounds how long other processes' writes take to show.
+"""
+
+import bisect
+import logging
+import threading
+
+import changes
+import statements
+
+logger = logging.getLogger()
+
+
+class Leaderboard:
+    def __init__(self, engine, min_reviews=5, prior_mean=3.5, poll_interval=1.0):
+        self.engine = engine
+        self.min_reviews = min_reviews
+        self.prior_mean = prior_mean
+        self.poll_interval = poll_interval
+        # state, or (state, folded city) -> [(-score, business_id)], ascending
+        self._boards = {}
+        # business_id -> (sort key, its two boards, public entry)
+        self._entries = {}
+        self._since = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def score(self, review_count, star_total):
+        return (self.min_reviews * self.prior_mean + star_total) / (self.min_reviews + review_count)
+
+    def _entry(self, row):
+        score = self.score(row.review_count, row.star_total)
+        entry = {'id': row.id, 'name': row.name, 'city': row.city, 'state': row.state,
+                 'review_count': row.review_count, 'average_stars': round(row.star_total / row.review_count, 2),
+                 'score': round(score, 4)}
+        return (-score, row.id), (row.state, (row.state, row.city.casefold())), entry
+
+    def load(self):
+        """Rebuild every board from business_ratings."""
+        with self.engine.connect() as conn:
+            # Read first, so that changes committed during the load are
+            # applied again afterwards rather than missed
+            since = changes.settled_seq(conn)
+            rows = conn.execute(statements.SELECT_RANKED_BUSINESSES,
+                                parameters={'min_reviews': self.min_reviews}).fetchall()
+        entries = {}
+        boards = {}
+        for row in rows:
+            key, names, entry = entries[row.id] = self._entry(row)
+            for name in names:
+                boards.setdefault(name, []).append(key)
+        # One sort per board instead of an insertion per business
+        for ranked in boards.values():
+            ranked.sort()
+        with self._lock:
+            self._entries = entries
+            self._boards = boards
+            self._since = since
+        return len(rows)
+
+    def _remove(self, business_id):
+        found = self._entries.pop(business_id, None)
+        if found is None:
+            return
+        key, names, _ = found
+        for name in names:
+            ranked = self._boards[name]
+            del ranked[bisect.bisect_left(ranked, key)]
+
+    def _put(self, row):
+        if row.review_count < self.min_reviews:
+            return
+        key, names, entry = self._entries[row.id] = self._entry(row)
+        for name in names:
+            bisect.insort(self._boards.setdefault(name, []), key)
+
+    def refresh(self, business_ids):
+        """Re-read the given businesses and move them on their boards."""
+        business_ids = list(business_ids)
+        if not business_ids:
+            return
+        with self.engine.connect() as conn:
+            rows = conn.execute(statements.SELECT_BUSINESS_RATINGS,
+                                parameters={'business_ids': business_ids}).fetchall()
+        self._apply(business_ids, rows)
+
+    def _apply(self, business_ids, rows):
+        with self._lock:
+            for business_id in business_ids:
+                self._remove(business_id)
+            # A deleted business has no row and stays off the boards
+            for row in rows:
+                self._put(row)
+
+    def top(self, state, city=None, k=10):
+        """The k best ranked businesses of a state, or of a city in it."""
+        state = state.upper()
+        name = state if city is None else (state, city.casefold())
+        with self._lock:
+            ranked = self._boards.get(name, ())
+            return [self._entries[business_id][2] for _, business_id in ranked[:k]]
+
+    def catch_up(self, limit=1000):
+        """Apply one page of the change feed. Returns True once caught up."""
+        with self.engine.connect() as conn:
+            entries = changes.read_changes(conn, self._since, limit)
+            touched = set()
+            for entry in entries:
+                if entry['entity'] == changes.ENTITY_BUSINESS:
+                    touched.add(entry['id'])
+                elif entry['entity'] == changes.ENTITY_REVIEW and entry['data']:
+                    touched.add(entry['data']['business_id'])
+            rows = []
+            if touched:
+                rows = conn.execute(statements.SELECT_BUSINESS_RATINGS,
+                                    parameters={'business_ids': list(touched)}).fetchall()
+        self._apply(touched, rows)
+        if entries:
+            self._since = entries[-1]['seq']
+        return len(entries) < limit
+
+    def start(self):
+        self.load()
+        self._thread = threading.Thread(target=self._run, name='leaderboard', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                caught_up = self.catch_up()
+            except Exception as e:
+                logger.exception(e)
+                caught_up = True
+            if caught_up:
+                changes.wait_for_changes(self.poll_interval)
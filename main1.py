@@ -1,11 +1,26 @@
+import base64
+import heapq
+import itertools
+import os
+import time
+
 from flask import Flask, request
+from google.api_core.exceptions import BadRequest, Conflict
 from google.cloud import datastore
+
+from entity_cache import CachedClient
 # Import the required libraries for SQLite
 import sqlite3
 
 BUSINESSES ='businesses'
 ERROR_NOT_FOUND = {"Error": "No business with this business_id exists"}
 REVIEWS = 'reviews'
+# One entity per (user_id, business_id) that has a review, named after the
+# pair, so the one-review-per-business rule is a key lookup
+REVIEW_GUARDS = 'review_guards'
+ERROR_DUPLICATE_REVIEW = {"Error": "You have already submitted a review for this business. You can update your previous review, or delete it and submit a new review"}
+# Tries of the review transaction when Datastore aborts it for contention
+REVIEW_TRANSACTION_ATTEMPTS = 5
 
 # Path to the SQLite database file
 DB_FILE = 'local_database.db'
@@ -13,8 +28,48 @@ DB_FILE = 'local_database.db'
 # Establish a connection to SQLite
 db_connection = sqlite3.connect(DB_FILE)
 
+# Entities kept by the process-wide cache (0 turns it off) and for how
+# many seconds an entry is trusted; other instances do not invalidate it.
+# The per-request cache is always on.
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 0))
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 30))
+
+# Seconds a page of GET /reviews/recent may be cached for
+RECENT_REVIEWS_MAX_AGE = int(os.environ.get('RECENT_REVIEWS_MAX_AGE', 5))
+
 app = Flask(__name__)
-client = datastore.Client()
+
+# The client is created on first use, not at import: building it resolves
+# credentials and opens channels, which slows cold starts, and a client
+# created before gunicorn forks must not be shared by the workers
+_client = None
+_client_pid = None
+
+
+def get_client():
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = CachedClient(datastore.Client(), max_entities=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
+        _client_pid = os.getpid()
+    return _client
+
+
+def review_guard_key(client, user_id, business_id):
+    return client.key(REVIEW_GUARDS, '%d:%d' % (user_id, business_id))
+
+
+def backfill_review_guards():
+    """Create the guards of reviews written before guards existed.
+
+    Run once after deploying, e.g. from a shell with ``import main1;
+    main1.backfill_review_guards()``; until then those reviews are not
+    protected against a second review of the same business.
+    """
+    client = get_client()
+    guards = [datastore.Entity(key=review_guard_key(client, review['user_id'], review['business_id']))
+              for review in client.query(kind=REVIEWS).fetch()]
+    for i in range(0, len(guards), 500):
+        client.put_multi(guards[i:i + 500])
 
 
 @app.route("/" + BUSINESSES, methods=['POST'])
@@ -27,7 +82,7 @@ def post_businesses():
     if missing_fields:
         return ({"Error": "The request body is missing at least one of the required attributes"}), 400
 
-    new_key = client.key(BUSINESSES)
+    new_key = get_client().key(BUSINESSES)
     new_business = datastore.Entity(key=new_key)
     new_business.update({  
         "owner_id": content['owner_id'],  
@@ -37,13 +92,13 @@ def post_businesses():
         "state": content['state'],
         "zip_code": int(content['zip_code'])
     })
-    client.put(new_business)
+    get_client().put(new_business)
     new_business['id'] = new_business.key.id
     return (new_business, 201)
 
 @app.route("/" + BUSINESSES, methods=['GET'])
 def get_businesses():
-    query = client.query(kind=BUSINESSES)
+    query = get_client().query(kind=BUSINESSES)
     results = list(query.fetch())
     for r in results:
         r['id'] = r.key.id
@@ -51,8 +106,8 @@ def get_businesses():
 
 @app.route("/" + BUSINESSES + "/<int:id>", methods=['GET'])
 def get_business(id):
-    business_key = client.key(BUSINESSES, id)
-    business = client.get(key=business_key)
+    business_key = get_client().key(BUSINESSES, id)
+    business = get_client().get(key=business_key)
     if business is None:
         return ERROR_NOT_FOUND, 404
     else:
@@ -63,12 +118,12 @@ def get_business(id):
 def put_business(id):
     content = request.get_json()
 
-    business_key = client.key(BUSINESSES, id)
-    business = client.get(key=business_key)
+    business_key = get_client().key(BUSINESSES, id)
+    business = get_client().get(key=business_key)
     if business is None:
         return ERROR_NOT_FOUND, 404
     else:
-        # new_key = client.key(BUSINESSES)
+        # new_key = get_client().key(BUSINESSES)
         # new_business = datastore.Entity(key=new_key)
 
         # Check if all required fields are present
@@ -85,30 +140,74 @@ def put_business(id):
             "state": content['state'],
             "zip_code": int(content['zip_code'])
         })
-    client.put(business)
+    get_client().put(business)
     business['id'] = business.key.id
     return (business, 200)
 
 @app.route("/" + BUSINESSES + "/<int:id>", methods=['DELETE'])
 def delete_business(id):
-    business_key = client.key(BUSINESSES, id)
-    business = client.get(key=business_key)
+    business_key = get_client().key(BUSINESSES, id)
+    business = get_client().get(key=business_key)
     if business is None:
         return  ERROR_NOT_FOUND, 404
     else:
         # Must delete reviews associated with deleted business
-        review_query = client.query(kind=REVIEWS)
+        review_query = get_client().query(kind=REVIEWS)
         review_query.add_filter('business_id', '=', id)
         reviews = list(review_query.fetch())
+        keys = []
         for review in reviews:
-            client.delete(review.key)
-
-        client.delete(business_key)
+            keys.append(review.key)
+            keys.append(review_guard_key(get_client(), review['user_id'], review['business_id']))
+        # Last, so a failure part way leaves the business to delete again
+        keys.append(business_key)
+        for i in range(0, len(keys), 500):
+            get_client().delete_multi(keys[i:i + 500])
         return ('', 204)
     
+# Reviews of a business one page at a time. Datastore query cursors are the
+# keyset: each page resumes where the index scan of the previous one ended.
+# The composite indexes are declared in index.yaml.
+@app.route("/" + BUSINESSES + "/<int:id>/" + REVIEWS, methods=['GET'])
+def get_business_reviews(id):
+    limit = request.args.get('limit', default=20, type=int)
+    min_stars = request.args.get('min_stars', type=int)
+    cursor = request.args.get('cursor')
+    if not 1 <= limit <= 100:
+        return ({"Error": "limit must be from 1 to 100"}), 400
+    if min_stars is not None and not 1 <= min_stars <= 5:
+        return ({"Error": "min_stars must be a whole number from 1 to 5"}), 400
+
+    if get_client().get(get_client().key(BUSINESSES, id)) is None:
+        return ERROR_NOT_FOUND, 404
+
+    query = get_client().query(kind=REVIEWS)
+    query.add_filter('business_id', '=', id)
+    if min_stars is not None:
+        query.add_filter('stars', '>=', min_stars)
+        # The property with the inequality filter has to be sorted on first
+        query.order = ['stars', '__key__']
+    else:
+        query.order = ['__key__']
+    try:
+        iterator = query.fetch(limit=limit, start_cursor=cursor)
+        results = list(next(iterator.pages))
+    except BadRequest:
+        return ({"Error": "The cursor is not valid for this query"}), 400
+
+    for r in results:
+        r['id'] = r.key.id
+    next_page_url = None
+    if len(results) == limit and iterator.next_page_token:
+        next_page_url = (request.url_root + BUSINESSES + "/" + str(id) + "/" + REVIEWS
+                         + "?limit=" + str(limit) + "&cursor=" + iterator.next_page_token.decode('ascii'))
+        if min_stars is not None:
+            next_page_url += "&min_stars=" + str(min_stars)
+    return {"entries": results, "next": next_page_url}
+
 @app.route("/owners/<int:owner_id>/businesses", methods=['GET'])
 def get_owner_businesses(owner_id):
-    query = client.query(kind=BUSINESSES)
+    query = get_client().query(kind=BUSINESSES)
     query.add_filter('owner_id', '=', owner_id)
     results = list(query.fetch())
     
@@ -127,46 +226,132 @@ def post_reviews():
     if missing_fields:
         return ({"Error": "The request body is missing at least one of the required attributes"}), 400
     
-    # Check if the business with the provided business_id exists
+    client = get_client()
     business_id = int(content['business_id'])
-    business_key = client.key('businesses', business_id)
-    business = client.get(business_key)
-    if business is None:
-        return ({"Error": "No business with this business_id exists"}), 404
-    
-    # Check if a review by the provided user_id already exists for the business
     user_id = int(content['user_id'])
-    existing_review_query = client.query(kind=REVIEWS)
-    existing_review_query.add_filter('user_id', '=', user_id)
-    existing_review_query.add_filter('business_id', '=', business_id)
-    existing_reviews = list(existing_review_query.fetch())
-    if existing_reviews:
-        return ({"Error": "You have already submitted a review for this business. You can update your previous review, or delete it and submit a new review"}), 409  # Review already exists
+    business_key = client.key(BUSINESSES, business_id)
+    guard_key = review_guard_key(client, user_id, business_id)
 
     new_key = client.key(REVIEWS)
     new_reviews = datastore.Entity(key=new_key)
+    now = time.time()
     new_reviews.update({   
-        "user_id": int(content['user_id']),
-        "business_id": int(content['business_id']),
+        "user_id": user_id,
+        "business_id": business_id,
         "stars": content['stars'],
-        "review_text": content.get('review_text', '')
+        "review_text": content.get('review_text', ''),
+        "created_at": now,
+        "updated_at": now
     })
-    client.put(new_reviews)
+
+    # The business and an existing review are checked with one strongly
+    # consistent lookup, and the guard is written with the review. Two
+    # concurrent posts for the same pair both read the guard, so the
+    # second one to commit is aborted rather than creating a duplicate.
+    # An abort only says there was contention, which may have been over
+    # the business; the transaction is run again, and the guard it reads
+    # then tells whether a review for the pair got there first.
+    for attempt in range(REVIEW_TRANSACTION_ATTEMPTS):
+        try:
+            with client.transaction():
+                found = {entity.key: entity for entity in client.get_multi([business_key, guard_key])}
+                if business_key not in found:
+                    return ({"Error": "No business with this business_id exists"}), 404
+                if guard_key in found:
+                    return ERROR_DUPLICATE_REVIEW, 409  # Review already exists
+                # The review's id is filled in when the transaction commits
+                client.put_multi([datastore.Entity(key=guard_key), new_reviews])
+            break
+        except Conflict:
+            if attempt + 1 < REVIEW_TRANSACTION_ATTEMPTS:
+                time.sleep(0.05 * 2 ** attempt)
+    else:
+        return {"Error": "The review could not be saved, try again later"}, 503, {'Retry-After': '1'}
     new_reviews['id'] = new_reviews.key.id
     return (new_reviews, 201)
 
 @app.route("/" + REVIEWS, methods=['GET'])
 def get_reviews():
-    query = client.query(kind=REVIEWS)
+    query = get_client().query(kind=REVIEWS)
     results = list(query.fetch())
     for r in results:
         r['id'] = r.key.id
     return results
 
+def encode_review_cursor(review):
+    raw = '%r:%d' % (review['created_at'], review.key.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_review_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, _, review_id = raw.partition(':')
+    return float(created_at), int(review_id)
+
+def newest_reviews(business_id=None, before=None):
+    """Reviews newest first, of one business or all, after the cursor."""
+    query = get_client().query(kind=REVIEWS)
+    if business_id is not None:
+        query.add_filter('business_id', '=', business_id)
+    query.order = ['-created_at', '-__key__']
+    if before is None:
+        return query.fetch()
+    # Only the index range from the cursor's timestamp down is read. The
+    # reviews sharing that timestamp come first; the cursor review and
+    # those before it in key order are skipped.
+    query.add_filter('created_at', '<=', before[0])
+    return (review for review in query.fetch()
+            if review['created_at'] < before[0] or review.key.id < before[1])
+
+# Newest reviews first, across the site or of one business (?business_id=)
+# or one owner's businesses (?owner_id=), with the same cursors as main.py
+@app.route("/" + REVIEWS + "/recent", methods=['GET'])
+def get_recent_reviews():
+    business_id = request.args.get('business_id', type=int)
+    owner_id = request.args.get('owner_id', type=int)
+    limit = request.args.get('limit', default=20, type=int)
+    if business_id is not None and owner_id is not None:
+        return ({"Error": "Give business_id or owner_id, not both"}), 400
+    if not 1 <= limit <= 100:
+        return ({"Error": "limit must be from 1 to 100"}), 400
+    before = None
+    if 'cursor' in request.args:
+        try:
+            before = decode_review_cursor(request.args['cursor'])
+        except ValueError:
+            return ({"Error": "The cursor is not valid"}), 400
+
+    if owner_id is not None:
+        # No joins in Datastore: the feeds of the owner's businesses are
+        # merged, each read only as far as the page needs
+        query = get_client().query(kind=BUSINESSES)
+        query.add_filter('owner_id', '=', owner_id)
+        query.keys_only()
+        feeds = [newest_reviews(key.id, before) for key in query.fetch()]
+        reviews = heapq.merge(*feeds, key=lambda review: (review['created_at'], review.key.id), reverse=True)
+    else:
+        if business_id is not None and get_client().get(get_client().key(BUSINESSES, business_id)) is None:
+            return ERROR_NOT_FOUND, 404
+        reviews = newest_reviews(business_id, before)
+    results = list(itertools.islice(reviews, limit + 1))
+
+    next_page_url = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_page_url = (request.url_root + REVIEWS + "/recent?cursor=" + encode_review_cursor(results[-1])
+                         + "&limit=" + str(limit))
+        if business_id is not None:
+            next_page_url += "&business_id=" + str(business_id)
+        if owner_id is not None:
+            next_page_url += "&owner_id=" + str(owner_id)
+    for r in results:
+        r['id'] = r.key.id
+    return ({"entries": results, "next": next_page_url}, 200,
+            {'Cache-Control': 'public, max-age=%d' % RECENT_REVIEWS_MAX_AGE})
+
 @app.route("/" + REVIEWS + "/<int:id>", methods=['GET'])
 def get_review(id):
-    review_key = client.key(REVIEWS, id)
-    review = client.get(key=review_key)
+    review_key = get_client().key(REVIEWS, id)
+    review = get_client().get(key=review_key)
     if review is None:
         return ({"Error": "No review with this review_id exists"}), 404
     else:
@@ -178,8 +363,8 @@ def put_review(id):
     content = request.get_json()
 
     # Check if review exists
-    review_key = client.key(REVIEWS, id)
-    review = client.get(key=review_key)
+    review_key = get_client().key(REVIEWS, id)
+    review = get_client().get(key=review_key)
     if review is None:
         return {"Error": "No review with this review_id exists"}, 404
     else:
@@ -193,24 +378,27 @@ def put_review(id):
         review['stars'] = content['stars']
         if 'review_text' in content and content['review_text'] != "":
             review['review_text'] = content['review_text']
+        review['updated_at'] = time.time()
 
-    client.put(review)
+    get_client().put(review)
     review['id'] = review.key.id
     return (review, 200)
 
 @app.route("/" + REVIEWS + "/<int:id>", methods=['DELETE'])
 def delete_review(id):
-    review_key = client.key(REVIEWS, id)
-    review = client.get(key=review_key)
+    review_key = get_client().key(REVIEWS, id)
+    review = get_client().get(key=review_key)
     if review is None:
         return  ({"Error": "No review with this review_id exists"}), 404
     else:
-        client.delete(review_key)
+        # Dropping the guard lets the user review the business again
+        get_client().delete_multi([review_key,
+                                   review_guard_key(get_client(), review['user_id'], review['business_id'])])
         return ('', 204)
     
 @app.route("/users/<int:user_id>/reviews", methods=['GET'])
 def get_user_reviews(user_id):
-    query = client.query(kind=REVIEWS)
+    query = get_client().query(kind=REVIEWS)
     query.add_filter('user_id', '=', user_id)
     results = list(query.fetch())
     
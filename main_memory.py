@@ -0,0 +1,152 @@
+from flask import Flask, request
+import os
+
+from memory_store import MemoryStore, NotFound, Conflict
+
+BUSINESSES ='businesses'
+ERROR_NOT_FOUND = {"Error": "No business with this business_id exists"}
+ERROR_REVIEW_NOT_FOUND = {"Error": "No review with this review_id exists"}
+ERROR_MISSING_ATTRIBUTES = {"Error": "The request body is missing at least one of the required attributes"}
+REVIEWS = 'reviews'
+
+# Optional append-only snapshot so the data survives a restart
+SNAPSHOT_FILE = os.environ.get('MEMORY_SNAPSHOT')
+
+store = MemoryStore(SNAPSHOT_FILE)
+
+app = Flask(__name__)
+
+
+def business_response(business):
+    response_body = business.to_dict()
+    response_body['self'] = request.url_root + BUSINESSES + "/" + str(business.id)
+    return response_body
+
+
+def review_response(review):
+    return {
+        "id": review.id,
+        "user_id": review.user_id,
+        "business": request.url_root + BUSINESSES + "/" + str(review.business_id),
+        "stars": review.stars,
+        "review_text": review.review_text,
+        "self": request.url_root + REVIEWS + "/" + str(review.id)
+    }
+
+
+@app.route("/" + BUSINESSES, methods=['POST'])
+def post_businesses():
+    content = request.get_json()
+
+    # Check if all required fields are present
+    required_fields = ['name', 'street_address', 'city', 'state', 'zip_code']
+    missing_fields = [field for field in required_fields if field not in content] # Get any field that is missing
+    if missing_fields:
+        return ERROR_MISSING_ATTRIBUTES, 400
+
+    business = store.create_business(content['name'], content['street_address'], content.get('owner_id'),
+                                      content['city'], content['state'], content['zip_code'])
+    return business_response(business), 201
+
+
+@app.route("/" + BUSINESSES + "/<int:business_id>", methods=['GET'])
+def get_business(business_id):
+    business = store.get_business(business_id)
+    if business is None:
+        return ERROR_NOT_FOUND, 404
+    return business_response(business), 200
+
+
+@app.route("/" + BUSINESSES, methods=['GET'])
+def get_all_businesses():
+    offset = request.args.get('offset', default=0, type=int)
+    limit = request.args.get('limit', default=3, type=int)
+
+    businesses = [business_response(business) for business in store.list_businesses(offset, limit)]
+    next_page_url = request.url_root + BUSINESSES + "?offset=" + str(offset + limit) + "&limit=" + str(limit)
+    return {"entries": businesses, "next": next_page_url}, 200
+
+
+@app.route("/" + BUSINESSES + "/<int:business_id>", methods=['PUT'])
+def put_business(business_id):
+    content = request.get_json()
+
+    required_fields = ['name', 'street_address', 'owner_id', 'city', 'state', 'zip_code']
+    missing_fields = [field for field in required_fields if field not in content]
+    if missing_fields:
+        return ERROR_MISSING_ATTRIBUTES, 400
+
+    business = store.update_business(business_id, content['name'], content['street_address'], content['owner_id'],
+                                      content['city'], content['state'], content['zip_code'])
+    if business is None:
+        return ERROR_NOT_FOUND, 404
+    return business_response(business), 200
+
+
+@app.route("/" + BUSINESSES + "/<int:business_id>", methods=['DELETE'])
+def delete_business(business_id):
+    # Deleting a business also deletes its reviews
+    if not store.delete_business(business_id):
+        return ERROR_NOT_FOUND, 404
+    return '', 204
+
+
+@app.route("/owners/<int:owner_id>/businesses", methods=['GET'])
+def get_owner_businesses(owner_id):
+    return [business_response(business) for business in store.owner_businesses(owner_id)], 200
+
+
+@app.route("/" + REVIEWS, methods=['POST'])
+def post_reviews():
+    content = request.get_json()
+
+    required_fields = ['user_id', 'business_id', 'stars']
+    missing_fields = [field for field in required_fields if field not in content]
+    if missing_fields:
+        return ERROR_MISSING_ATTRIBUTES, 400
+
+    try:
+        review = store.create_review(content['user_id'], content['business_id'], content['stars'],
+                                     content.get('review_text', ''))
+    except NotFound:
+        return ERROR_NOT_FOUND, 404
+    except Conflict:
+        return {"Error": "You have already submitted a review for this business. You can update your previous review, or delete it and submit a new review"}, 409
+    return review_response(review), 201
+
+
+@app.route("/" + REVIEWS + "/<int:review_id>", methods=['GET'])
+def get_review(review_id):
+    review = store.get_review(review_id)
+    if review is None:
+        return ERROR_REVIEW_NOT_FOUND, 404
+    return review_response(review), 200
+
+
+@app.route("/" + REVIEWS + "/<int:review_id>", methods=['PUT'])
+def put_review(review_id):
+    content = request.get_json()
+
+    if 'stars' not in content:
+        return ERROR_MISSING_ATTRIBUTES, 400
+
+    review = store.update_review(review_id, content['stars'], content.get('review_text'))
+    if review is None:
+        return ERROR_REVIEW_NOT_FOUND, 404
+    return review_response(review), 200
+
+
+@app.route("/" + REVIEWS + "/<int:review_id>", methods=['DELETE'])
+def delete_review(review_id):
+    if not store.delete_review(review_id):
+        return ERROR_REVIEW_NOT_FOUND, 404
+    return '', 204
+
+
+@app.route("/users/<int:user_id>/reviews", methods=['GET'])
+def get_user_reviews(user_id):
+    return [review_response(review) for review in store.user_reviews(user_id)], 200
+
+
+if __name__ == "__main__":
+    app.run(host="127.0.0.1", port=8080, debug=True)
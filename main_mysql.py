@@ -251,6 +251,57 @@ def get_owner_businesses(owner_id):
     except sqlite3.Error as e:
         return ({"Error": "An error occurred while fetching the businesses associated with the owner", "details": str(e)}), 500
     
+# Reviews of a business, oldest first, in keyset pages: ?after=<last id>
+@app.route("/" + BUSINESSES + "/<int:business_id>/" + REVIEWS, methods=['GET'])
+def get_business_reviews(business_id):
+    after = request.args.get('after', default=0, type=int)
+    limit = request.args.get('limit', default=20, type=int)
+    min_stars = request.args.get('min_stars')
+    if not 1 <= limit <= 100:
+        return ({"Error": "limit must be from 1 to 100"}), 400
+    if min_stars is not None:
+        # Checked as text, so that min_stars=abc is refused rather than ignored
+        if min_stars not in ('1', '2', '3', '4', '5'):
+            return ({"Error": "min_stars must be a whole number from 1 to 5"}), 400
+        min_stars = int(min_stars)
+    try:
+        connection = sqlite3.connect(DB_FILE)
+        cursor = connection.cursor()
+
+        cursor.execute("SELECT id FROM businesses WHERE id=?", (business_id,))
+        if cursor.fetchone() is None:
+            connection.close()
+            return ERROR_NOT_FOUND, 404
+
+        # Served by the reviews_business_page (business_id, id) index: the
+        # scan starts right after the last id of the previous page
+        cursor.execute("SELECT id, user_id, business_id, stars, review_text FROM reviews "
+                       "WHERE business_id=? AND id>? AND stars>=? ORDER BY id LIMIT ?",
+                       (business_id, after, min_stars or 1, limit + 1))
+        rows = cursor.fetchall()
+        connection.close()
+
+        response_body = []
+        for review in rows[:limit]:
+            response_body.append({
+                "id": review[0],
+                "user_id": review[1],
+                "business": request.url_root + "businesses/" + str(review[2]),
+                "stars": review[3],
+                "review_text": review[4],
+                "self": request.url_root + "reviews/" + str(review[0])
+            })
+
+        next_page_url = None
+        if len(rows) > limit:
+            next_page_url = (request.url_root + BUSINESSES + "/" + str(business_id) + "/" + REVIEWS
+                             + "?after=" + str(rows[limit - 1][0]) + "&limit=" + str(limit))
+            if min_stars is not None:
+                next_page_url += "&min_stars=" + str(min_stars)
+        return {"entries": response_body, "next": next_page_url}, 200
+    except sqlite3.Error as e:
+        return ({"Error": "An error occurred while fetching the reviews", "details": str(e)}), 500
+
 @app.route("/reviews", methods=['POST'])
 def post_reviews():
     try:
@@ -0,0 +1,116 @@
+"""Turn database rows into API representations.
+
+Rows are read by column name, never by position, so adding a column to a
+table cannot shift the values returned to clients. The list endpoints also
+accept a ``fields`` query parameter (e.g. ``?fields=id,stars,business``);
+only the columns those fields need are selected from the database.
+
+Links can be rendered three ways, picked with ``?links=`` or, for compact,
+the ``application/vnd.compact+json`` media type:
+
+* full (default): absolute URLs in every ``self``/``business`` link.
+* relative: root-relative paths such as ``/businesses/7``.
+* compact: no link fields at all; a review's ``business`` is the bare id
+  and the response carries the URL root once, under ``base``.
+"""
+
+BUSINESSES = 'businesses'
+REVIEWS = 'reviews'
+
+BUSINESS_FIELDS = ('id', 'name', 'street_address', 'owner_id', 'city', 'state', 'zip_code', 'self')
+REVIEW_FIELDS = ('id', 'user_id', 'business', 'stars', 'review_text', 'created_at', 'updated_at', 'self')
+
+LINKS_FULL = 'full'
+LINKS_RELATIVE = 'relative'
+LINKS_COMPACT = 'compact'
+COMPACT_MEDIA_TYPE = 'application/vnd.compact+json'
+
+# Column each API field is read from, in table order. 'id' is always
+# selected because the 'self' link needs it.
+_BUSINESS_SOURCES = {'id': 'id', 'name': 'name', 'street_address': 'street_address',
+                     'owner_id': 'owner_id', 'city': 'city', 'state': 'state',
+                     'zip_code': 'zip_code', 'self': 'id'}
+_REVIEW_SOURCES = {'id': 'id', 'user_id': 'user_id', 'business': 'business_id',
+                   'stars': 'stars', 'review_text': 'review_text', 'created_at': 'created_at',
+                   'updated_at': 'updated_at', 'self': 'id'}
+_BUSINESS_COLUMN_ORDER = ('id', 'name', 'street_address', 'owner_id', 'city', 'state', 'zip_code')
+_REVIEW_COLUMN_ORDER = ('id', 'user_id', 'business_id', 'stars', 'review_text', 'created_at', 'updated_at')
+
+
+class InvalidFields(ValueError):
+    """Raised when ?fields= names something the resource does not have."""
+
+
+def parse_fields(raw, allowed):
+    """Parse a comma separated ?fields= value. Returns ``allowed`` when absent."""
+    if raw is None:
+        return allowed
+    fields = tuple(field.strip() for field in raw.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise InvalidFields(unknown)
+    return fields
+
+
+class InvalidLinks(ValueError):
+    """Raised when ?links= is not one of full, relative or compact."""
+
+
+def parse_links(raw, accept_mimetypes):
+    """Pick the link style from ?links=, falling back to the Accept header."""
+    if raw is None:
+        if accept_mimetypes.best_match(['application/json', COMPACT_MEDIA_TYPE]) == COMPACT_MEDIA_TYPE:
+            return LINKS_COMPACT
+        return LINKS_FULL
+    if raw not in (LINKS_FULL, LINKS_RELATIVE, LINKS_COMPACT):
+        raise InvalidLinks(raw)
+    return raw
+
+
+def compact_fields(fields):
+    """Fields for the compact style: 'self' is dropped, but the id it linked to is kept."""
+    compact = tuple(field for field in fields if field != 'self')
+    if 'self' in fields and 'id' not in compact:
+        compact = ('id',) + compact
+    return compact
+
+
+def _columns(fields, sources, order):
+    needed = {'id'} | {sources[field] for field in fields}
+    return tuple(column for column in order if column in needed)
+
+
+def business_columns(fields=BUSINESS_FIELDS):
+    return _columns(fields, _BUSINESS_SOURCES, _BUSINESS_COLUMN_ORDER)
+
+
+def review_columns(fields=REVIEW_FIELDS):
+    return _columns(fields, _REVIEW_SOURCES, _REVIEW_COLUMN_ORDER)
+
+
+def business_to_json(row, url_root, fields=BUSINESS_FIELDS):
+    # url_root=None is the compact style, see compact_fields()
+    values = row._mapping
+    business = {}
+    for field in fields:
+        if field == 'self':
+            business['self'] = url_root + BUSINESSES + "/" + str(values['id'])
+        else:
+            business[field] = values[field]
+    return business
+
+
+def review_to_json(row, url_root, fields=REVIEW_FIELDS):
+    values = row._mapping
+    review = {}
+    for field in fields:
+        if field == 'self':
+            review['self'] = url_root + REVIEWS + "/" + str(values['id'])
+        elif field == 'business':
+            if url_root is None:
+                review['business'] = values['business_id']
+            else:
+                review['business'] = url_root + BUSINESSES + "/" + str(values['business_id'])
+        else:
+            review[field] = values[field]
+    return review
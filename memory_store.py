@@ -0,0 +1,261 @@
+"""In-memory storage for businesses and reviews.
+
+Records are small ``__slots__`` objects held in dicts keyed by id, with hash
+indexes on owner_id, user_id, business_id and (user_id, business_id). The
+semantics follow the SQL backends: ids are never reused, a review needs an
+existing business and is unique per (user_id, business_id), and deleting a
+business deletes its reviews.
+
+If a snapshot path is given every mutation is appended to it as one JSON
+line, and the file is replayed on start so the store survives a restart.
+``compact()`` rewrites the file with just the live records.
+"""
+
+import itertools
+import json
+import os
+import threading
+
+
+class NotFound(Exception):
+    """Raised when a review refers to a business that does not exist."""
+
+
+class Conflict(Exception):
+    """Raised when the user already reviewed the business."""
+
+
+class Business:
+    __slots__ = ('id', 'name', 'street_address', 'owner_id', 'city', 'state', 'zip_code')
+    FIELDS = __slots__
+
+    def __init__(self, id, name, street_address, owner_id, city, state, zip_code):
+        self.id = id
+        self.name = name
+        self.street_address = street_address
+        self.owner_id = owner_id
+        self.city = city
+        self.state = state
+        self.zip_code = zip_code
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class Review:
+    __slots__ = ('id', 'user_id', 'business_id', 'stars', 'review_text')
+    FIELDS = __slots__
+
+    def __init__(self, id, user_id, business_id, stars, review_text):
+        self.id = id
+        self.user_id = user_id
+        self.business_id = business_id
+        self.stars = stars
+        self.review_text = review_text
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class MemoryStore:
+    def __init__(self, snapshot_path=None):
+        self._lock = threading.RLock()
+        self.businesses = {}
+        self.reviews = {}
+        # Secondary indexes: key -> {id: None}, a dict used as an ordered set
+        self._by_owner = {}
+        self._by_user = {}
+        self._by_business = {}
+        # (user_id, business_id) -> review id, enforces one review per pair
+        self._by_user_business = {}
+        self._next_business_id = 1
+        self._next_review_id = 1
+        self._snapshot_path = snapshot_path
+        self._snapshot = None
+        if snapshot_path is not None:
+            if os.path.exists(snapshot_path):
+                self._replay(snapshot_path)
+            self._snapshot = open(snapshot_path, 'a', encoding='utf-8')
+
+    # Businesses
+
+    def create_business(self, name, street_address, owner_id, city, state, zip_code):
+        with self._lock:
+            business = Business(self._next_business_id, name, street_address, owner_id, city, state, zip_code)
+            self._put_business(business)
+            self._log('business', business.to_dict())
+            return business
+
+    def get_business(self, business_id):
+        return self.businesses.get(business_id)
+
+    def list_businesses(self, offset, limit):
+        with self._lock:
+            return list(itertools.islice(self.businesses.values(), offset, offset + limit))
+
+    def owner_businesses(self, owner_id):
+        with self._lock:
+            return [self.businesses[i] for i in self._by_owner.get(owner_id, ())]
+
+    def update_business(self, business_id, name, street_address, owner_id, city, state, zip_code):
+        """Returns the updated business, or None if it does not exist."""
+        with self._lock:
+            if business_id not in self.businesses:
+                return None
+            business = Business(business_id, name, street_address, owner_id, city, state, zip_code)
+            self._put_business(business)
+            self._log('business', business.to_dict())
+            return business
+
+    def delete_business(self, business_id):
+        """Deletes the business and its reviews. Returns False if it did not exist."""
+        with self._lock:
+            if business_id not in self.businesses:
+                return False
+            for review_id in list(self._by_business.get(business_id, ())):
+                self._remove_review(review_id)
+            self._remove_business(business_id)
+            self._log('delete_business', {'id': business_id})
+            return True
+
+    # Reviews
+
+    def create_review(self, user_id, business_id, stars, review_text):
+        with self._lock:
+            if business_id not in self.businesses:
+                raise NotFound(business_id)
+            if (user_id, business_id) in self._by_user_business:
+                raise Conflict((user_id, business_id))
+            review = Review(self._next_review_id, user_id, business_id, stars, review_text)
+            self._put_review(review)
+            self._log('review', review.to_dict())
+            return review
+
+    def get_review(self, review_id):
+        return self.reviews.get(review_id)
+
+    def user_reviews(self, user_id):
+        with self._lock:
+            return [self.reviews[i] for i in self._by_user.get(user_id, ())]
+
+    def update_review(self, review_id, stars, review_text=None):
+        """Returns the updated review, or None if it does not exist.
+
+        A review_text of None keeps the current text.
+        """
+        with self._lock:
+            old = self.reviews.get(review_id)
+            if old is None:
+                return None
+            if review_text is None:
+                review_text = old.review_text
+            review = Review(review_id, old.user_id, old.business_id, stars, review_text)
+            self._put_review(review)
+            self._log('review', review.to_dict())
+            return review
+
+    def delete_review(self, review_id):
+        with self._lock:
+            if review_id not in self.reviews:
+                return False
+            self._remove_review(review_id)
+            self._log('delete_review', {'id': review_id})
+            return True
+
+    # Snapshot
+
+    def compact(self):
+        """Rewrite the snapshot so it holds one line per live record."""
+        if self._snapshot_path is None:
+            return
+        with self._lock:
+            tmp_path = self._snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for business in self.businesses.values():
+                    f.write(json.dumps(['business', business.to_dict()]) + '\n')
+                for review in self.reviews.values():
+                    f.write(json.dumps(['review', review.to_dict()]) + '\n')
+                # Keep id counters moving forward past deleted records
+                f.write(json.dumps(['next_ids', {'business': self._next_business_id,
+                                                 'review': self._next_review_id}]) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._snapshot.close()
+            os.replace(tmp_path, self._snapshot_path)
+            self._snapshot = open(self._snapshot_path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    def _log(self, op, record):
+        if self._snapshot is not None:
+            self._snapshot.write(json.dumps([op, record]) + '\n')
+            self._snapshot.flush()
+
+    def _replay(self, path):
+        valid_bytes = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                # A torn last line from a crash mid-write is cut off below,
+                # so new records are not appended onto it.
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    op, record = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                if op == 'business':
+                    self._put_business(Business(**record))
+                elif op == 'review':
+                    self._put_review(Review(**record))
+                elif op == 'delete_business':
+                    for review_id in list(self._by_business.get(record['id'], ())):
+                        self._remove_review(review_id)
+                    self._remove_business(record['id'])
+                elif op == 'delete_review':
+                    self._remove_review(record['id'])
+                elif op == 'next_ids':
+                    self._next_business_id = max(self._next_business_id, record['business'])
+                    self._next_review_id = max(self._next_review_id, record['review'])
+        if valid_bytes < os.path.getsize(path):
+            os.truncate(path, valid_bytes)
+
+    # Index maintenance
+
+    def _put_business(self, business):
+        old = self.businesses.get(business.id)
+        if old is not None and old.owner_id != business.owner_id:
+            _unindex(self._by_owner, old.owner_id, old.id)
+        self.businesses[business.id] = business
+        self._by_owner.setdefault(business.owner_id, {})[business.id] = None
+        self._next_business_id = max(self._next_business_id, business.id + 1)
+
+    def _remove_business(self, business_id):
+        business = self.businesses.pop(business_id, None)
+        if business is not None:
+            _unindex(self._by_owner, business.owner_id, business_id)
+
+    def _put_review(self, review):
+        self.reviews[review.id] = review
+        self._by_user.setdefault(review.user_id, {})[review.id] = None
+        self._by_business.setdefault(review.business_id, {})[review.id] = None
+        self._by_user_business[(review.user_id, review.business_id)] = review.id
+        self._next_review_id = max(self._next_review_id, review.id + 1)
+
+    def _remove_review(self, review_id):
+        review = self.reviews.pop(review_id, None)
+        if review is not None:
+            _unindex(self._by_user, review.user_id, review_id)
+            _unindex(self._by_business, review.business_id, review_id)
+            del self._by_user_business[(review.user_id, review.business_id)]
+
+
+def _unindex(index, key, record_id):
+    ids = index.get(key)
+    if ids is not None:
+        ids.pop(record_id, None)
+        if not ids:
+            del index[key]
@@ -0,0 +1,135 @@
+"""Schema tightening migration for databases created before compact types.
+
+Brings existing MySQL tables in line with ``main.create_table``:
+
+* businesses.state    TEXT         -> CHAR(2)
+* businesses.zip_code INTEGER      -> CHAR(5), zero padded again
+* reviews.stars       INTEGER      -> TINYINT UNSIGNED, CHECK 1-5
+* reviews.review_text VARCHAR(1000) -> VARBINARY(4001) holding
+  ``statements.CompressedText`` values
+* users.username      TEXT         -> VARCHAR(100)
+
+Rows that would not fit are counted first and the migration stops without
+changing anything if there are any. Each step checks the current column
+type, so running it again skips what is already done. ALTER TABLE rebuilds
+the table, so run it with the API stopped:
+
+    python migrations.py --batch-size 5000
+"""
+
+import logging
+
+import sqlalchemy
+
+import statements
+
+logger = logging.getLogger()
+
+# (description, query counting rows that do not fit the new types)
+PREFLIGHT = (
+    ('businesses with a state that is not two characters',
+     'SELECT COUNT(*) FROM businesses WHERE CHAR_LENGTH(state) <> 2'),
+    ('businesses with a zip_code outside 0-99999',
+     'SELECT COUNT(*) FROM businesses WHERE zip_code NOT BETWEEN 0 AND 99999'),
+    ('reviews with stars outside 1-5',
+     'SELECT COUNT(*) FROM reviews WHERE stars NOT BETWEEN 1 AND 5'),
+    ('users with a username over 100 characters',
+     'SELECT COUNT(*) FROM users WHERE CHAR_LENGTH(username) > 100'),
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+def column_type(conn, table, column):
+    return conn.execute(sqlalchemy.text(
+        'SELECT COLUMN_TYPE FROM information_schema.COLUMNS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column'),
+        {'table': table, 'column': column}).scalar()
+
+
+def preflight(conn):
+    problems = []
+    for description, query in PREFLIGHT:
+        count = conn.execute(sqlalchemy.text(query)).scalar()
+        if count:
+            problems.append('%d %s' % (count, description))
+    return problems
+
+
+def migrate(engine, batch_size=5000):
+    with engine.connect() as conn:
+        problems = preflight(conn)
+        if problems:
+            raise MigrationError('fix these rows first: ' + '; '.join(problems))
+
+        if column_type(conn, 'businesses', 'zip_code') != 'char(5)':
+            logger.info('businesses: state CHAR(2), zip_code CHAR(5)')
+            conn.execute(sqlalchemy.text('ALTER TABLE businesses '
+                                         'MODIFY state CHAR(2) NOT NULL, '
+                                         'MODIFY zip_code CHAR(5) NOT NULL'))
+            # Integers lost their leading zeros; every US ZIP code has five digits
+            while conn.execute(sqlalchemy.text(
+                    "UPDATE businesses SET zip_code = LPAD(zip_code, 5, '0') "
+                    'WHERE CHAR_LENGTH(zip_code) < 5 LIMIT :limit'), {'limit': batch_size}).rowcount:
+                conn.commit()
+            conn.commit()
+
+        if not column_type(conn, 'reviews', 'stars').startswith('tinyint'):
+            logger.info('reviews: stars TINYINT with CHECK')
+            conn.execute(sqlalchemy.text('ALTER TABLE reviews '
+                                         'MODIFY stars TINYINT UNSIGNED NOT NULL, '
+                                         'ADD CONSTRAINT reviews_stars CHECK (stars BETWEEN 1 AND 5)'))
+            conn.commit()
+
+        if column_type(conn, 'reviews', 'review_text') != 'varbinary(4001)':
+            logger.info('reviews: compressing review_text')
+            compress_review_text(conn, batch_size)
+
+        if column_type(conn, 'users', 'username') == 'text':
+            logger.info('users: username VARCHAR(100)')
+            conn.execute(sqlalchemy.text('ALTER TABLE users MODIFY username VARCHAR(100) NOT NULL'))
+            conn.commit()
+
+
+def compress_review_text(conn, batch_size):
+    """Copy review_text into a compressed column in batches, then swap it in."""
+    if column_type(conn, 'reviews', 'review_text_z') is None:
+        conn.execute(sqlalchemy.text('ALTER TABLE reviews ADD COLUMN review_text_z VARBINARY(4001)'))
+        conn.commit()
+
+    # Same type as the final column, so its bind processing compresses
+    compress = sqlalchemy.bindparam('review_text_z', type_=statements.reviews.c.review_text.type)
+    copy = sqlalchemy.text('UPDATE reviews SET review_text_z = :review_text_z WHERE id = :id').bindparams(compress)
+    last_id = 0
+    while True:
+        rows = conn.execute(sqlalchemy.text(
+            'SELECT id, review_text FROM reviews WHERE id > :last_id AND review_text IS NOT NULL '
+            'AND review_text_z IS NULL ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': batch_size}).fetchall()
+        if not rows:
+            break
+        conn.execute(copy, [{'id': row.id, 'review_text_z': row.review_text} for row in rows])
+        conn.commit()
+        last_id = rows[-1].id
+
+    conn.execute(sqlalchemy.text('ALTER TABLE reviews DROP COLUMN review_text, '
+                                 'RENAME COLUMN review_text_z TO review_text'))
+    conn.commit()
+
+
+def main():
+    import argparse
+    import main as api
+
+    parser = argparse.ArgumentParser(description='Migrate the tables to compact column types.')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrate(api.init_connection_pool(), args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
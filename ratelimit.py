@@ -0,0 +1,193 @@
+"""Per-client rate limiting and load shedding in front of the DB pool.
+
+Two checks run before every request:
+
+* A token bucket per (client, route). An empty bucket is answered with a
+  429 and a Retry-After for when the next token is due.
+* An admission controller that watches the connection pool. If too many
+  requests are already queued for a connection, or recent checkouts have
+  waited too long, new requests get a 503 with Retry-After straight away
+  rather than joining the queue and timing out after ``pool_timeout``.
+
+Queue depth is estimated as the number of in-flight requests beyond what
+the pool can serve at once. Checkout wait is the time from the start of a
+request to its first connection checkout, smoothed with an EWMA. The
+average also decays with the time since the last checkout, so once
+shedding has drained the pool it falls below the limit and requests are
+let through again. Requests that ``exempt`` picks out (long-polls and
+event streams, which mostly sleep) are never counted or shed.
+
+Buckets are keyed by ``ClientIdentity``: the client's address, unless the
+request came through a trusted peer (an API gateway that authenticates
+callers) that names the client in X-Client-Id. A header any caller can
+set would let a client dodge its limit with a fresh id per request, or
+drain another client's bucket.
+"""
+
+import collections
+import ipaddress
+import math
+import threading
+import time
+
+import sqlalchemy
+from flask import g, has_request_context, request
+
+CLIENT_HEADER = 'X-Client-Id'
+
+
+class ClientIdentity:
+    """Who a request comes from, for per-client limits and keys.
+
+    The client's address is request.remote_addr, which is the address
+    forwarded by the app's proxies when it runs behind werkzeug's ProxyFix.
+    X-Client-Id is only believed from a connection whose own address is in
+    trusted_peers (addresses or networks).
+    """
+
+    def __init__(self, trusted_peers=()):
+        self.trusted_peers = [ipaddress.ip_network(peer, strict=False) for peer in trusted_peers]
+
+    def __call__(self):
+        client_id = request.headers.get(CLIENT_HEADER)
+        if client_id and self._from_trusted_peer():
+            return 'id:' + client_id
+        return 'ip:' + (request.remote_addr or '')
+
+    def _from_trusted_peer(self):
+        if not self.trusted_peers:
+            return False
+        # The connection's address, from before ProxyFix replaced it
+        environ = request.environ.get('werkzeug.proxy_fix.orig', request.environ)
+        try:
+            peer = ipaddress.ip_address(environ.get('REMOTE_ADDR') or '')
+        except ValueError:
+            return False
+        return any(peer in network for network in self.trusted_peers)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token. Returns 0 on success, else seconds until one is due."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, max_clients=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # Least recently seen buckets are evicted first, bounding memory
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client, route):
+        key = (client, route)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take()
+
+
+class AdmissionController:
+    def __init__(self, capacity, max_queue_depth, max_wait, alpha=0.2, decay_time=2.0):
+        # capacity: connections the pool can hand out at once
+        # (pool_size + max_overflow)
+        self.capacity = capacity
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self.alpha = alpha
+        # Seconds for the average to fall by a factor e without checkouts
+        self.decay_time = decay_time
+        self.in_flight = 0
+        self.wait_ewma = 0.0
+        self._observed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def queue_depth(self):
+        return max(self.in_flight - self.capacity, 0)
+
+    def _wait(self, now):
+        # No checkout means nothing queued behind the pool, which is
+        # always the case while every request is being shed
+        return self.wait_ewma * math.exp(-(now - self._observed_at) / self.decay_time)
+
+    def admit(self):
+        with self._lock:
+            if self.queue_depth() >= self.max_queue_depth or self._wait(time.monotonic()) >= self.max_wait:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._wait(now)
+            self.wait_ewma = wait + self.alpha * (seconds - wait)
+            self._observed_at = now
+
+    def retry_after(self):
+        with self._lock:
+            return max(1, math.ceil(self._wait(time.monotonic())))
+
+
+def install(app, limiter=None, admission=None, exempt=None, identify=None):
+    """Register the checks on a Flask app.
+
+    exempt, if given, is called in each request; requests it returns True
+    for skip the admission controller. identify names the client of a
+    request, by default a ClientIdentity that trusts no peer.
+    """
+    identify = identify or ClientIdentity()
+
+    @app.before_request
+    def check_limits():
+        if limiter is not None:
+            client = identify()
+            retry_after = limiter.check(client, request.url_rule.rule if request.url_rule else request.path)
+            if retry_after:
+                return ({"Error": "Too many requests"}, 429,
+                        {'Retry-After': str(max(1, math.ceil(retry_after)))})
+        if admission is not None and not (exempt is not None and exempt()):
+            if not admission.admit():
+                return ({"Error": "The service is overloaded, try again later"}, 503,
+                        {'Retry-After': str(admission.retry_after())})
+            g.admitted_at = time.monotonic()
+
+    @app.teardown_request
+    def release(exc):
+        if admission is not None and 'admitted_at' in g:
+            admission.release()
+
+
+def watch_pool(engine, admission):
+    """Feed checkout waits from the engine's pool to the admission controller."""
+    @sqlalchemy.event.listens_for(engine.pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        # Only the first checkout of a request waited in the queue
+        if has_request_context() and g.get('admitted_at') is not None:
+            admission.observe_wait(time.monotonic() - g.admitted_at)
+            g.admitted_at = None
@@ -0,0 +1,195 @@
+"""Replay captured traffic against a backend and compare latencies.
+
+Reads the NDJSON written by capture.py (several files are merged in time
+order), sends every request to the target at its original pacing, or
+--speed times faster (--speed 0 sends them back to back), and reports per
+route how the replayed latencies compare with the captured ones. Routes are
+the path with numeric segments replaced by <id>.
+
+Any of the backends can be the target, over HTTP:
+
+    python replay.py captures/requests.jsonl --target http://127.0.0.1:8080 --speed 4
+
+or in-process through Flask's test client, for apps that need no setup
+beyond being imported:
+
+    python replay.py captures/requests.jsonl --app main_mysql:app --speed 0
+
+--output saves the report as JSON; --baseline compares against a report
+saved earlier, e.g. from before a change.
+"""
+
+import argparse
+import base64
+import http.client
+import importlib
+import json
+import math
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+_ID = re.compile(r'/\d+(?=/|$)')
+
+
+def route_of(method, path):
+    return method + ' ' + _ID.sub('/<id>', path.split('?', 1)[0])
+
+
+def load_capture(paths):
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    # Stable, so equal timestamps keep their file order and runs repeat exactly
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
+
+
+def body_of(entry):
+    if 'body_b64' in entry:
+        return base64.b64decode(entry['body_b64'])
+    return entry.get('body', '').encode('utf-8') or None
+
+
+class HttpTarget:
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.https = parsed.scheme == 'https'
+        self.prefix = parsed.path.rstrip('/')
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=60)
+        return conn
+
+    def send(self, method, path, headers, body):
+        conn = self._connection()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            return None
+
+
+class AppTarget:
+    def __init__(self, spec):
+        module, _, attr = spec.partition(':')
+        self.app = getattr(importlib.import_module(module), attr or 'app')
+        self._local = threading.local()
+
+    def send(self, method, path, headers, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client.open(path, method=method, headers=headers, data=body).status_code
+
+
+def replay(entries, target, speed, concurrency):
+    """Returns one (entry, status, latency_ms, lag_ms) tuple per entry."""
+    results = [None] * len(entries)
+
+    def send(i, entry, due):
+        start = time.perf_counter()
+        status = target.send(entry['method'], entry['path'], entry.get('headers', {}), body_of(entry))
+        results[i] = (entry, status, (time.perf_counter() - start) * 1000, max(0.0, (start - due) * 1000))
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        first_ts = entries[0]['ts'] if entries else 0
+        started = time.perf_counter()
+        for i, entry in enumerate(entries):
+            due = started + ((entry['ts'] - first_ts) / speed if speed else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, i, entry, due)
+    return results
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)] if values else None
+
+
+def summarize(results):
+    routes = {}
+    for entry, status, latency, lag in results:
+        route = routes.setdefault(route_of(entry['method'], entry['path']),
+                                  {'captured': [], 'replayed': [], 'lag': [], 'status_mismatches': 0})
+        route['captured'].append(entry['duration_ms'])
+        route['replayed'].append(latency)
+        route['lag'].append(lag)
+        if status != entry['status']:
+            route['status_mismatches'] += 1
+    return {name: {'count': len(route['replayed']),
+                   'captured_p50': percentile(route['captured'], 50),
+                   'captured_p99': percentile(route['captured'], 99),
+                   'replayed_p50': percentile(route['replayed'], 50),
+                   'replayed_p99': percentile(route['replayed'], 99),
+                   'lag_p99': percentile(route['lag'], 99),
+                   'status_mismatches': route['status_mismatches']}
+            for name, route in sorted(routes.items())}
+
+
+def delta(new, old):
+    return '%+6.0f%%' % ((new - old) / old * 100) if old else '     n/a'
+
+
+def print_report(report, baseline=None):
+    print('%-40s %6s %9s %9s %8s %9s %9s %8s %6s' % (
+        'route', 'count', 'capt p50', 'repl p50', 'delta', 'capt p99', 'repl p99', 'delta', 'status'))
+    for name, route in report.items():
+        print('%-40s %6d %9.1f %9.1f %8s %9.1f %9.1f %8s %6d' % (
+            name[:40], route['count'],
+            route['captured_p50'], route['replayed_p50'], delta(route['replayed_p50'], route['captured_p50']),
+            route['captured_p99'], route['replayed_p99'], delta(route['replayed_p99'], route['captured_p99']),
+            route['status_mismatches']))
+    if baseline:
+        print('\nagainst the baseline replay:')
+        for name, route in report.items():
+            old = baseline.get(name)
+            if old:
+                print('%-40s p50 %8s  p99 %8s' % (name[:40], delta(route['replayed_p50'], old['replayed_p50']),
+                                                  delta(route['replayed_p99'], old['replayed_p99'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='+')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--target', help='base URL of a running backend')
+    group.add_argument('--app', help='module:attribute of a Flask app to call in-process')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='pacing multiplier; 1 is the captured pacing, 0 sends without waiting')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--output', help='save the report as JSON')
+    parser.add_argument('--baseline', help='report saved by an earlier --output to compare against')
+    args = parser.parse_args()
+
+    entries = load_capture(args.captures)
+    target = HttpTarget(args.target) if args.target else AppTarget(args.app)
+    report = summarize(replay(entries, target, args.speed, args.concurrency))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""Write-behind ingestion for reviews.
+
+Reviews are validated by the request handler, then handed to a bounded
+in-process queue. A single background thread drains the queue and writes
+the reviews in group commits: one transaction (and one fsync) for the
+reviews that queued up while the previous one was committing, up to
+``max_batch``. ``max_delay`` makes it wait that long for more; it only
+pays off when commits are much slower than the gaps between reviews.
+
+Each submitted review gets a Future that resolves to the new review id once
+its batch has been committed, so a handler can choose to acknowledge on
+commit (wait for the Future) or on enqueue (return straight away).
+
+A batch that fails because of the database (connection lost, deadlock,
+lock wait timeout) is retried with exponential backoff for up to
+``retry_for`` seconds; the queue fills up meanwhile and new reviews are
+turned away with QueueFull. A batch that fails because of a review in it
+is written one review at a time instead, so that review cannot fail the
+rest. A review that still cannot be written goes to
+``review_dead_letters`` with the error, and its Future fails.
+
+Acknowledging on enqueue trades durability for latency. Until its batch
+commits, an acknowledged review exists only in this process's memory:
+
+* if the process dies without ``close()`` (SIGKILL, out of memory, a
+  gunicorn worker timeout), the queued reviews are lost;
+* if the database is down for longer than ``retry_for``, they are
+  dead-lettered, or only logged when the dead letter cannot be written
+  either.
+
+Neither is reported to the client, which was told 202 already. Clients
+that need to know their review was stored must acknowledge on commit,
+which is the default.
+
+One live review per (user_id, business_id) is enforced by the
+``reviews_live_pair`` unique index. ``claim`` catches duplicates within
+this process before they are queued; a duplicate queued by another
+process is rejected by the index when its batch is written, and its
+Future fails with ``DuplicateReview`` (it is not dead-lettered).
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import sqlalchemy
+
+import changes
+import statements
+
+logger = logging.getLogger()
+
+ACK_COMMIT = 'commit'
+ACK_ENQUEUE = 'enqueue'
+
+
+class QueueFull(Exception):
+    """Raised when the ingestion queue is at capacity."""
+
+
+class DuplicateReview(Exception):
+    """Raised when a review for (user_id, business_id) is already queued or stored."""
+
+
+def _transient(error):
+    """Whether a failed write may succeed if tried again as it is."""
+    return (isinstance(error, (sqlalchemy.exc.OperationalError, sqlalchemy.exc.InterfaceError))
+            or getattr(error, 'connection_invalidated', False))
+
+
+class ReviewWriter:
+    def __init__(self, engine, max_batch=200, max_delay=0.0, max_queue=10000, retry_for=30.0, retry_delay=0.1,
+                 max_retry_delay=5.0):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # Seconds to keep retrying a batch the database cannot take
+        self.retry_for = retry_for
+        # Doubled after each failed attempt, up to max_retry_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        # (user_id, business_id) pairs that are queued but not yet committed.
+        # The database cannot see these yet, so the request handler's check
+        # for an existing review has to; the unique index backs it up.
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='review-writer', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=None):
+        """Flush everything that is queued and stop the writer thread."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def claim(self, user_id, business_id):
+        """Reserve (user_id, business_id) until the review is committed.
+
+        Must be called before checking the database for an existing review so
+        that two concurrent requests for the same pair cannot both pass.
+        """
+        with self._lock:
+            if (user_id, business_id) in self._pending:
+                raise DuplicateReview((user_id, business_id))
+            self._pending.add((user_id, business_id))
+
+    def release(self, user_id, business_id):
+        with self._lock:
+            self._pending.discard((user_id, business_id))
+
+    def submit(self, user_id, business_id, stars, review_text):
+        """Queue a claimed review. Returns a Future for the new review id."""
+        future = Future()
+        try:
+            self._queue.put_nowait((user_id, business_id, stars, review_text, future))
+        except queue.Full:
+            self.release(user_id, business_id)
+            raise QueueFull()
+        return future
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _next_batch(self):
+        # Block for the first item (waking up now and then to notice close()),
+        # then take what queued up meanwhile, which is what arrived during
+        # the previous commit. Only with max_delay set does it wait for more,
+        # until the batch is full or max_delay has passed since the first.
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Insert the reviews of a batch in one transaction. Returns their ids."""
+        review_ids = []
+        with self.engine.connect() as conn:
+            # The reviews of a batch are committed, and so created, together
+            now = time.time()
+            for user_id, business_id, stars, review_text, _ in batch:
+                result = conn.execute(statements.INSERT_REVIEW, parameters={'user_id': user_id,
+                                                        'business_id': business_id,
+                                                        'stars': stars,
+                                                        'review_text': review_text,
+                                                        'created_at': now})
+                review_ids.append(result.lastrowid)
+            # One rating update per business in the batch
+            ratings = {}
+            for user_id, business_id, stars, review_text, _ in batch:
+                reviews, total = ratings.get(business_id, (0, 0))
+                ratings[business_id] = (reviews + 1, total + stars)
+            conn.execute(statements.ADJUST_BUSINESS_RATING,
+                         [{'b_business_id': business_id, 'reviews': reviews, 'stars': total}
+                          for business_id, (reviews, total) in ratings.items()])
+            # Changes last, so a batch that fails on a review or waits for
+            # a rating's lock has not taken a seq yet
+            for (user_id, business_id, stars, review_text, _), review_id in zip(batch, review_ids):
+                changes.record_change(conn, changes.ENTITY_REVIEW, review_id, changes.OP_CREATE,
+                                      {'id': review_id, 'user_id': user_id, 'business_id': business_id,
+                                       'stars': stars, 'review_text': review_text,
+                                       'created_at': now, 'updated_at': now})
+            # One commit for the whole batch
+            conn.commit()
+        return review_ids
+
+    def _flush(self, batch):
+        try:
+            deadline = time.monotonic() + self.retry_for
+            delay = self.retry_delay
+            while True:
+                try:
+                    review_ids = self._write(batch)
+                    break
+                except Exception as e:
+                    logger.exception(e)
+                    if not _transient(e):
+                        # A review is at fault (a duplicate, say): isolate it
+                        self._flush_each(batch)
+                        return
+                    if time.monotonic() + delay > deadline:
+                        for item in batch:
+                            self._dead_letter(item, e)
+                            item[-1].set_exception(e)
+                        return
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+            for (*_, future), review_id in zip(batch, review_ids):
+                future.set_result(review_id)
+        finally:
+            with self._lock:
+                for user_id, business_id, *_ in batch:
+                    self._pending.discard((user_id, business_id))
+
+    def _flush_each(self, batch):
+        for item in batch:
+            future = item[-1]
+            try:
+                review_id, = self._write([item])
+            except Exception as e:
+                if statements.is_duplicate_review(e):
+                    # Queued by another process at the same time
+                    logger.warning('Duplicate review user_id=%s business_id=%s dropped', item[0], item[1])
+                    future.set_exception(DuplicateReview((item[0], item[1])))
+                    continue
+                logger.exception(e)
+                self._dead_letter(item, e)
+                future.set_exception(e)
+            else:
+                future.set_result(review_id)
+
+    def _dead_letter(self, item, error):
+        user_id, business_id, stars, review_text, _ = item
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(statements.INSERT_REVIEW_DEAD_LETTER, parameters={
+                    'user_id': user_id, 'business_id': business_id, 'stars': stars,
+                    'review_text': review_text, 'error': repr(error)[:1000], 'failed_at': time.time()})
+                conn.commit()
+        except Exception as e:
+            # Nowhere left to keep it; the log has everything needed to replay it
+            logger.error('Lost review user_id=%s business_id=%s stars=%s review_text=%r: %r',
+                         user_id, business_id, stars, review_text, e)
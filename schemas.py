@@ -0,0 +1,146 @@
+"""Request body schemas for main.py.
+
+Each schema is built once at import from a field per attribute: whether it
+is required (or its default), and a checker that validates and coerces the
+value in one step. ``Schema.load`` parses the raw body and runs the
+checkers in a single pass, returning a new dict that holds only the
+schema's fields, with the types the columns expect. Unknown attributes are
+ignored, as before.
+
+The limits match the DDL in ``main.create_table``: VARCHAR lengths, the
+DECIMAL(6,2) price, the 1-5 stars CHECK, two letter states and five digit
+ZIP codes (integers are padded back to five digits).
+"""
+
+import json
+
+ERROR_MISSING = "The request body is missing at least one of the required attributes"
+ERROR_NOT_OBJECT = "The request body must be a JSON object"
+
+_REQUIRED = object()
+
+
+class InvalidBody(ValueError):
+    """Raised with the message for the client when a body does not validate."""
+
+
+def text(max_length, name, min_length=1):
+    message = '%s must be text of %d to %d characters' % (name, min_length, max_length)
+
+    def check(value):
+        if type(value) is not str or not min_length <= len(value) <= max_length:
+            raise InvalidBody(message)
+        return value
+    return check
+
+
+def optional_text(max_length, name):
+    message = '%s must be text of at most %d characters' % (name, max_length)
+
+    def check(value):
+        if value is not None and (type(value) is not str or len(value) > max_length):
+            raise InvalidBody(message)
+        return value
+    return check
+
+
+def integer(name, minimum=None, maximum=None, nullable=False):
+    if minimum is not None and maximum is not None:
+        message = '%s must be a whole number from %d to %d' % (name, minimum, maximum)
+    else:
+        message = '%s must be a whole number' % name
+
+    def check(value):
+        # type() rather than isinstance(), so that true and false are refused
+        if type(value) is not int:
+            if value is None and nullable:
+                return None
+            raise InvalidBody(message)
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise InvalidBody(message)
+        return value
+    return check
+
+
+def decimal(name, precision, scale):
+    limit = 10 ** (precision - scale)
+    message = '%s must be a number from 0 to less than %d' % (name, limit)
+
+    def check(value):
+        if type(value) not in (int, float) or not 0 <= value < limit:
+            raise InvalidBody(message)
+        return value
+    return check
+
+
+def state(value):
+    if type(value) is not str or len(value) != 2 or not value.isalpha():
+        raise InvalidBody("state must be a two letter abbreviation")
+    return value.upper()
+
+
+def zip_code(value):
+    if type(value) is int and 0 <= value <= 99999:
+        return '%05d' % value
+    if type(value) is not str or len(value) != 5 or not value.isdigit():
+        raise InvalidBody("zip_code must be a five digit ZIP code")
+    return value
+
+
+class Schema:
+    def __init__(self, **fields):
+        """fields maps each attribute to a checker, or to a (checker,
+        default) pair for an optional attribute."""
+        self.fields = tuple((name, field, _REQUIRED) if callable(field) else (name,) + field
+                            for name, field in fields.items())
+
+    def load(self, data):
+        """Parse a JSON body (bytes or str) and validate it."""
+        try:
+            content = json.loads(data)
+        except ValueError:
+            raise InvalidBody(ERROR_NOT_OBJECT)
+        return self.validate(content)
+
+    def validate(self, content):
+        if type(content) is not dict:
+            raise InvalidBody(ERROR_NOT_OBJECT)
+        result = {}
+        for name, check, default in self.fields:
+            value = content.get(name, _REQUIRED)
+            if value is _REQUIRED:
+                if default is _REQUIRED:
+                    raise InvalidBody(ERROR_MISSING)
+                result[name] = default
+            else:
+                result[name] = check(value)
+        return result
+
+
+LODGING = Schema(
+    name=text(30, 'name'),
+    description=text(100, 'description'),
+    price=decimal('price', 6, 2),
+)
+
+BUSINESS = Schema(
+    name=text(50, 'name'),
+    street_address=text(100, 'street_address'),
+    owner_id=integer('owner_id', nullable=True),
+    city=text(50, 'city'),
+    state=state,
+    zip_code=zip_code,
+)
+
+REVIEW = Schema(
+    user_id=integer('user_id'),
+    business_id=integer('business_id'),
+    stars=integer('stars', 1, 5),
+    review_text=(optional_text(1000, 'review_text'), ""),
+)
+
+# PUT /reviews/<id>: a missing review_text keeps the stored one
+REVIEW_UPDATE = Schema(
+    stars=integer('stars', 1, 5),
+    review_text=(optional_text(1000, 'review_text'), None),
+)
@@ -0,0 +1,376 @@
+"""Shard businesses and reviews across several databases.
+
+Businesses are placed by ``owner_id`` and reviews by ``business_id`` on a
+consistent hash ring, so all of an owner's businesses (and all of a
+business's reviews) live on one shard and adding a shard only moves about
+1/N of the rows.
+
+The shard map is a JSON file::
+
+    {"vnodes": 64,
+     "shards": [{"name": "s0", "index": 0, "url": "sqlite:///shard0.db"},
+                {"name": "s1", "index": 1, "url": "sqlite:///shard1.db"}]}
+
+``index`` must never change for a shard: ids are allocated per shard as
+``sequence * ID_STRIDE + index`` so they stay unique across shards, and
+rows keep their id when a rebalance moves them. Indexes must be distinct
+and below ``ID_STRIDE``, which loading a map checks.
+
+Lookups by id and unscoped listings are scatter-gathered over all shards;
+``list_businesses`` merges the per-shard pages by id (keyset pagination).
+
+    python sharding.py init --map shards.json
+    python sharding.py rebalance --from-map old.json --to-map new.json
+"""
+
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import json
+import logging
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy import bindparam, delete, insert, select
+
+import statements
+from statements import _live_business, _live_review, businesses, reviews
+
+logger = logging.getLogger()
+
+# Upper bound on the number of shards, and the step between ids from one shard
+ID_STRIDE = 1024
+
+shard_metadata = sqlalchemy.MetaData()
+# One row per allocated id; only the AUTO_INCREMENT value is used
+id_sequence = sqlalchemy.Table(
+    'id_sequence', shard_metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True, autoincrement=True),
+    sqlalchemy.Column('kind', sqlalchemy.String(20), nullable=False),
+)
+
+
+def _without_foreign_keys(table):
+    """A copy of table in shard_metadata, minus its foreign keys.
+
+    Reviews are placed by business_id and businesses by owner_id, so a
+    review's business is usually on another shard, and users are on none.
+    """
+    copy = table.to_metadata(shard_metadata)
+    for constraint in list(copy.foreign_key_constraints):
+        copy.constraints.remove(constraint)
+    for column in copy.columns:
+        column.foreign_keys.clear()
+    copy.foreign_keys.clear()
+    return copy
+
+
+# Created on every shard; the statements still use the tables of statements.py
+_without_foreign_keys(businesses)
+_without_foreign_keys(reviews)
+
+ALLOCATE_ID = insert(id_sequence).values(kind=bindparam('kind'))
+INSERT_BUSINESS_WITH_ID = insert(businesses)
+INSERT_REVIEW_WITH_ID = insert(reviews)
+SELECT_BUSINESSES_AFTER = (select(businesses)
+                           .where(businesses.c.id > bindparam('after'), _live_business)
+                           .order_by(businesses.c.id)
+                           .limit(bindparam('limit')))
+# Deleted ones too, for a rebalance to move
+SELECT_ALL_BUSINESSES_AFTER = (select(businesses)
+                               .where(businesses.c.id > bindparam('after'))
+                               .order_by(businesses.c.id)
+                               .limit(bindparam('limit')))
+# statements.py checks that a review's business is live with a join, but
+# here the business is usually on another shard. Deleting a business
+# deletes its reviews, so a live review is enough.
+SELECT_REVIEW = select(reviews).where(reviews.c.id == bindparam('review_id'), _live_review)
+SELECT_USER_REVIEWS = select(reviews).where(reviews.c.user_id == bindparam('user_id'), _live_review)
+SELECT_BUSINESS_REVIEWS = select(reviews).where(reviews.c.business_id == bindparam('business_id'), _live_review)
+SELECT_REVIEWS_AFTER = (select(reviews)
+                        .where(reviews.c.id > bindparam('after'))
+                        .order_by(reviews.c.id)
+                        .limit(bindparam('limit')))
+DELETE_BUSINESSES_BY_ID = delete(businesses).where(businesses.c.id.in_(bindparam('ids', expanding=True)))
+DELETE_REVIEWS_BY_ID = delete(reviews).where(reviews.c.id.in_(bindparam('ids', expanding=True)))
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with ``vnodes`` points per shard."""
+
+    def __init__(self, shard_names, vnodes=64):
+        points = sorted((_hash('%s#%d' % (name, i)), name) for name in shard_names for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._names = [name for _, name in points]
+
+    def shard_for(self, key):
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._names[i]
+
+
+class ShardMap:
+    def __init__(self, shards, vnodes=64):
+        # shards: list of {'name', 'index', 'url'}
+        names = [shard['name'] for shard in shards]
+        indexes = [shard['index'] for shard in shards]
+        if len(set(names)) != len(names):
+            raise ValueError('Shard names must be distinct: %r' % names)
+        if len(set(indexes)) != len(indexes):
+            raise ValueError('Shard indexes must be distinct: %r' % indexes)
+        for shard in shards:
+            # Beyond the stride, two shards would allocate the same ids
+            if not isinstance(shard['index'], int) or not 0 <= shard['index'] < ID_STRIDE:
+                raise ValueError('Shard %s has index %r, which must be from 0 to %d'
+                                 % (shard['name'], shard['index'], ID_STRIDE - 1))
+        self.shards = shards
+        self.ring = HashRing([shard['name'] for shard in shards], vnodes)
+        self.index = {shard['name']: shard['index'] for shard in shards}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config['shards'], config.get('vnodes', 64))
+
+
+class ShardedStore:
+    """Business and review operations routed over a ShardMap.
+
+    While a rebalance is running, pass the map being moved away from as
+    ``previous``; keyed lookups then also check the shard it would pick.
+    """
+
+    def __init__(self, shard_map, previous=None, engines=None, max_locations=100000):
+        self.map = shard_map
+        self.previous = previous
+        self.engines = engines or {}
+        for shard in shard_map.shards + (previous.shards if previous else []):
+            if shard['name'] not in self.engines:
+                self.engines[shard['name']] = sqlalchemy.create_engine(shard['url'])
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self.engines), 1))
+        # business_id -> shard name, filled in by scatter lookups. Least
+        # recently used first, and evicted first past max_locations.
+        self.max_locations = max_locations
+        self._business_location = collections.OrderedDict()
+        self._location_lock = threading.Lock()
+
+    def create_tables(self):
+        for engine in self.engines.values():
+            shard_metadata.create_all(engine)
+
+    def _shards_for(self, key):
+        names = [self.map.ring.shard_for(key)]
+        if self.previous is not None:
+            old = self.previous.ring.shard_for(key)
+            if old not in names:
+                names.append(old)
+        return names
+
+    def _scatter(self, fn):
+        """Run fn(shard_name, conn) on every shard in parallel; returns the results."""
+        def run(name):
+            with self.engines[name].connect() as conn:
+                return name, fn(name, conn)
+        return list(self._pool.map(run, list(self.engines)))
+
+    def _recall_location(self, business_id):
+        with self._location_lock:
+            shard_name = self._business_location.get(business_id)
+            if shard_name is not None:
+                self._business_location.move_to_end(business_id)
+            return shard_name
+
+    def _remember_location(self, business_id, shard_name):
+        with self._location_lock:
+            self._business_location[business_id] = shard_name
+            self._business_location.move_to_end(business_id)
+            if len(self._business_location) > self.max_locations:
+                self._business_location.popitem(last=False)
+
+    def _forget_location(self, business_id):
+        with self._location_lock:
+            self._business_location.pop(business_id, None)
+
+    def _allocate_id(self, conn, shard_name, kind):
+        sequence = conn.execute(ALLOCATE_ID, parameters={'kind': kind}).lastrowid
+        return sequence * ID_STRIDE + self.map.index[shard_name]
+
+    # Businesses
+
+    def create_business(self, name, street_address, owner_id, city, state, zip_code):
+        shard_name = self.map.ring.shard_for(owner_id)
+        with self.engines[shard_name].connect() as conn:
+            business = {'name': name, 'street_address': street_address, 'owner_id': owner_id,
+                        'city': city, 'state': state, 'zip_code': zip_code}
+            business['id'] = self._allocate_id(conn, shard_name, 'business')
+            conn.execute(INSERT_BUSINESS_WITH_ID, parameters=business)
+            conn.commit()
+        self._remember_location(business['id'], shard_name)
+        return business
+
+    def locate_business(self, business_id):
+        """Returns (shard name, row) for a business, or (None, None)."""
+        shard_name = self._recall_location(business_id)
+        if shard_name is not None:
+            with self.engines[shard_name].connect() as conn:
+                row = conn.execute(statements.SELECT_BUSINESS, parameters={'business_id': business_id}).one_or_none()
+            if row is not None:
+                return shard_name, row
+        for shard_name, row in self._scatter(
+                lambda name, conn: conn.execute(statements.SELECT_BUSINESS,
+                                                parameters={'business_id': business_id}).one_or_none()):
+            if row is not None:
+                self._remember_location(business_id, shard_name)
+                return shard_name, row
+        self._forget_location(business_id)
+        return None, None
+
+    def get_business(self, business_id):
+        return self.locate_business(business_id)[1]
+
+    def list_businesses(self, after=0, limit=3):
+        """Businesses with id > after, in id order. Returns (rows, next cursor)."""
+        pages = self._scatter(lambda name, conn: conn.execute(
+            SELECT_BUSINESSES_AFTER, parameters={'after': after, 'limit': limit}).fetchall())
+        rows = list(heapq.merge(*[page for _, page in pages], key=lambda row: row.id))[:limit]
+        return rows, (rows[-1].id if len(rows) == limit else None)
+
+    def owner_businesses(self, owner_id):
+        rows = []
+        for shard_name in self._shards_for(owner_id):
+            with self.engines[shard_name].connect() as conn:
+                stmt = statements.select_owner_businesses(tuple(businesses.c.keys()))
+                rows.extend(conn.execute(stmt, parameters={'owner_id': owner_id}).fetchall())
+        return sorted({row.id: row for row in rows}.values(), key=lambda row: row.id)
+
+    def delete_business(self, business_id):
+        shard_name, row = self.locate_business(business_id)
+        if row is None:
+            return False
+        # Reviews first, so no review is left pointing at a missing business
+        for review_shard in self._shards_for(business_id):
+            with self.engines[review_shard].connect() as conn:
+                conn.execute(statements.DELETE_BUSINESS_REVIEWS, parameters={'business_id': business_id})
+                conn.commit()
+        with self.engines[shard_name].connect() as conn:
+            result = conn.execute(statements.DELETE_BUSINESS, parameters={'business_id': business_id})
+            conn.commit()
+        self._forget_location(business_id)
+        return result.rowcount == 1
+
+    # Reviews
+
+    def create_review(self, user_id, business_id, stars, review_text):
+        """Returns the new review, or None if the business does not exist.
+
+        Raises ValueError if the user already reviewed the business.
+        """
+        if self.get_business(business_id) is None:
+            return None
+        for shard_name in self._shards_for(business_id):
+            with self.engines[shard_name].connect() as conn:
+                if conn.execute(statements.REVIEW_EXISTS_FOR_USER,
+                                parameters={'user_id': user_id, 'business_id': business_id}).first():
+                    raise ValueError((user_id, business_id))
+        shard_name = self.map.ring.shard_for(business_id)
+        with self.engines[shard_name].connect() as conn:
+            now = time.time()
+            review = {'user_id': user_id, 'business_id': business_id, 'stars': stars, 'review_text': review_text,
+                      'created_at': now, 'updated_at': now}
+            review['id'] = self._allocate_id(conn, shard_name, 'review')
+            conn.execute(INSERT_REVIEW_WITH_ID, parameters=review)
+            conn.commit()
+        return review
+
+    def get_review(self, review_id):
+        for _, row in self._scatter(lambda name, conn: conn.execute(
+                SELECT_REVIEW, parameters={'review_id': review_id}).one_or_none()):
+            if row is not None:
+                return row
+        return None
+
+    def business_reviews(self, business_id):
+        rows = []
+        for shard_name in self._shards_for(business_id):
+            with self.engines[shard_name].connect() as conn:
+                rows.extend(conn.execute(SELECT_BUSINESS_REVIEWS, parameters={'business_id': business_id}).fetchall())
+        return sorted(rows, key=lambda row: row.id)
+
+    def user_reviews(self, user_id):
+        pages = self._scatter(lambda name, conn: conn.execute(SELECT_USER_REVIEWS,
+                                                              parameters={'user_id': user_id}).fetchall())
+        return sorted((row for _, page in pages for row in page), key=lambda row: row.id)
+
+
+def rebalance(store, batch_size=500):
+    """Move rows whose shard changed between store.previous and store.map.
+
+    Rows are copied to their new shard and then deleted from the old one in
+    small batches, so the API keeps serving while this runs. Copies skip ids
+    that already exist on the target, which makes an interrupted run safe to
+    start again. Returns the number of rows moved.
+    """
+    moved = 0
+    for shard in store.previous.shards:
+        source = store.engines[shard['name']]
+        for table, batch_stmt, key, delete_stmt in [
+                (businesses, SELECT_ALL_BUSINESSES_AFTER, 'owner_id', DELETE_BUSINESSES_BY_ID),
+                (reviews, SELECT_REVIEWS_AFTER, 'business_id', DELETE_REVIEWS_BY_ID)]:
+            after = 0
+            while True:
+                with source.connect() as conn:
+                    rows = conn.execute(batch_stmt, parameters={'after': after, 'limit': batch_size}).fetchall()
+                if not rows:
+                    break
+                after = rows[-1].id
+                by_target = {}
+                for row in rows:
+                    target = store.map.ring.shard_for(getattr(row, key))
+                    if target != shard['name']:
+                        by_target.setdefault(target, []).append(row._asdict())
+                for target, batch in by_target.items():
+                    with store.engines[target].connect() as conn:
+                        existing = set(conn.execute(
+                            select(table.c.id).where(table.c.id.in_([row['id'] for row in batch]))).scalars())
+                        fresh = [row for row in batch if row['id'] not in existing]
+                        if fresh:
+                            conn.execute(insert(table), fresh)
+                        conn.commit()
+                    with source.connect() as conn:
+                        conn.execute(delete_stmt, parameters={'ids': [row['id'] for row in batch]})
+                        conn.commit()
+                    moved += len(batch)
+                    logger.info('moved %d %s rows from %s to %s', len(batch), table.name, shard['name'], target)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage business/review shards.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    init = sub.add_parser('init', help='create the tables on every shard')
+    init.add_argument('--map', required=True)
+    move = sub.add_parser('rebalance', help='move rows after the shard map changed')
+    move.add_argument('--from-map', required=True)
+    move.add_argument('--to-map', required=True)
+    move.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'init':
+        ShardedStore(ShardMap.load(args.map)).create_tables()
+    else:
+        store = ShardedStore(ShardMap.load(args.to_map), previous=ShardMap.load(args.from_map))
+        store.create_tables()
+        print('moved %d rows' % rebalance(store, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
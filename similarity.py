@@ -0,0 +1,285 @@
+"""Co-review similarity of businesses, for GET /businesses/<id>/similar.
+
+Two businesses are similar when the same users rated both highly, with
+--min-stars or more. X is the 0/1 users x businesses matrix of those
+ratings, so X^T X holds the number of users who rated both businesses
+of a pair, and
+
+    score(a, b) = common(a, b) / sqrt(raters(a) * raters(b))
+
+is the cosine similarity of their columns. Pairs with fewer than
+--min-common common raters are dropped, so two businesses one user
+happened to like do not score 1.0. The best --k of each business go into
+business_similarities, which the API reads with a primary key lookup.
+
+The first run, and any run with --full, computes every business. Later
+runs read the change feed from the seq the previous run recorded in
+similarity_runs and recompute only the lists that can have changed:
+
+* those of businesses whose reviews changed, or that were deleted,
+* those that name a changed business, whose score moved or which is gone,
+* those that a changed business now scores high enough to get into.
+
+A score depends only on the two businesses' columns of X, so no other
+list can have changed. The (user, business) pairs of X are kept between
+runs in the --cache file, with the seq they are current as of. A run
+re-reads only the changed businesses' high ratings, through the
+business_id index, replaces their columns and rebuilds X in memory. X is
+read in full (one scan of two integer columns of every live review) by
+--full runs, and when the cache is missing or does not belong to the
+last run: a run that died before saving it, or another --min-stars.
+Products are computed only for the changed businesses and the lists
+being recomputed, --chunk-size businesses at a time, and each chunk's
+lists are replaced in one transaction. Runs must not overlap, and each
+database needs a cache file of its own.
+
+Without --sqlite or --url the engine is built by connect_with_connector()
+from the usual environment. Run it from cron, e.g. every few minutes:
+
+    python similarity.py --cache /var/cache/similarity.npz
+    python similarity.py --sqlite bench.db --full
+
+Needs numpy and scipy, which the API itself does not use:
+
+    pip install -r requirements-analytics.txt
+"""
+
+import argparse
+import os
+import time
+
+import numpy
+import scipy.sparse
+import sqlalchemy
+
+import changes
+import statements
+
+# Neighbors kept per business; GET /businesses/<id>/similar serves up to these
+DEFAULT_K = 20
+
+
+def read_ratings(conn, statement, parameters, batch_size=10000):
+    """(user_ids, business_ids) arrays of the high ratings a statement selects."""
+    user_ids = []
+    business_ids = []
+    result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+        statement, parameters=parameters)
+    for batch in result.partitions(batch_size):
+        user_ids.append(numpy.array([row[0] for row in batch], dtype=numpy.int64))
+        business_ids.append(numpy.array([row[1] for row in batch], dtype=numpy.int64))
+    user_ids = numpy.concatenate(user_ids) if user_ids else numpy.empty(0, dtype=numpy.int64)
+    business_ids = numpy.concatenate(business_ids) if business_ids else numpy.empty(0, dtype=numpy.int64)
+    return user_ids, business_ids
+
+
+def load_ratings(conn, min_stars, batch_size=10000):
+    """Every high rating, in one scan."""
+    return read_ratings(conn, statements.SELECT_HIGH_RATINGS, {'min_stars': min_stars}, batch_size)
+
+
+def update_ratings(conn, user_ids, business_ids, changed, min_stars, batch_size=10000):
+    """The ratings with those of the changed businesses read again."""
+    changed = sorted(changed)
+    keep = ~numpy.isin(business_ids, changed)
+    user_ids, business_ids = [user_ids[keep]], [business_ids[keep]]
+    for start in range(0, len(changed), 1000):
+        users, businesses = read_ratings(conn, statements.SELECT_BUSINESS_HIGH_RATINGS,
+                                         {'min_stars': min_stars, 'business_ids': changed[start:start + 1000]},
+                                         batch_size)
+        user_ids.append(users)
+        business_ids.append(businesses)
+    return numpy.concatenate(user_ids), numpy.concatenate(business_ids)
+
+
+def read_cache(path, seq, min_stars):
+    """The cached ratings if they are current as of seq, else None."""
+    try:
+        with numpy.load(path) as cache:
+            if int(cache['seq']) != seq or int(cache['min_stars']) != min_stars:
+                return None
+            return cache['user_ids'], cache['business_ids']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cache(path, seq, min_stars, user_ids, business_ids):
+    # Replaced in one step, so a run that dies half way leaves the old one
+    with open(path + '.tmp', 'wb') as f:
+        numpy.savez(f, seq=seq, min_stars=min_stars, user_ids=user_ids, business_ids=business_ids)
+    os.replace(path + '.tmp', path)
+
+
+def ratings_matrix(user_ids, business_ids):
+    """The users x businesses matrix of high ratings, column i being business id i."""
+    # Rows are numbered by user, in user id order
+    users, rows = numpy.unique(user_ids, return_inverse=True)
+    width = int(business_ids.max()) + 1 if len(business_ids) else 0
+    matrix = scipy.sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (rows, business_ids)),
+                                     shape=(len(users), width))
+    # A user has one review per business, but a repeat must not count twice
+    matrix.data[:] = 1
+    return matrix
+
+
+def candidates(matrix, columns, raters, min_common):
+    """Every business scored against each of the given businesses.
+
+    Returns (owner, similar_id, score) arrays, where owner indexes into
+    columns; similar ids ascend within each owner.
+    """
+    columns = numpy.asarray(columns)
+    # common[i, j]: users who rated both columns[i] and business j highly
+    common = (matrix[:, columns].T.tocsr() @ matrix).tocsr()
+    common.sort_indices()
+    owner = numpy.repeat(numpy.arange(len(columns)), numpy.diff(common.indptr))
+    keep = (common.indices != columns[owner]) & (common.data >= min_common)
+    owner, similar, count = owner[keep], common.indices[keep], common.data[keep]
+    score = count / numpy.sqrt(raters[columns[owner]].astype(numpy.float64) * raters[similar])
+    return owner, similar, score
+
+
+def neighbors(matrix, columns, raters, k, min_common):
+    """The k best scored businesses of each of the given businesses.
+
+    Returns (owner, position, similar_id, score) arrays, where owner
+    indexes into columns.
+    """
+    owner, similar, score = candidates(matrix, columns, raters, min_common)
+    # Best first within each owner, then the first k. Both sorts are
+    # stable and the ids ascend, so ties stay in business id order.
+    order = numpy.argsort(-score, kind='stable')
+    order = order[numpy.argsort(owner[order], kind='stable')]
+    owner, similar, score = owner[order], similar[order], score[order]
+    position = numpy.arange(len(owner)) - numpy.searchsorted(owner, owner)
+    keep = position < k
+    return owner[keep], position[keep], similar[keep], score[keep]
+
+
+def changed_businesses(conn, since, until, limit=10000):
+    """Businesses with a review change, or deleted, after since up to until.
+
+    Returns them with the seq read up to, which is short of until if the
+    feed stopped at a gap that has not settled yet.
+    """
+    changed = set()
+    while since < until:
+        entries = changes.read_changes(conn, since, limit)
+        for entry in entries:
+            if entry['seq'] > until:
+                return changed, since
+            if entry['entity'] == changes.ENTITY_REVIEW and entry['data']:
+                changed.add(entry['data']['business_id'])
+            elif entry['entity'] == changes.ENTITY_BUSINESS and entry['op'] == changes.OP_DELETE:
+                changed.add(entry['id'])
+            since = entry['seq']
+        if len(entries) < limit:
+            break
+    return changed, since
+
+
+def affected(matrix, conn, changed, raters, k, min_common):
+    """The businesses whose lists can change when the given ones did."""
+    changed = sorted(changed)
+    businesses = set(changed)
+    # Lists that name a changed business: its score moved, or it is gone
+    for start in range(0, len(changed), 1000):
+        businesses.update(conn.execute(statements.SELECT_SIMILARITY_LISTS_WITH,
+                                       parameters={'business_ids': changed[start:start + 1000]}).scalars())
+    columns = [business_id for business_id in changed if business_id < matrix.shape[1]]
+    if columns:
+        # Any other list only changes if a changed business now makes it:
+        # the rest of its scores did not move. The lowest stored score is
+        # the bar, or there is none while a list is short of k.
+        bar = numpy.zeros(matrix.shape[1])
+        for business_id, count, lowest in conn.execute(statements.SELECT_SIMILARITY_BARS):
+            if count >= k and business_id < len(bar):
+                bar[business_id] = lowest
+        _, similar, score = candidates(matrix, columns, raters, min_common)
+        # Stored scores may have been rounded to single precision
+        businesses.update(similar[score >= bar[similar] - 1e-6].tolist())
+    return businesses
+
+
+def refresh(engine, full=False, k=DEFAULT_K, min_stars=4, min_common=2, chunk_size=1000, batch_size=10000,
+            cache=None):
+    """Bring business_similarities up to date. Returns (lists recomputed, full)."""
+    with engine.connect() as conn:
+        since = None if full else conn.execute(statements.LAST_SIMILARITY_SEQ).scalar()
+        # Read first, so that changes committed during the run are picked
+        # up again by the next one rather than missed. Reading a changed
+        # business's ratings again is harmless, so ratings read later than
+        # until are fine to keep.
+        until = changes.settled_seq(conn)
+        if since is None:
+            user_ids, business_ids = load_ratings(conn, min_stars, batch_size)
+            matrix = ratings_matrix(user_ids, business_ids)
+            businesses = set(numpy.flatnonzero(matrix.getnnz(axis=0)).tolist())
+            businesses.update(conn.execute(statements.SELECT_SIMILARITY_LISTS).scalars())
+        else:
+            changed, until = changed_businesses(conn, since, until)
+            cached = read_cache(cache, since, min_stars) if cache else None
+            if cached is None:
+                user_ids, business_ids = load_ratings(conn, min_stars, batch_size)
+            else:
+                user_ids, business_ids = update_ratings(conn, *cached, changed, min_stars, batch_size)
+            matrix = ratings_matrix(user_ids, business_ids)
+            businesses = affected(matrix, conn, changed, matrix.getnnz(axis=0), k, min_common)
+
+    raters = matrix.getnnz(axis=0)
+    businesses = sorted(businesses)
+    for start in range(0, len(businesses), chunk_size):
+        chunk = businesses[start:start + chunk_size]
+        # Businesses without a high rating have an empty list
+        columns = [business_id for business_id in chunk if business_id < matrix.shape[1]]
+        rows = []
+        if columns:
+            owner, position, similar, score = neighbors(matrix, columns, raters, k, min_common)
+            rows = [{'business_id': columns[o], 'position': p, 'similar_id': s, 'score': c}
+                    for o, p, s, c in zip(owner.tolist(), position.tolist(), similar.tolist(), score.tolist())]
+        with engine.connect() as conn:
+            conn.execute(statements.DELETE_BUSINESS_SIMILARITIES, parameters={'business_ids': chunk})
+            if rows:
+                conn.execute(statements.INSERT_BUSINESS_SIMILARITY, rows)
+            conn.commit()
+
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_SIMILARITY_RUN,
+                     parameters={'seq': until, 'businesses': len(businesses), 'finished_at': time.time()})
+        conn.commit()
+    if cache:
+        write_cache(cache, until, min_stars, user_ids, business_ids)
+    return len(businesses), since is None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sqlite', help='SQLite file to use instead of Cloud SQL')
+    parser.add_argument('--url', help='SQLAlchemy URL to use instead of Cloud SQL')
+    parser.add_argument('--full', action='store_true', help='recompute every business')
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='neighbors kept per business')
+    parser.add_argument('--min-stars', type=int, default=4, help='stars that count as a high rating')
+    parser.add_argument('--min-common', type=int, default=2, help='common raters a pair needs')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--cache', help='file to keep the rating matrix in between runs; '
+                                        'without it every run reads all ratings')
+    args = parser.parse_args()
+
+    if args.sqlite:
+        engine = sqlalchemy.create_engine('sqlite:///' + args.sqlite)
+    elif args.url:
+        engine = sqlalchemy.create_engine(args.url)
+    else:
+        from connect_connector import connect_with_connector
+        engine = connect_with_connector()
+
+    start = time.perf_counter()
+    count, full = refresh(engine, args.full, args.k, args.min_stars, args.min_common,
+                          args.chunk_size, args.batch_size, args.cache)
+    print('recomputed %d businesses (%s) in %.1f s'
+          % (count, 'full' if full else 'incremental', time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
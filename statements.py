@@ -0,0 +1,618 @@
+"""SQL statements used by main.py, built once at import time.
+
+The tables are described with SQLAlchemy Core ``Table`` objects that mirror
+the DDL in ``main.create_table``. Building each statement once (instead of a
+new ``sqlalchemy.text`` object per request) lets the engine's compiled cache
+(``query_cache_size``) hand back the compiled SQL straight away.
+
+PyMySQL has no server-side prepared statement support, so statements are
+still sent as text to MySQL; the saving is on the Python side.
+
+Rows with ``deleted_at`` set are tombstones (soft deletes) and every read
+filters them out. The indexes serving live-row reads are partial
+(``WHERE deleted_at IS NULL``) on SQLite and PostgreSQL. MySQL has no
+partial indexes, so ``main.create_table`` gives it composite indexes
+ending in ``deleted_at`` instead, which still turn ``deleted_at IS NULL``
+into an index lookup rather than a row filter.
+
+``review_text`` is stored compressed (see ``CompressedText``) to keep the
+review rows small; statements read and write it as plain text.
+"""
+
+import functools
+import zlib
+
+import sqlalchemy
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+metadata = sqlalchemy.MetaData()
+
+
+class CompressedText(sqlalchemy.types.TypeDecorator):
+    """Text stored zlib-compressed whenever that makes it smaller.
+
+    The first byte of the stored value says how the rest is encoded: 0 for
+    plain UTF-8, 1 for zlib. Values read back as str (a column not yet
+    migrated by migrations.py) are passed through unchanged.
+    """
+    impl = sqlalchemy.VARBINARY
+    cache_ok = True
+
+    RAW = b'\x00'
+    ZLIB = b'\x01'
+
+    def __init__(self, length):
+        # length is in characters, as for String; UTF-8 needs up to 4
+        # bytes per character, plus the header byte
+        super().__init__(4 * length + 1)
+        self.max_chars = length
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        data = value.encode('utf-8')
+        compressed = zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return self.ZLIB + compressed
+        return self.RAW + data
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if value[:1] == self.ZLIB:
+            return zlib.decompress(value[1:]).decode('utf-8')
+        return value[1:].decode('utf-8')
+
+
+lodgings = sqlalchemy.Table(
+    'lodgings', metadata,
+    sqlalchemy.Column('lodging_id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('name', sqlalchemy.String(30), nullable=False),
+    sqlalchemy.Column('description', sqlalchemy.String(100), nullable=False),
+    sqlalchemy.Column('price', sqlalchemy.Numeric(6, 2), nullable=False),
+    sqlalchemy.Column('deleted_at', sqlalchemy.Float(precision=53)),
+)
+
+users = sqlalchemy.Table(
+    'users', metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('username', sqlalchemy.String(100), nullable=False),
+)
+
+businesses = sqlalchemy.Table(
+    'businesses', metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('name', sqlalchemy.String(50), nullable=False),
+    sqlalchemy.Column('street_address', sqlalchemy.String(100), nullable=False),
+    sqlalchemy.Column('owner_id', sqlalchemy.Integer),
+    sqlalchemy.Column('city', sqlalchemy.String(50), nullable=False),
+    # Two letter postal abbreviation
+    sqlalchemy.Column('state', sqlalchemy.CHAR(2), nullable=False),
+    # A string, so that leading zeros (e.g. 02134) survive
+    sqlalchemy.Column('zip_code', sqlalchemy.CHAR(5), nullable=False),
+    # Set when the business is deleted: a soft delete, or a hard delete
+    # whose reviews are still being purged
+    sqlalchemy.Column('deleted_at', sqlalchemy.Float(precision=53)),
+)
+
+reviews = sqlalchemy.Table(
+    'reviews', metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('user_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), nullable=False),
+    sqlalchemy.Column('business_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('businesses.id'), nullable=False),
+    sqlalchemy.Column('stars', sqlalchemy.SmallInteger, nullable=False),
+    sqlalchemy.Column('review_text', CompressedText(1000)),
+    # Unix times; NULL for reviews written before the columns existed
+    sqlalchemy.Column('created_at', sqlalchemy.Float(precision=53)),
+    sqlalchemy.Column('updated_at', sqlalchemy.Float(precision=53)),
+    sqlalchemy.Column('deleted_at', sqlalchemy.Float(precision=53)),
+    sqlalchemy.CheckConstraint('stars BETWEEN 1 AND 5', name='reviews_stars'),
+)
+
+
+def _live_index(name, table, *columns):
+    # Columns are names, or expressions such as table.c.created_at.desc()
+    return sqlalchemy.Index(name, *[table.c[column] if isinstance(column, str) else column for column in columns],
+                            sqlite_where=table.c.deleted_at.is_(None),
+                            postgresql_where=table.c.deleted_at.is_(None))
+
+
+_live_index('businesses_owner_live', businesses, 'owner_id')
+_live_index('reviews_user_live', reviews, 'user_id')
+# A business's reviews in id order, for keyset pages that read only the
+# rows they return however many reviews the business has
+_live_index('reviews_business_page', reviews, 'business_id', 'id')
+# Newest first, for the GET /reviews/recent feeds
+_live_index('reviews_recent', reviews, reviews.c.created_at.desc(), reviews.c.id.desc())
+_live_index('reviews_business_recent', reviews, 'business_id', reviews.c.created_at.desc(), reviews.c.id.desc())
+# One live review per user and business, enforced by the database so that
+# it holds across processes. MySQL has no partial indexes, so
+# main.create_table makes it unique on (user_id, business_id, is_live),
+# is_live being a generated column that is NULL for deleted reviews.
+sqlalchemy.Index('reviews_live_pair', reviews.c.user_id, reviews.c.business_id, unique=True,
+                 sqlite_where=reviews.c.deleted_at.is_(None),
+                 postgresql_where=reviews.c.deleted_at.is_(None)).ddl_if(dialect=('sqlite', 'postgresql'))
+
+
+def is_duplicate_review(error):
+    """Whether a failed insert broke reviews_live_pair."""
+    if not isinstance(error, sqlalchemy.exc.IntegrityError):
+        return False
+    # MySQL's ER_DUP_ENTRY (the only unique key an insert can break is this
+    # one, ids being generated); SQLite names the columns, PostgreSQL the index
+    if getattr(error.orig, 'args', None) and error.orig.args[0] == 1062:
+        return True
+    message = str(error.orig)
+    return 'reviews_live_pair' in message or 'reviews.user_id, reviews.business_id' in message
+
+
+def _tombstone_index(name, table):
+    # Partial, so that a planner without statistics never takes it for the
+    # 'deleted_at IS NULL' of live reads; compaction's 'deleted_at < :horizon'
+    # implies NOT NULL and can still use it
+    return sqlalchemy.Index(name, table.c.deleted_at,
+                            sqlite_where=table.c.deleted_at.is_not(None),
+                            postgresql_where=table.c.deleted_at.is_not(None))
+
+
+# Tombstones by age, for compaction
+_tombstone_index('businesses_deleted', businesses)
+_tombstone_index('reviews_deleted', reviews)
+_tombstone_index('lodgings_deleted', lodgings)
+
+# Reviews the buffered writer (review_writer.py) could not store, kept with
+# the error so they can be replayed rather than lost
+review_dead_letters = sqlalchemy.Table(
+    'review_dead_letters', metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('user_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('business_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('stars', sqlalchemy.SmallInteger, nullable=False),
+    sqlalchemy.Column('review_text', sqlalchemy.Text),
+    sqlalchemy.Column('error', sqlalchemy.String(1000), nullable=False),
+    sqlalchemy.Column('failed_at', sqlalchemy.Float(precision=53), nullable=False),
+)
+
+# Review count and star total of every business, kept in step with its
+# live reviews by the review handlers. leaderboard.py ranks from these.
+business_ratings = sqlalchemy.Table(
+    'business_ratings', metadata,
+    sqlalchemy.Column('business_id', sqlalchemy.Integer, primary_key=True, autoincrement=False),
+    sqlalchemy.Column('review_count', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('star_total', sqlalchemy.Integer, nullable=False),
+)
+
+# Each business's most similar businesses by co-review, best first, as
+# computed by similarity.py. Read by GET /businesses/<id>/similar.
+business_similarities = sqlalchemy.Table(
+    'business_similarities', metadata,
+    sqlalchemy.Column('business_id', sqlalchemy.Integer, primary_key=True, autoincrement=False),
+    sqlalchemy.Column('position', sqlalchemy.SmallInteger, primary_key=True, autoincrement=False),
+    sqlalchemy.Column('similar_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('score', sqlalchemy.Float, nullable=False),
+    # Which lists mention a business, for incremental refreshes
+    sqlalchemy.Index('business_similarities_similar', 'similar_id'),
+)
+
+# One row per similarity.py run: the change feed seq it is up to date with
+similarity_runs = sqlalchemy.Table(
+    'similarity_runs', metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('seq', sqlalchemy.BigInteger().with_variant(sqlalchemy.Integer, 'sqlite'), nullable=False),
+    sqlalchemy.Column('businesses', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('finished_at', sqlalchemy.Float(precision=53), nullable=False),
+)
+
+# Outbox of mutations, written in the same transaction as the change itself
+changes = sqlalchemy.Table(
+    'changes', metadata,
+    sqlalchemy.Column('seq', sqlalchemy.BigInteger().with_variant(sqlalchemy.Integer, 'sqlite'), primary_key=True),
+    sqlalchemy.Column('entity', sqlalchemy.String(20), nullable=False),
+    sqlalchemy.Column('entity_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('op', sqlalchemy.String(10), nullable=False),
+    sqlalchemy.Column('payload', sqlalchemy.Text),
+    # When the row was written, to tell a seq still being committed from one
+    # that was rolled back (see changes.read_changes)
+    sqlalchemy.Column('created_at', sqlalchemy.Float(precision=53)),
+    sqlalchemy.Index('changes_entity', 'entity', 'entity_id', 'seq'),
+)
+
+# Stored responses for POSTs sent with an Idempotency-Key header. A NULL
+# status means the first request with that key is still being handled.
+idempotency_keys = sqlalchemy.Table(
+    'idempotency_keys', metadata,
+    sqlalchemy.Column('client_id', sqlalchemy.String(100), primary_key=True),
+    sqlalchemy.Column('idem_key', sqlalchemy.String(100), primary_key=True),
+    sqlalchemy.Column('request_hash', sqlalchemy.String(64), nullable=False),
+    sqlalchemy.Column('status', sqlalchemy.Integer),
+    sqlalchemy.Column('body', sqlalchemy.Text),
+    sqlalchemy.Column('created_at', sqlalchemy.Float(precision=53), nullable=False),
+    sqlalchemy.Index('idempotency_keys_created', 'created_at'),
+)
+
+# Background purges of a deleted business's reviews, see delete_jobs.py
+delete_jobs = sqlalchemy.Table(
+    'delete_jobs', metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('business_id', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('action', sqlalchemy.String(10), nullable=False),
+    sqlalchemy.Column('state', sqlalchemy.String(10), nullable=False),
+    sqlalchemy.Column('processed', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('total', sqlalchemy.Integer),
+    sqlalchemy.Column('created_at', sqlalchemy.Float(precision=53), nullable=False),
+    # Doubles as the heartbeat of the worker running the job
+    sqlalchemy.Column('updated_at', sqlalchemy.Float(precision=53), nullable=False),
+    sqlalchemy.Index('delete_jobs_state', 'state', 'updated_at'),
+)
+
+# MySQL: the most recent AUTO_INCREMENT value generated on this connection
+LAST_INSERT_ID = select(func.last_insert_id())
+
+# Lodgings
+INSERT_LODGING = insert(lodgings).values(
+    name=bindparam('name'),
+    description=bindparam('description'),
+    price=bindparam('price'),
+)
+_live_lodging = lodgings.c.deleted_at.is_(None)
+SELECT_LODGINGS = (select(lodgings.c.lodging_id, lodgings.c.name, lodgings.c.price, lodgings.c.description)
+                   .where(_live_lodging))
+SELECT_LODGING = SELECT_LODGINGS.where(lodgings.c.lodging_id == bindparam('lodging_id'))
+# 'lodging_id' is a column name, which update() reserves for the SET clause
+UPDATE_LODGING = update(lodgings).where(lodgings.c.lodging_id == bindparam('b_lodging_id'), _live_lodging).values(
+    name=bindparam('name'),
+    description=bindparam('description'),
+    price=bindparam('price'),
+)
+DELETE_LODGING = delete(lodgings).where(lodgings.c.lodging_id == bindparam('lodging_id'), _live_lodging)
+SOFT_DELETE_LODGING = (update(lodgings)
+                       .where(lodgings.c.lodging_id == bindparam('b_lodging_id'), _live_lodging)
+                       .values(deleted_at=bindparam('deleted_at')))
+
+# Businesses
+INSERT_BUSINESS = insert(businesses).values(
+    name=bindparam('name'),
+    street_address=bindparam('street_address'),
+    owner_id=bindparam('owner_id'),
+    city=bindparam('city'),
+    state=bindparam('state'),
+    zip_code=bindparam('zip_code'),
+)
+# A business with deleted_at set is gone as far as the API is concerned
+_live_business = businesses.c.deleted_at.is_(None)
+SELECT_BUSINESS = select(businesses).where(businesses.c.id == bindparam('business_id'), _live_business)
+BUSINESS_EXISTS = select(businesses.c.id).where(businesses.c.id == bindparam('business_id'), _live_business)
+
+# The list statements take the projected column names as a tuple so that a
+# narrowed projection (e.g. ?fields=id,name) is built and compiled only once.
+@functools.lru_cache(maxsize=64)
+def select_businesses_page(columns):
+    return (select(*[businesses.c[name] for name in columns])
+            .where(_live_business)
+            .limit(bindparam('limit'))
+            .offset(bindparam('offset')))
+
+
+@functools.lru_cache(maxsize=64)
+def select_owner_businesses(columns):
+    return (select(*[businesses.c[name] for name in columns])
+            .where(businesses.c.owner_id == bindparam('owner_id'), _live_business))
+
+UPDATE_BUSINESS = update(businesses).where(businesses.c.id == bindparam('business_id'), _live_business).values(
+    name=bindparam('name'),
+    street_address=bindparam('street_address'),
+    owner_id=bindparam('owner_id'),
+    city=bindparam('city'),
+    state=bindparam('state'),
+    zip_code=bindparam('zip_code'),
+)
+DELETE_BUSINESS = delete(businesses).where(businesses.c.id == bindparam('business_id'), _live_business)
+TOMBSTONE_BUSINESS = update(businesses).where(businesses.c.id == bindparam('business_id'), _live_business).values(
+    deleted_at=bindparam('deleted_at'),
+)
+# Drops the tombstone itself once the delete job has purged the reviews
+PURGE_BUSINESS = delete(businesses).where(businesses.c.id == bindparam('business_id'))
+
+# Reviews
+INSERT_REVIEW = insert(reviews).values(
+    user_id=bindparam('user_id'),
+    business_id=bindparam('business_id'),
+    stars=bindparam('stars'),
+    review_text=bindparam('review_text'),
+    created_at=bindparam('created_at'),
+    updated_at=bindparam('created_at'),
+)
+_live_review = reviews.c.deleted_at.is_(None)
+# What the API serves and lets clients change: a live review of a live
+# business. An async business delete only tombstones the business, and its
+# reviews keep deleted_at NULL until the delete job gets to them.
+_visible_review = sqlalchemy.and_(
+    _live_review,
+    select(businesses.c.id).where(businesses.c.id == reviews.c.business_id, _live_business).exists())
+SELECT_REVIEW = select(reviews).where(reviews.c.id == bindparam('review_id'), _visible_review)
+REVIEW_EXISTS_FOR_USER = select(reviews.c.id).where(
+    reviews.c.user_id == bindparam('user_id'),
+    reviews.c.business_id == bindparam('business_id'),
+    _live_review,
+)
+
+
+@functools.lru_cache(maxsize=64)
+def select_user_reviews(columns):
+    return select(*[reviews.c[name] for name in columns]).where(reviews.c.user_id == bindparam('user_id'), _visible_review)
+
+
+@functools.lru_cache(maxsize=64)
+def select_business_reviews_page(columns, min_stars=False):
+    """The next :limit reviews of :business_id after review id :after."""
+    stmt = (select(*[reviews.c[name] for name in columns])
+            .where(reviews.c.business_id == bindparam('business_id'),
+                   reviews.c.id > bindparam('after'),
+                   _live_review))
+    if min_stars:
+        stmt = stmt.where(reviews.c.stars >= bindparam('min_stars'))
+    return stmt.order_by(reviews.c.id).limit(bindparam('limit'))
+
+
+@functools.lru_cache(maxsize=64)
+def select_recent_reviews(columns, scope=None, paged=False):
+    """The newest :limit reviews, of :business_id or :owner_id's businesses
+    when scope is 'business' or 'owner'. A paged statement starts after the
+    review (:before_created_at, :before_id)."""
+    stmt = select(*[reviews.c[name] for name in columns]).where(_visible_review)
+    if scope == 'business':
+        stmt = stmt.where(reviews.c.business_id == bindparam('business_id'))
+    elif scope == 'owner':
+        stmt = stmt.where(reviews.c.business_id.in_(
+            select(businesses.c.id).where(businesses.c.owner_id == bindparam('owner_id'), _live_business)))
+    if paged:
+        # The plain <= is what the index range is seeked on; the OR then
+        # drops the rows of the cursor's own timestamp up to its id
+        stmt = stmt.where(reviews.c.created_at <= bindparam('before_created_at'),
+                          (reviews.c.created_at < bindparam('before_created_at'))
+                          | (reviews.c.id < bindparam('before_id')))
+    else:
+        stmt = stmt.where(reviews.c.created_at.is_not(None))
+    return stmt.order_by(reviews.c.created_at.desc(), reviews.c.id.desc()).limit(bindparam('limit'))
+
+
+# review_text is optional on update: a NULL :b_review_text keeps the old text
+UPDATE_REVIEW = update(reviews).where(reviews.c.id == bindparam('review_id'), _visible_review).values(
+    stars=bindparam('stars'),
+    review_text=func.coalesce(bindparam('b_review_text', type_=reviews.c.review_text.type), reviews.c.review_text),
+    updated_at=bindparam('updated_at'),
+)
+# For dialects with UPDATE ... RETURNING (SQLite, PostgreSQL), the update
+# also hands back the columns the response needs. MySQL and MariaDB have
+# none; MariaDB's RETURNING is only on DELETE and INSERT.
+UPDATE_REVIEW_RETURNING = UPDATE_REVIEW.returning(reviews.c.user_id, reviews.c.business_id, reviews.c.review_text,
+                                                  reviews.c.created_at)
+DELETE_REVIEW = delete(reviews).where(reviews.c.id == bindparam('review_id'), _visible_review)
+SOFT_DELETE_REVIEW = update(reviews).where(reviews.c.id == bindparam('review_id'), _visible_review).values(
+    deleted_at=bindparam('deleted_at'),
+)
+DELETE_BUSINESS_REVIEWS = delete(reviews).where(reviews.c.business_id == bindparam('business_id'))
+SOFT_DELETE_BUSINESS_REVIEWS = (update(reviews)
+                                .where(reviews.c.business_id == bindparam('b_business_id'), _live_review)
+                                .values(deleted_at=bindparam('deleted_at')))
+COUNT_BUSINESS_REVIEWS = select(func.count()).select_from(reviews).where(reviews.c.business_id == bindparam('business_id'))
+COUNT_LIVE_BUSINESS_REVIEWS = COUNT_BUSINESS_REVIEWS.where(_live_review)
+# MySQL rejects LIMIT inside an IN subquery, so chunks are selected first
+SELECT_BUSINESS_REVIEW_IDS = (select(reviews.c.id)
+                              .where(reviews.c.business_id == bindparam('business_id'))
+                              .limit(bindparam('limit')))
+SELECT_LIVE_BUSINESS_REVIEW_IDS = SELECT_BUSINESS_REVIEW_IDS.where(_live_review)
+DELETE_REVIEWS = delete(reviews).where(reviews.c.id.in_(bindparam('review_ids', expanding=True)))
+SOFT_DELETE_REVIEWS = (update(reviews)
+                       .where(reviews.c.id.in_(bindparam('review_ids', expanding=True)))
+                       .values(deleted_at=bindparam('deleted_at')))
+
+INSERT_REVIEW_DEAD_LETTER = insert(review_dead_letters).values(
+    user_id=bindparam('user_id'),
+    business_id=bindparam('business_id'),
+    stars=bindparam('stars'),
+    review_text=bindparam('review_text'),
+    error=bindparam('error'),
+    failed_at=bindparam('failed_at'),
+)
+
+# Business ratings
+INSERT_BUSINESS_RATING = insert(business_ratings).values(business_id=bindparam('business_id'), review_count=0, star_total=0)
+# Column names are reserved for the SET clause of update(), hence the b_ prefix
+ADJUST_BUSINESS_RATING = (update(business_ratings)
+                          .where(business_ratings.c.business_id == bindparam('b_business_id'))
+                          .values(review_count=business_ratings.c.review_count + bindparam('reviews'),
+                                  star_total=business_ratings.c.star_total + bindparam('stars')))
+# Run before UPDATE_REVIEW, while the row still holds the old stars
+_rated_review = select(reviews.c.business_id).where(reviews.c.id == bindparam('review_id'), _visible_review)
+RERATE_REVIEW = (update(business_ratings)
+                 .where(business_ratings.c.business_id == _rated_review.scalar_subquery())
+                 .values(star_total=business_ratings.c.star_total + bindparam('stars')
+                         - select(reviews.c.stars).where(reviews.c.id == bindparam('review_id'), _visible_review)
+                         .scalar_subquery()))
+# What a deleted review takes off its business's rating. The RETURNING forms
+# are for dialects that have them (MariaDB only for DELETE, so not for a soft
+# delete); MySQL locks and reads the row first.
+SELECT_REVIEW_RATING = (select(reviews.c.business_id, reviews.c.stars)
+                        .where(reviews.c.id == bindparam('review_id'), _visible_review)
+                        .with_for_update())
+DELETE_REVIEW_RETURNING = DELETE_REVIEW.returning(reviews.c.business_id, reviews.c.stars)
+SOFT_DELETE_REVIEW_RETURNING = SOFT_DELETE_REVIEW.returning(reviews.c.business_id, reviews.c.stars)
+DELETE_BUSINESS_RATING = delete(business_ratings).where(business_ratings.c.business_id == bindparam('business_id'))
+# Rows for the businesses that have none yet (the table is new, or the data
+# was bulk loaded), computed from their live reviews
+BACKFILL_BUSINESS_RATINGS = insert(business_ratings).from_select(
+    ['business_id', 'review_count', 'star_total'],
+    select(businesses.c.id, func.count(reviews.c.id), func.coalesce(func.sum(reviews.c.stars), 0))
+    .select_from(businesses.outerjoin(reviews, (reviews.c.business_id == businesses.c.id) & _live_review))
+    .where(_live_business,
+           ~select(business_ratings.c.business_id)
+           .where(business_ratings.c.business_id == businesses.c.id).exists())
+    .group_by(businesses.c.id))
+_rated_business = (select(businesses.c.id, businesses.c.name, businesses.c.city, businesses.c.state,
+                          business_ratings.c.review_count, business_ratings.c.star_total)
+                   .join(business_ratings, business_ratings.c.business_id == businesses.c.id)
+                   .where(_live_business))
+SELECT_RANKED_BUSINESSES = _rated_business.where(business_ratings.c.review_count >= bindparam('min_reviews'))
+SELECT_BUSINESS_RATINGS = _rated_business.where(businesses.c.id.in_(bindparam('business_ids', expanding=True)))
+
+# Business similarities
+# One query for the business and its list: the business's row joined to
+# its live similar businesses, or to NULLs if it has none. No row at all
+# means the business does not exist.
+_similar = businesses.alias('similar')
+SELECT_SIMILAR_BUSINESSES = (select(_similar.c.id, _similar.c.name, _similar.c.city, _similar.c.state,
+                                    business_similarities.c.score)
+                             .select_from(businesses.outerjoin(
+                                 business_similarities.join(_similar, sqlalchemy.and_(
+                                     _similar.c.id == business_similarities.c.similar_id,
+                                     _similar.c.deleted_at.is_(None))),
+                                 business_similarities.c.business_id == businesses.c.id))
+                             .where(businesses.c.id == bindparam('business_id'), _live_business)
+                             .order_by(business_similarities.c.position)
+                             .limit(bindparam('limit')))
+# The co-review matrix of similarity.py: who rated which live business highly
+SELECT_HIGH_RATINGS = (select(reviews.c.user_id, reviews.c.business_id)
+                       .join(businesses, businesses.c.id == reviews.c.business_id)
+                       .where(_live_review, _live_business, reviews.c.stars >= bindparam('min_stars')))
+# The same for some businesses, through reviews_business_page
+SELECT_BUSINESS_HIGH_RATINGS = SELECT_HIGH_RATINGS.where(
+    reviews.c.business_id.in_(bindparam('business_ids', expanding=True)))
+SELECT_SIMILARITY_LISTS = select(business_similarities.c.business_id).distinct()
+SELECT_SIMILARITY_LISTS_WITH = SELECT_SIMILARITY_LISTS.where(
+    business_similarities.c.similar_id.in_(bindparam('business_ids', expanding=True)))
+# Length and lowest score of every stored list
+SELECT_SIMILARITY_BARS = (select(business_similarities.c.business_id, func.count(),
+                                 func.min(business_similarities.c.score))
+                          .group_by(business_similarities.c.business_id))
+DELETE_BUSINESS_SIMILARITIES = delete(business_similarities).where(
+    business_similarities.c.business_id.in_(bindparam('business_ids', expanding=True)))
+INSERT_BUSINESS_SIMILARITY = insert(business_similarities)
+INSERT_SIMILARITY_RUN = insert(similarity_runs).values(
+    seq=bindparam('seq'),
+    businesses=bindparam('businesses'),
+    finished_at=bindparam('finished_at'),
+)
+LAST_SIMILARITY_SEQ = select(func.max(similarity_runs.c.seq))
+
+# Users
+SELECT_USER = select(users).where(users.c.id == bindparam('user_id'))
+
+# Change feed
+INSERT_CHANGE = insert(changes).values(
+    entity=bindparam('entity'),
+    entity_id=bindparam('entity_id'),
+    op=bindparam('op'),
+    payload=bindparam('payload'),
+    created_at=bindparam('created_at'),
+)
+SELECT_CHANGES_SINCE = (select(changes)
+                        .where(changes.c.seq > bindparam('since'))
+                        .order_by(changes.c.seq)
+                        .limit(bindparam('limit')))
+# Rows below the horizon that a later row for the same entity supersedes
+_newer = changes.alias('newer')
+SELECT_SUPERSEDED_CHANGES = (select(changes.c.seq)
+                             .where(changes.c.seq < bindparam('horizon'),
+                                    select(_newer.c.seq)
+                                    .where(_newer.c.entity == changes.c.entity,
+                                           _newer.c.entity_id == changes.c.entity_id,
+                                           _newer.c.seq > changes.c.seq,
+                                           _newer.c.seq < bindparam('horizon'))
+                                    .exists())
+                             .limit(bindparam('limit')))
+# Newest first, for finding where the settled part of the feed ends
+SELECT_CHANGES_BEFORE = (select(changes.c.seq, changes.c.created_at)
+                         .where(changes.c.seq < bindparam('before'))
+                         .order_by(changes.c.seq.desc())
+                         .limit(bindparam('limit')))
+LAST_CHANGE_SEQ = select(func.max(changes.c.seq))
+DELETE_CHANGES = delete(changes).where(changes.c.seq.in_(bindparam('seqs', expanding=True)))
+
+# Idempotency keys
+# Column names are reserved for the SET clause of update(), hence the b_ prefix
+_idempotency_key = (idempotency_keys.c.client_id == bindparam('b_client_id')) & \
+    (idempotency_keys.c.idem_key == bindparam('b_idem_key'))
+SELECT_IDEMPOTENCY_KEY = select(idempotency_keys).where(_idempotency_key)
+INSERT_IDEMPOTENCY_KEY = insert(idempotency_keys).values(
+    client_id=bindparam('b_client_id'),
+    idem_key=bindparam('b_idem_key'),
+    request_hash=bindparam('request_hash'),
+    created_at=bindparam('created_at'),
+)
+# created_at of an in-progress key is when it was claimed, and identifies
+# the claim: a request whose lease was taken over no longer matches
+_idempotency_claim = _idempotency_key & idempotency_keys.c.status.is_(None) & \
+    (idempotency_keys.c.created_at == bindparam('claimed_at'))
+COMPLETE_IDEMPOTENCY_KEY = update(idempotency_keys).where(_idempotency_claim).values(
+    status=bindparam('status'),
+    body=bindparam('body'),
+)
+TAKE_OVER_IDEMPOTENCY_KEY = update(idempotency_keys).where(_idempotency_claim).values(created_at=bindparam('now'))
+RELEASE_IDEMPOTENCY_KEY = delete(idempotency_keys).where(_idempotency_claim)
+DELETE_IDEMPOTENCY_KEY = delete(idempotency_keys).where(_idempotency_key)
+SELECT_EXPIRED_IDEMPOTENCY_KEYS = (select(idempotency_keys.c.client_id, idempotency_keys.c.idem_key)
+                                   .where(idempotency_keys.c.created_at < bindparam('before'))
+                                   .order_by(idempotency_keys.c.created_at)
+                                   .limit(bindparam('limit')))
+COUNT_IDEMPOTENCY_KEYS = select(func.count()).select_from(idempotency_keys)
+# created_at of the (n+1)-th newest key; purge() evicts everything older
+NTH_NEWEST_IDEMPOTENCY_KEY = (select(idempotency_keys.c.created_at)
+                              .order_by(idempotency_keys.c.created_at.desc())
+                              .limit(1)
+                              .offset(bindparam('n')))
+
+# Delete jobs
+# Column names are reserved for the SET clause of update(), hence the b_ prefix
+INSERT_DELETE_JOB = insert(delete_jobs).values(
+    business_id=bindparam('business_id'),
+    action=bindparam('action'),
+    state='pending',
+    processed=0,
+    created_at=bindparam('created_at'),
+    updated_at=bindparam('created_at'),
+)
+SELECT_DELETE_JOB = select(delete_jobs).where(delete_jobs.c.id == bindparam('job_id'))
+# Pending jobs, and running jobs whose worker stopped sending heartbeats
+SELECT_RUNNABLE_DELETE_JOBS = (select(delete_jobs)
+                               .where((delete_jobs.c.state == 'pending')
+                                      | ((delete_jobs.c.state == 'running')
+                                         & (delete_jobs.c.updated_at < bindparam('stale_before'))))
+                               .order_by(delete_jobs.c.id)
+                               .limit(bindparam('limit')))
+# Matching on the heartbeat that was read makes the claim atomic: of two
+# workers racing for the same job, only one updates a row
+CLAIM_DELETE_JOB = (update(delete_jobs)
+                    .where(delete_jobs.c.id == bindparam('b_job_id'),
+                           delete_jobs.c.state != 'done',
+                           delete_jobs.c.updated_at == bindparam('b_updated_at'))
+                    .values(state='running', total=bindparam('total'), updated_at=bindparam('now')))
+UPDATE_DELETE_JOB_PROGRESS = (update(delete_jobs)
+                              .where(delete_jobs.c.id == bindparam('b_job_id'))
+                              .values(processed=delete_jobs.c.processed + bindparam('n'),
+                                      updated_at=bindparam('now')))
+FINISH_DELETE_JOB = (update(delete_jobs)
+                     .where(delete_jobs.c.id == bindparam('b_job_id'))
+                     .values(state='done', updated_at=bindparam('now')))
+
+# Tombstone compaction: rows soft-deleted before the horizon, oldest first
+SELECT_EXPIRED_REVIEWS = (select(reviews.c.id)
+                          .where(reviews.c.deleted_at < bindparam('horizon'))
+                          .order_by(reviews.c.deleted_at)
+                          .limit(bindparam('limit')))
+SELECT_EXPIRED_LODGINGS = (select(lodgings.c.lodging_id)
+                           .where(lodgings.c.deleted_at < bindparam('horizon'))
+                           .order_by(lodgings.c.deleted_at)
+                           .limit(bindparam('limit')))
+DELETE_LODGINGS = delete(lodgings).where(lodgings.c.lodging_id.in_(bindparam('lodging_ids', expanding=True)))
+# A tombstoned business is only dropped once no review row points at it
+# and no delete job still has work to do on it
+SELECT_EXPIRED_BUSINESSES = (select(businesses.c.id)
+                             .where(businesses.c.deleted_at < bindparam('horizon'),
+                                    ~select(reviews.c.id).where(reviews.c.business_id == businesses.c.id).exists(),
+                                    ~select(delete_jobs.c.id).where(delete_jobs.c.business_id == businesses.c.id,
+                                                                    delete_jobs.c.state != 'done').exists())
+                             .order_by(businesses.c.deleted_at)
+                             .limit(bindparam('limit')))
+DELETE_BUSINESSES = delete(businesses).where(businesses.c.id.in_(bindparam('business_ids', expanding=True)))
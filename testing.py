@@ -15,8 +15,8 @@ cursor.execute('''
         street_address VARCHAR(100) NOT NULL,
         owner_id INTEGER,
         city VARCHAR(50) NOT NULL,
-        state TEXT NOT NULL,
-        zip_code INTEGER NOT NULL
+        state CHAR(2) NOT NULL,
+        zip_code CHAR(5) NOT NULL
     )
 ''')
 
@@ -25,13 +25,18 @@ cursor.execute('''
         id INTEGER PRIMARY KEY,
         user_id INTEGER NOT NULL,
         business_id INTEGER NOT NULL,
-        stars INTEGER NOT NULL,
+        stars INTEGER NOT NULL CHECK (stars BETWEEN 1 AND 5),
         review_text VARCHAR(1000),
         FOREIGN KEY (user_id) REFERENCES users(id),
         FOREIGN KEY (business_id) REFERENCES businesses(id)
     )
 ''')
 
+# Lists of a business's reviews page through this in id order
+cursor.execute('''
+    CREATE INDEX IF NOT EXISTS reviews_business_page ON reviews (business_id, id)
+''')
+
 # Commit changes and close connection
 connection.commit()
 connection.close()
@@ -0,0 +1,32 @@
+import pytest
+import sqlalchemy
+
+import main
+import statements
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """A SQLite file with every table of statements.py."""
+    # SQLite's spelling of MySQL's LAST_INSERT_ID()
+    monkeypatch.setattr(statements, 'LAST_INSERT_ID', sqlalchemy.select(sqlalchemy.func.last_insert_rowid()))
+    engine = sqlalchemy.create_engine('sqlite:///' + str(tmp_path / 'api.db'))
+    statements.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def app(engine):
+    app = main.create_app(engine=engine)
+    yield app
+    main.close_app(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+BUSINESS = {'name': 'Cafe', 'street_address': '1 Main St', 'owner_id': 7, 'city': 'Portland', 'state': 'OR',
+            'zip_code': 97201}
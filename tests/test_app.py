@@ -0,0 +1,28 @@
+import sqlalchemy
+
+import main
+import statements
+from conftest import BUSINESS
+
+
+def test_apps_do_not_share_state(client, tmp_path):
+    other_engine = sqlalchemy.create_engine('sqlite:///' + str(tmp_path / 'other.db'))
+    statements.metadata.create_all(other_engine)
+    other_app = main.create_app(engine=other_engine)
+    try:
+        other = other_app.test_client()
+        assert client.post('/businesses', json=BUSINESS).status_code == 201
+        assert client.post('/reviews', json={'user_id': 1, 'business_id': 1, 'stars': 5}).status_code == 201
+
+        assert client.get('/businesses/1').status_code == 200
+        assert other.get('/businesses/1').status_code == 404
+        # Same URL, so a cache shared by the two apps would answer both
+        assert len(client.get('/reviews/recent').get_json()['entries']) == 1
+        assert other.get('/reviews/recent').get_json()['entries'] == []
+
+        state, other_state = client.application.extensions['api'], other_app.extensions['api']
+        assert other_state.db is other_engine
+        assert other_state.leaderboard is not state.leaderboard
+    finally:
+        main.close_app(other_app)
+        other_engine.dispose()
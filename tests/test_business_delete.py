@@ -0,0 +1,28 @@
+import sqlalchemy
+
+import main
+import statements
+from conftest import BUSINESS
+
+
+def test_async_delete_hides_reviews_at_once(client, engine, monkeypatch):
+    for _ in range(2):
+        assert client.post('/businesses', json=BUSINESS).status_code == 201
+    gone = client.post('/reviews', json={'user_id': 1, 'business_id': 1, 'stars': 5}).get_json()['id']
+    kept = client.post('/reviews', json={'user_id': 1, 'business_id': 2, 'stars': 4}).get_json()['id']
+
+    # The app is set up by now without a delete job runner, so the
+    # reviews stay in the table for the rest of the test
+    monkeypatch.setattr(main, 'BUSINESS_DELETE_MODE', 'async')
+    assert client.delete('/businesses/1').status_code == 202
+    with engine.connect() as conn:
+        assert conn.execute(sqlalchemy.select(statements.reviews.c.deleted_at)
+                            .where(statements.reviews.c.id == gone)).scalar_one() is None
+
+    assert client.get('/reviews/%d' % gone).status_code == 404
+    assert client.put('/reviews/%d' % gone, json={'stars': 1}).status_code == 404
+    assert client.delete('/reviews/%d' % gone).status_code == 404
+    assert [review['id'] for review in client.get('/users/1/reviews').get_json()] == [kept]
+    assert [review['id'] for review in client.get('/reviews/recent').get_json()['entries']] == [kept]
+    assert client.get('/reviews/recent?business_id=1').status_code == 404
+    assert client.get('/reviews/%d' % kept).status_code == 200
@@ -0,0 +1,22 @@
+import pytest
+
+import main_mysql
+from conftest import BUSINESS
+
+
+@pytest.mark.parametrize('min_stars', ['0', '6', 'abc', '4.5', ''])
+def test_min_stars_out_of_range_or_not_a_whole_number(client, min_stars):
+    assert client.post('/businesses', json=BUSINESS).status_code == 201
+    for http in (client, main_mysql.app.test_client()):
+        response = http.get('/businesses/1/reviews', query_string={'min_stars': min_stars})
+        assert response.status_code == 400
+        assert response.get_json() == {"Error": "min_stars must be a whole number from 1 to 5"}
+
+
+def test_min_stars_filters(client):
+    assert client.post('/businesses', json=BUSINESS).status_code == 201
+    for user_id, stars in ((1, 2), (2, 5)):
+        assert client.post('/reviews', json={'user_id': user_id, 'business_id': 1, 'stars': stars}).status_code == 201
+    assert len(client.get('/businesses/1/reviews').get_json()['entries']) == 2
+    assert [review['stars'] for review in
+            client.get('/businesses/1/reviews?min_stars=4').get_json()['entries']] == [5]
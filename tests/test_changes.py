@@ -0,0 +1,22 @@
+import time
+
+import changes
+import statements
+
+
+def test_readers_wait_out_a_gap_for_the_settle_window(engine, monkeypatch):
+    monkeypatch.setattr(changes, 'SETTLE_SECONDS', 0.2)
+    with engine.connect() as conn:
+        # seq 2 was rolled back, or is still being committed
+        for seq in (1, 3):
+            conn.execute(statements.changes.insert(), {'seq': seq, 'entity': changes.ENTITY_REVIEW,
+                                                       'entity_id': seq, 'op': changes.OP_CREATE,
+                                                       'created_at': time.time()})
+        conn.commit()
+
+        assert [entry['seq'] for entry in changes.read_changes(conn, 0, 10)] == [1]
+        assert changes.settled_seq(conn) == 1
+        time.sleep(0.3)
+        assert [entry['seq'] for entry in changes.read_changes(conn, 0, 10)] == [1, 3]
+        assert changes.settled_seq(conn) == 3
+
@@ -0,0 +1,22 @@
+from conftest import BUSINESS
+
+
+def post(client, path, peer, key='k1', **kwargs):
+    return client.post(path, json=BUSINESS, headers={'Idempotency-Key': key, 'X-Client-Id': 'shared'},
+                       environ_base={'REMOTE_ADDR': peer}, **kwargs)
+
+
+def test_keys_are_scoped_to_the_client(client):
+    first = post(client, '/businesses', '192.0.2.1')
+    assert first.status_code == 201
+    assert post(client, '/businesses', '192.0.2.1').get_json() == first.get_json()
+    # Same key and X-Client-Id from another address is another client's request
+    other = post(client, '/businesses', '192.0.2.2')
+    assert other.status_code == 201
+    assert other.get_json()['id'] != first.get_json()['id']
+
+
+def test_key_reused_for_another_request_is_rejected(client):
+    assert post(client, '/businesses', '192.0.2.1').status_code == 201
+    assert post(client, '/lodgings', '192.0.2.1').status_code == 422
+    assert post(client, '/businesses', '192.0.2.1', query_string={'x': 1}).status_code == 422
@@ -0,0 +1,82 @@
+import contextlib
+
+import pytest
+
+datastore = pytest.importorskip('google.cloud.datastore')
+from google.api_core.exceptions import Conflict  # noqa: E402
+
+import main1  # noqa: E402
+
+
+class FakeClient:
+    """Just enough of datastore.Client for POST /reviews, with aborts on demand."""
+
+    def __init__(self, conflicts=0, on_conflict=None):
+        self.entities = {}
+        # Commits to abort, and what the competing request does meanwhile
+        self.conflicts = conflicts
+        self.on_conflict = on_conflict
+        self.current_transaction = None
+        self._next_id = 1
+
+    def key(self, *path):
+        return datastore.Key(*path, project='test')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.current_transaction = pending = []
+        try:
+            yield
+            if self.conflicts:
+                self.conflicts -= 1
+                if self.on_conflict is not None:
+                    self.on_conflict(self)
+                raise Conflict('too much contention on these datastore entities')
+            for entity in pending:
+                if entity.key.is_partial:
+                    entity.key = entity.key.completed_key(self._next_id)
+                    self._next_id += 1
+                self.entities[entity.key] = entity
+        finally:
+            self.current_transaction = None
+
+    def get_multi(self, keys):
+        return [self.entities[key] for key in keys if key in self.entities]
+
+    def put_multi(self, entities):
+        self.current_transaction.extend(entities)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def use(client):
+        client.entities[client.key(main1.BUSINESSES, 1)] = datastore.Entity(key=client.key(main1.BUSINESSES, 1))
+        monkeypatch.setattr(main1, '_client', client)
+        monkeypatch.setattr(main1, '_client_pid', main1.os.getpid())
+        monkeypatch.setattr(main1.time, 'sleep', lambda seconds: None)
+        return main1.app.test_client()
+    return use
+
+
+REVIEW = {'user_id': 1, 'business_id': 1, 'stars': 4}
+
+
+def test_contention_is_retried(fake):
+    http = fake(FakeClient(conflicts=2))
+    assert http.post('/reviews', json=REVIEW).status_code == 201
+
+
+def test_lost_race_is_a_duplicate(fake):
+    def competing_review(client):
+        client.entities[main1.review_guard_key(client, 1, 1)] = datastore.Entity(
+            key=main1.review_guard_key(client, 1, 1))
+
+    http = fake(FakeClient(conflicts=1, on_conflict=competing_review))
+    assert http.post('/reviews', json=REVIEW).status_code == 409
+
+
+def test_lasting_contention_is_unavailable(fake):
+    http = fake(FakeClient(conflicts=main1.REVIEW_TRANSACTION_ATTEMPTS))
+    response = http.post('/reviews', json=REVIEW)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
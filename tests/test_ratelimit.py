@@ -0,0 +1,44 @@
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import ratelimit
+
+
+def make_app(trusted_peers=(), proxy_hops=0):
+    app = Flask(__name__)
+    ratelimit.install(app, limiter=ratelimit.RateLimiter(0.001, 1),
+                      identify=ratelimit.ClientIdentity(trusted_peers))
+    app.add_url_rule('/', 'index', lambda: 'ok')
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+    return app
+
+
+def get(client, client_id, peer, forwarded_for=None):
+    headers = {ratelimit.CLIENT_HEADER: client_id}
+    if forwarded_for:
+        headers['X-Forwarded-For'] = forwarded_for
+    return client.get('/', headers=headers, environ_base={'REMOTE_ADDR': peer}).status_code
+
+
+def test_client_id_from_untrusted_peer_is_ignored():
+    client = make_app(trusted_peers=['10.0.0.0/8']).test_client()
+    assert get(client, 'a', '192.0.2.1') == 200
+    assert get(client, 'b', '192.0.2.1') == 429
+    # Another address has a bucket of its own
+    assert get(client, 'b', '192.0.2.2') == 200
+
+
+def test_client_id_from_trusted_peer_names_the_client():
+    client = make_app(trusted_peers=['10.0.0.0/8']).test_client()
+    assert get(client, 'a', '10.0.0.1') == 200
+    assert get(client, 'b', '10.0.0.1') == 200
+    assert get(client, 'a', '10.0.0.2') == 429
+
+
+def test_forwarded_address_behind_proxy():
+    client = make_app(proxy_hops=1).test_client()
+    assert get(client, 'a', '10.0.0.1', forwarded_for='198.51.100.1') == 200
+    assert get(client, 'a', '10.0.0.1', forwarded_for='198.51.100.2') == 200
+    # A spoofed entry in front of the one the proxy appended changes nothing
+    assert get(client, 'b', '10.0.0.1', forwarded_for='203.0.113.9, 198.51.100.1') == 429
@@ -0,0 +1,87 @@
+import pytest
+import sqlalchemy
+
+import statements
+from review_writer import DuplicateReview, ReviewWriter
+
+
+def test_one_live_review_per_pair(engine):
+    review = {'user_id': 1, 'business_id': 1, 'stars': 5, 'review_text': None, 'created_at': 1.0}
+    with engine.connect() as conn:
+        conn.execute(statements.INSERT_REVIEW, parameters=review)
+        with pytest.raises(sqlalchemy.exc.IntegrityError) as error:
+            conn.execute(statements.INSERT_REVIEW, parameters=review)
+        assert statements.is_duplicate_review(error.value)
+        conn.rollback()
+
+        conn.execute(statements.INSERT_REVIEW, parameters=review)
+        conn.execute(statements.SOFT_DELETE_REVIEWS, parameters={'review_ids': [1], 'deleted_at': 2.0})
+        # A deleted review does not count
+        conn.execute(statements.INSERT_REVIEW, parameters=review)
+        conn.commit()
+
+
+def test_writers_in_two_processes_store_one_review(engine):
+    # Two workers each accept the same review; their claims cannot see each other
+    first, second = ReviewWriter(engine, max_delay=0.05), ReviewWriter(engine, max_delay=0.05)
+    for writer in (first, second):
+        writer.claim(1, 1)
+    first.claim(2, 1)
+    futures = [first.submit(1, 1, 5, 'twice'), second.submit(1, 1, 5, 'twice')]
+    other_user = first.submit(2, 1, 4, 'once')
+    for writer in (first, second):
+        writer.start()
+    for writer in (first, second):
+        writer.close()
+
+    stored = []
+    for future in futures:
+        try:
+            stored.append(future.result(timeout=0))
+        except DuplicateReview:
+            pass
+    assert len(stored) == 1
+    # Its batch mate was written all the same
+    assert other_user.result(timeout=0)
+    with engine.connect() as conn:
+        users = conn.execute(sqlalchemy.select(statements.reviews.c.user_id)).scalars().all()
+        dead_letters = conn.execute(sqlalchemy.select(sqlalchemy.func.count())
+                                    .select_from(statements.review_dead_letters)).scalar()
+    assert sorted(users) == [1, 2]
+    assert dead_letters == 0
+
+
+def test_writer_retries_while_the_database_is_down(engine, monkeypatch):
+    writer = ReviewWriter(engine, retry_delay=0.01)
+    write = writer._write
+    failures = []
+
+    def flaky(batch):
+        if len(failures) < 3:
+            failures.append(batch)
+            raise sqlalchemy.exc.OperationalError('INSERT', {}, Exception('server has gone away'))
+        return write(batch)
+
+    monkeypatch.setattr(writer, '_write', flaky)
+    writer.claim(1, 1)
+    future = writer.submit(1, 1, 5, None)
+    writer.start()
+    assert future.result(timeout=5)
+    writer.close()
+    assert len(failures) == 3
+
+
+def test_writer_dead_letters_a_bad_review_without_retrying(engine):
+    writer = ReviewWriter(engine, max_delay=0.05, retry_for=60)
+    for user_id in (1, 2):
+        writer.claim(user_id, 1)
+    good = writer.submit(1, 1, 5, None)
+    # Breaks the stars CHECK constraint
+    bad = writer.submit(2, 1, 9, None)
+    writer.start()
+    assert good.result(timeout=5)
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        bad.result(timeout=5)
+    writer.close()
+    with engine.connect() as conn:
+        assert conn.execute(sqlalchemy.select(statements.review_dead_letters.c.user_id)).scalars().all() == [2]
@@ -0,0 +1,75 @@
+import pytest
+import sqlalchemy
+
+import statements
+from sharding import ID_STRIDE, ShardedStore, ShardMap, rebalance
+
+
+def shards(tmp_path, count):
+    return [{'name': 's%d' % i, 'index': i, 'url': 'sqlite:///' + str(tmp_path / ('shard%d.db' % i))}
+            for i in range(count)]
+
+
+def test_rebalance_two_to_three_shards(tmp_path):
+    old = ShardMap(shards(tmp_path, 2))
+    store = ShardedStore(old)
+    store.create_tables()
+    business_ids = [store.create_business('b%d' % i, 's', i % 7, 'c', 'OR', 97000)['id'] for i in range(40)]
+    review_ids = [store.create_review(user_id, business_id, 4, 't')['id']
+                  for business_id in business_ids[:10] for user_id in range(3)]
+
+    new = ShardMap(shards(tmp_path, 3))
+    moving = ShardedStore(new, previous=old)
+    moving.create_tables()
+    assert rebalance(moving, batch_size=4) > 0
+    # Copies skip what is already there, so a rerun has nothing left to move
+    assert rebalance(moving, batch_size=4) == 0
+
+    store = ShardedStore(new)
+    for name, engine in store.engines.items():
+        with engine.connect() as conn:
+            for row in conn.execute(sqlalchemy.select(statements.businesses)):
+                assert new.ring.shard_for(row.owner_id) == name
+            for row in conn.execute(sqlalchemy.select(statements.reviews)):
+                assert new.ring.shard_for(row.business_id) == name
+    assert all(store.get_business(business_id) is not None for business_id in business_ids)
+    assert sorted(row.id for business_id in business_ids[:10]
+                  for row in store.business_reviews(business_id)) == sorted(review_ids)
+    # A review's business is usually on another shard
+    assert len(store.user_reviews(1)) == 10
+    assert all(store.get_review(review_id) is not None for review_id in review_ids)
+
+    listed, after = [], 0
+    while after is not None:
+        rows, after = store.list_businesses(after, 7)
+        listed += [row.id for row in rows]
+    assert listed == sorted(business_ids)
+
+
+def test_listing_skips_deleted_businesses(tmp_path):
+    store = ShardedStore(ShardMap(shards(tmp_path, 2)))
+    store.create_tables()
+    gone, kept = [store.create_business('b', 's', owner_id, 'c', 'OR', 97000)['id'] for owner_id in (1, 2)]
+    shard_name, _ = store.locate_business(gone)
+    with store.engines[shard_name].connect() as conn:
+        conn.execute(statements.TOMBSTONE_BUSINESS, parameters={'business_id': gone, 'deleted_at': 1.0})
+        conn.commit()
+    assert [row.id for row in store.list_businesses(0, 10)[0]] == [kept]
+
+
+def test_locations_are_bounded(tmp_path):
+    store = ShardedStore(ShardMap(shards(tmp_path, 2)), max_locations=3)
+    store.create_tables()
+    business_ids = [store.create_business('b', 's', owner_id, 'c', 'OR', 97000)['id'] for owner_id in range(10)]
+    assert list(store._business_location) == business_ids[-3:]
+    # Evicted ones are found by a scatter lookup
+    assert store.get_business(business_ids[0]) is not None
+
+
+@pytest.mark.parametrize('indexes', [[0, ID_STRIDE], [0, -1], [1, 1]])
+def test_map_rejects_indexes_that_can_collide(tmp_path, indexes):
+    config = shards(tmp_path, len(indexes))
+    for shard, index in zip(config, indexes):
+        shard['index'] = index
+    with pytest.raises(ValueError):
+        ShardMap(config)
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+import sqlalchemy
+
+import statements
+from conftest import BUSINESS
+
+pytest.importorskip('scipy')
+import similarity  # noqa: E402
+
+
+def similarities(engine):
+    with engine.connect() as conn:
+        return conn.execute(sqlalchemy.select(statements.business_similarities)
+                            .order_by('business_id', 'position')).fetchall()
+
+
+def test_cached_refresh_matches_full(client, engine, tmp_path, monkeypatch):
+    rng = random.Random(1)
+    cache = str(tmp_path / 'similarity.npz')
+    for _ in range(20):
+        assert client.post('/businesses', json=BUSINESS).status_code == 201
+
+    def post_reviews(n):
+        ids = []
+        for _ in range(n):
+            response = client.post('/reviews', json={'user_id': rng.randint(1, 100), 'business_id': rng.randint(1, 20),
+                                                     'stars': rng.randint(1, 5)})
+            if response.status_code == 201:
+                ids.append(response.get_json()['id'])
+        return ids
+
+    ids = post_reviews(400)
+    assert similarity.refresh(engine, cache=cache)[1]
+
+    ids += post_reviews(100)
+    for review_id in rng.sample(ids, 30):
+        client.put('/reviews/%d' % review_id, json={'stars': rng.randint(1, 5)})
+    for review_id in rng.sample(ids, 30):
+        client.delete('/reviews/%d' % review_id)
+    assert client.delete('/businesses/3').status_code == 204
+
+    def full_scan(*args):
+        raise AssertionError('read every rating')
+
+    with monkeypatch.context() as m:
+        m.setattr(similarity, 'load_ratings', full_scan)
+        assert not similarity.refresh(engine, cache=cache)[1]
+    cached = similarities(engine)
+
+    similarity.refresh(engine, full=True)
+    assert cached == similarities(engine)
+
+
+def test_similar_businesses_in_one_query(client, engine):
+    for _ in range(3):
+        assert client.post('/businesses', json=BUSINESS).status_code == 201
+    for user_id in (1, 2):
+        for business_id in (1, 2):
+            assert client.post('/reviews', json={'user_id': user_id, 'business_id': business_id,
+                                                 'stars': 5}).status_code == 201
+    similarity.refresh(engine)
+
+    queries = []
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', lambda *args: queries.append(args[2]))
+    assert [entry['id'] for entry in client.get('/businesses/1/similar').get_json()] == [2]
+    assert len(queries) == 1
+    assert client.get('/businesses/3/similar').get_json() == []
+    assert client.get('/businesses/4/similar').status_code == 404
+
+    assert client.delete('/businesses/2').status_code == 204
+    assert client.get('/businesses/1/similar').get_json() == []
+    assert client.get('/businesses/2/similar').status_code == 404
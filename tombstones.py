@@ -0,0 +1,66 @@
+"""Compaction of soft-deleted rows.
+
+With ``SOFT_DELETE`` on, deletes only set ``deleted_at``; the rows stay
+behind as tombstones until this job removes the ones older than the
+retention period. Rows go in batches of ``batch_size``, each batch its own
+short transaction, with an optional pause between batches so that
+compaction does not crowd out live traffic. A business is removed last,
+once its reviews are gone and no delete job is still working on it.
+
+Run it periodically, e.g. from cron:
+
+    python tombstones.py --retention-days 30 --pause-ms 50
+"""
+
+import time
+
+import statements
+
+# (table, select statement, delete statement, name of the ids parameter)
+_TABLES = (
+    ('reviews', statements.SELECT_EXPIRED_REVIEWS, statements.DELETE_REVIEWS, 'review_ids'),
+    ('lodgings', statements.SELECT_EXPIRED_LODGINGS, statements.DELETE_LODGINGS, 'lodging_ids'),
+    ('businesses', statements.SELECT_EXPIRED_BUSINESSES, statements.DELETE_BUSINESSES, 'business_ids'),
+)
+
+
+def compact(engine, horizon, batch_size=1000, pause=0.0):
+    """Delete tombstones with deleted_at < horizon. Returns the count per table."""
+    deleted = {}
+    for table, select_expired, delete_rows, ids_param in _TABLES:
+        deleted[table] = 0
+        while True:
+            with engine.connect() as conn:
+                ids = conn.execute(select_expired,
+                                   parameters={'horizon': horizon, 'limit': batch_size}).scalars().all()
+                if ids:
+                    conn.execute(delete_rows, parameters={ids_param: ids})
+                    conn.commit()
+            deleted[table] += len(ids)
+            if len(ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return deleted
+
+
+def main():
+    import argparse
+    import main as api
+
+    parser = argparse.ArgumentParser(description='Purge old soft-deleted rows.')
+    parser.add_argument('--retention-days', type=float, default=30,
+                        help='keep tombstones younger than this, so deletes can still be undone')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--pause-ms', type=float, default=0,
+                        help='sleep between batches to throttle the purge')
+    args = parser.parse_args()
+
+    engine = api.init_connection_pool()
+    deleted = compact(engine, time.time() - args.retention_days * 86400, args.batch_size, args.pause_ms / 1000)
+    for table, count in deleted.items():
+        print('deleted %d %s' % (count, table))
+
+
+if __name__ == '__main__':
+    main()